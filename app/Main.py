@@ -1,4 +1,5 @@
 import streamlit as st
+import util_funcs
 from PIL import Image
 
 st.image(Image.open('app/img/ileda.png'))
@@ -6,3 +7,5 @@ st.image(Image.open('app/img/ileda.png'))
 st.write('# ILEDA Hackathon')
 
 st.write('By Alexander Kostadinov and Veneta Kireva')
+
+util_funcs.filtered_data()
@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import compute_backend  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the compute backend shared by all dashboard sessions.')
+    parser.add_argument('--address', default=compute_backend.ADDRESS or 'localhost:6000',
+                        help='host:port to listen on (default: ILEDA_BACKEND_ADDRESS or localhost:6000)')
+    parser.add_argument('--data', default=os.environ.get('ILEDA_DATA_PATH', 'data/processed.csv'),
+                        help='processed.csv, or a Parquet file or directory to query out of core')
+    parser.add_argument('--workers', type=int, default=4, help='figures computed at the same time')
+    parser.add_argument('--queue', type=int, default=64, help='requests allowed to wait for a worker')
+    parser.add_argument('--queue-timeout', type=float, default=120, help='seconds a request may wait in the queue')
+    parser.add_argument('--warmup-workers', type=int, default=2, help='threads precomputing figures after a load')
+    args = parser.parse_args()
+
+    try:
+        authkey = compute_backend.create_authkey()
+    except PermissionError as error:
+        parser.error(str(error))
+
+    server = compute_backend.ComputeServer(args.data, args.workers, args.queue, args.queue_timeout,
+                                           args.warmup_workers)
+    print('Compute backend listening on ' + args.address)
+    if not os.environ.get('ILEDA_BACKEND_AUTHKEY'):
+        print('Clients authenticate with the key in ' + compute_backend.AUTHKEY_PATH)
+    server.serve_forever(args.address, authkey)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import query_backend  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert processed.csv into a Parquet dataset that the dashboard '
+                                                 'queries out of core (set ILEDA_DATA_PATH to the output directory).')
+    parser.add_argument('--csv', default='data/processed.csv', help='the CSV file to convert')
+    parser.add_argument('--output', default='data/processed.parquet', help='the directory to write the files to')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='rows per Parquet file')
+    args = parser.parse_args()
+
+    rows = query_backend.convert_csv(args.csv, args.output, args.chunksize)
+    print(f'Wrote {rows} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
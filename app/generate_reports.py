@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import reports, warmup  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the dashboard figures of every course and institution to a '
+                                                 'report directory (PNG, PDF, HTML and CSV files per report), '
+                                                 'skipping the reports whose inputs have not changed.')
+    parser.add_argument('--data', default=os.environ.get('ILEDA_DATA_PATH', 'data/processed.csv'),
+                        help='processed.csv, or a Parquet file or directory to query out of core')
+    parser.add_argument('--output', default='reports', help='the directory to write the reports to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: all CPUs)')
+    parser.add_argument('--metrics', nargs='+', choices=warmup.TIME_SERIES_METRICS, default=reports.DEFAULT_METRICS,
+                        help='the time series metrics to plot (default: both)')
+    parser.add_argument('--force', action='store_true', help='rebuild the reports whose inputs have not changed')
+    args = parser.parse_args()
+
+    summary = reports.generate(args.data, args.output, args.workers, args.metrics, args.force)
+    print(f"Built {summary['built']} reports ({summary['failed']} with errors), skipped {summary['skipped']} "
+          f"unchanged in {summary['seconds']:.1f}s")
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
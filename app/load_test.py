@@ -0,0 +1,171 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class PeakRss:
+    """
+    Sample the memory of the process on a background thread and keep the peak.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def run_session(path, reruns, seed, timeout):
+    """
+    Browse a page like a user: open it, then rerun it with random widget values.
+
+    Parameters:
+    - path (str): The path of the page script.
+    - reruns (int): The number of reruns after the page is opened.
+    - seed (int): The seed of the random widget values.
+    - timeout (float): The maximum duration of a rerun in seconds.
+
+    Returns:
+    - Tuple[List[float], List[str]]: The duration of every run in seconds, including the first one, and the errors.
+    """
+    from utils import page_driver
+
+    rng = np.random.default_rng(seed)
+    session = page_driver.new_session(path, timeout, concurrent=True)
+    latencies, errors = [], []
+
+    for run in range(reruns + 1):
+        if run > 0:
+            page_driver.randomize_widgets(session, rng)
+
+        start = time.perf_counter()
+        try:
+            session.run()
+        except RuntimeError as error:
+            errors.append(str(error))
+            break
+        latencies.append(time.perf_counter() - start)
+        errors.extend(exception.message for exception in session.exception)
+
+    return latencies, errors
+
+
+def load_page(path, sessions, reruns, seed, timeout):
+    """
+    Run concurrent sessions of a page and measure the rerun latency, the throughput and the peak memory.
+
+    Parameters:
+    - path (str): The path of the page script.
+    - sessions (int): The number of concurrent sessions.
+    - reruns (int): The number of reruns per session after the page is opened.
+    - seed (int): The seed of the first session; the other sessions use the following seeds.
+    - timeout (float): The maximum duration of a rerun in seconds.
+
+    Returns:
+    - dict: The number of runs and errors, the p50/p95/p99 latency in seconds, the throughput in runs per second and
+      the peak RSS in bytes.
+    """
+    with PeakRss() as rss, ThreadPoolExecutor(sessions) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(run_session, [path] * sessions, [reruns] * sessions,
+                                    range(seed, seed + sessions), [timeout] * sessions))
+        elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate([session_latencies for session_latencies, _ in results])
+    errors = [error for _, session_errors in results for error in session_errors]
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+
+    return {
+        'runs': len(latencies),
+        'errors': errors,
+        'p50': p50,
+        'p95': p95,
+        'p99': p99,
+        'throughput': len(latencies) / elapsed,
+        'peak_rss': rss.peak
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run concurrent simulated sessions on every page of the app.')
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent sessions per page')
+    parser.add_argument('--reruns', type=int, default=20, help='reruns per session after the page is opened')
+    parser.add_argument('--pages', nargs='*', help='only load these pages, e.g. "Time series"')
+    parser.add_argument('--events', type=int, default=100000, help='events in the synthetic dataset')
+    parser.add_argument('--data', help='use this dataset instead of a synthetic one')
+    parser.add_argument('--timeout', type=float, default=300, help='maximum duration of a rerun in seconds')
+    parser.add_argument('--warmup', action='store_true', help='warm up the figure cache before the first session')
+    parser.add_argument('--no-cache', action='store_true', help='disable the figure cache')
+    parser.add_argument('--csv', help='also write the results to this CSV file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.data is None:
+        from utils import synthetic
+        args.data = os.path.join(tempfile.mkdtemp(), 'processed.csv')
+        synthetic.generate_events(args.events, seed=args.seed).to_csv(args.data, index=False)
+
+    os.environ['ILEDA_DATA_PATH'] = args.data
+    os.environ['ILEDA_VISITS_PATH'] = os.path.join(tempfile.mkdtemp(), 'visits.json')
+    if not args.warmup:
+        os.environ['ILEDA_WARMUP_WORKERS'] = '0'
+    if args.no_cache:
+        os.environ['ILEDA_FIGURE_CACHE_BYTES'] = '0'
+
+    from utils import page_driver
+
+    paths = page_driver.list_pages()
+    if args.pages:
+        paths = [path for path in paths if page_driver.page_name(path) in args.pages]
+
+    if args.warmup:
+        from utils import warmup
+        page_driver.new_session(paths[0], args.timeout, concurrent=True).run()
+        while warmup.current() is not None and not warmup.current().status()['finished']:
+            time.sleep(1)
+
+    rows = []
+    print(f'{"Page":<24}{"Runs":>6}{"Errors":>8}{"p50 (s)":>9}{"p95 (s)":>9}{"p99 (s)":>9}{"Runs/s":>8}'
+          f'{"Peak RSS (MiB)":>16}')
+    for path in paths:
+        result = load_page(path, args.sessions, args.reruns, args.seed, args.timeout)
+        rows.append({'page': page_driver.page_name(path), **result, 'errors': len(result['errors'])})
+        print(f'{rows[-1]["page"]:<24}{result["runs"]:>6}{len(result["errors"]):>8}{result["p50"]:>9.2f}'
+              f'{result["p95"]:>9.2f}{result["p99"]:>9.2f}{result["throughput"]:>8.2f}'
+              f'{result["peak_rss"] / 1024 ** 2:>16.1f}')
+        for error in sorted(set(result['errors'])):
+            print('    ' + error)
+
+    if args.csv:
+        import pandas as pd
+        pd.DataFrame(rows).to_csv(args.csv, index=False)
+
+    sys.exit(1 if any(row['errors'] for row in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import gc
+import os
+import sys
+import tempfile
+
+import numpy as np
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def soak_page(path, runs, warmup, sample_every, rng):
+    """
+    Rerun a page many times in one session with random widget values and record the process memory.
+
+    Parameters:
+    - path (str): The path of the page script.
+    - runs (int): The number of measured reruns.
+    - warmup (int): The number of reruns before the baseline is taken.
+    - sample_every (int): The number of reruns between two memory samples.
+    - rng (np.random.Generator): The random generator.
+
+    Returns:
+    - Tuple[List[int], int]: The RSS samples in bytes (the first one is the baseline) and the number of open pyplot
+      figures at the end.
+    """
+    from matplotlib import pyplot as plt
+    from utils import page_driver
+
+    process = psutil.Process()
+    session = page_driver.new_session(path).run()
+
+    samples = []
+    for run in range(warmup + runs):
+        if run >= warmup and (run - warmup) % sample_every == 0:
+            gc.collect()
+            samples.append(process.memory_info().rss)
+
+        page_driver.randomize_widgets(session, rng)
+        session.run()
+        if session.exception:
+            raise RuntimeError(page_driver.page_name(path) + ': ' + session.exception[0].message)
+
+    gc.collect()
+    samples.append(process.memory_info().rss)
+    return samples, len(plt.get_fignums())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rerun every page of the app and check that memory stays flat.')
+    parser.add_argument('--runs', type=int, default=2000, help='measured reruns per page')
+    parser.add_argument('--warmup', type=int, default=50, help='reruns per page before the baseline is taken')
+    parser.add_argument('--sample-every', type=int, default=100, help='reruns between two memory samples')
+    parser.add_argument('--events', type=int, default=20000, help='events in the synthetic dataset')
+    parser.add_argument('--data', help='use this dataset instead of a synthetic one')
+    parser.add_argument('--max-growth', type=float, default=20.0, help='allowed RSS growth per page in MiB')
+    parser.add_argument('--keep-cache', action='store_true', help='keep the figure cache enabled')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.data is None:
+        from utils import synthetic
+        args.data = os.path.join(tempfile.mkdtemp(), 'processed.csv')
+        synthetic.generate_events(args.events, seed=args.seed).to_csv(args.data, index=False)
+
+    os.environ['ILEDA_DATA_PATH'] = args.data
+    os.environ['ILEDA_VISITS_PATH'] = os.path.join(tempfile.mkdtemp(), 'visits.json')
+    os.environ['ILEDA_WARMUP_WORKERS'] = '0'
+    if not args.keep_cache:
+        os.environ['ILEDA_FIGURE_CACHE_BYTES'] = '0'
+
+    from utils import page_driver
+
+    rng = np.random.default_rng(args.seed)
+    failed = False
+
+    print(f'{"Page":<24}{"Baseline (MiB)":>16}{"Final (MiB)":>14}{"Growth (MiB)":>14}{"Figures":>9}')
+    for path in page_driver.list_pages():
+        samples, open_figures = soak_page(path, args.runs, args.warmup, args.sample_every, rng)
+        growth = (samples[-1] - samples[0]) / 1024 ** 2
+        failed = failed or growth > args.max_growth or open_figures > 0
+        print(f'{page_driver.page_name(path):<24}{samples[0] / 1024 ** 2:>16.1f}{samples[-1] / 1024 ** 2:>14.1f}'
+              f'{growth:>14.1f}{open_figures:>9}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import streamlit as st
+import util_funcs
+from utils import compute_backend, figure_cache, versioning, warmup
+
+util_funcs.load_data()
+
+st.markdown('# Cache Status')
+
+st.markdown('This page shows the progress of the background warm-up, which precomputes the figures of every course '
+            'and institution after a deploy or a data refresh, and the usage of the shared figure cache.')
+
+client = util_funcs.get_compute_client()
+backend = None
+
+if client is not None:
+    st.markdown('## Compute backend')
+    try:
+        backend = client.status()
+    except ConnectionError:
+        st.warning(f'The compute backend at {compute_backend.ADDRESS} cannot be reached; figures are computed by '
+                   f'this server process.')
+    else:
+        col1, col2 = st.columns(2)
+        col1.metric('Computations in flight', backend['in_flight'])
+        col2.metric('Requests running or queued', f"{backend['pending']} / "
+                                                  f"{backend['max_workers'] + backend['max_queue']}")
+
+st.markdown('## Warm-up')
+
+scheduler = warmup.current()
+
+if backend is not None:
+    status = backend['warmup']
+elif scheduler is not None:
+    status = scheduler.status()
+else:
+    status = None
+
+if status is None:
+    st.info('No warm-up has been started yet.')
+else:
+    st.progress(status['done'] / status['total'] if status['total'] else 1.0,
+                text=f"{status['done']} of {status['total']} figures precomputed in {status['elapsed']:.0f} s")
+    st.markdown(f"**Data version:** `{status['version']}`")
+
+    if status['running']:
+        st.markdown('**Running:** ' + ', '.join(status['running']))
+
+    if status['errors']:
+        with st.expander(f"Show failed tasks ({len(status['errors'])})"):
+            st.dataframe({'Task': [task for task, _ in status['errors']],
+                          'Error': [error for _, error in status['errors']]}, use_container_width=True)
+
+st.markdown('## Figure cache')
+
+stats = figure_cache.figure_cache.stats() if backend is None else backend['cache']
+requests = stats['hits'] + stats['misses']
+
+col1, col2, col3 = st.columns(3)
+col1.metric('Entries', stats['entries'])
+col2.metric('Memory', f"{stats['bytes'] / 1024 ** 2:.1f} / {stats['max_bytes'] / 1024 ** 2:.0f} MiB")
+col3.metric('Hit rate', f"{stats['hits'] / requests:.0%}" if requests else '-')
+
+st.markdown('## Data versions')
+
+st.markdown('The version of every dataset and derived table, a hash of its content and schema, and the versions of '
+            'the inputs derived tables were computed from. Stale tables were computed from older inputs.')
+
+versions = versioning.get_registry().status()
+if versions['Stale'].any():
+    st.warning(f"{versions['Stale'].sum()} derived tables are stale: " + ', '.join(versions['Path'][versions['Stale']]))
+st.dataframe(versions, hide_index=True, use_container_width=True)
+
+if status is not None and not status['finished']:
+    st.button('Refresh')
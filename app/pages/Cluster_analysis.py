@@ -1,8 +1,8 @@
 import streamlit as st
 import util_funcs
-from utils import clustering
+from utils import clustering, versioning
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Cluster Analysis ')
 
@@ -11,15 +11,22 @@ st.markdown('This module performs clustering analysis on course data using K-mea
 
 course = st.selectbox(
     "Select a course",
-    df['Course'].drop_duplicates().tolist(),
+    util_funcs.get_names(df, util_funcs.filtered_version(), 'Course'),
     placeholder="Enter course name here...",
 )
 
-fig1, fig2 = clustering.cluster(course, 3)
+util_funcs.record_visit('Cluster analysis', course)
+
+stale = versioning.get_registry().stale_parents(clustering.clustering_path(course))
+if stale:
+    st.warning('The clustering features of this course were computed from an older version of '
+               + ', '.join(stale) + '. Compute them again and register them with register_data.py.')
+
+fig1, fig2 = util_funcs.cached_figures(clustering.cluster, course, 3)
 
 if fig1 is not None:
-    st.plotly_chart(fig1)
+    util_funcs.show_figure(fig1)
 
 if fig2 is not None:
     st.write('**Main PCA features - composition:**')
-    st.pyplot(fig2)
+    util_funcs.show_figure(fig2)
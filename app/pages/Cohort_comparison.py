@@ -0,0 +1,85 @@
+import pandas as pd
+import streamlit as st
+import util_funcs
+from utils import cohorts
+
+df = util_funcs.filtered_data()
+
+st.markdown('# Cohort Comparison')
+
+st.markdown('This module compares two groups of students on dozens of metrics at once: interaction counts per verb '
+            'and object type, activity, scores, success and completion rates and study sessions. Differences are '
+            'tested with bootstrap confidence intervals and permutation tests, and the p-values are adjusted for the '
+            'number of metrics compared.')
+
+version = util_funcs.filtered_version()
+first, last = util_funcs.get_time_bounds(df, version)
+teaching = util_funcs.get_names(df, version, 'Teaching')
+
+
+def cohort_filter(column, label, default_teaching):
+    """
+    Show the filter of a cohort.
+
+    Parameters:
+    - column: The Streamlit column to show the filter in.
+    - label (str): The name of the cohort, 'A' or 'B'.
+    - default_teaching (str): The teaching type selected by default.
+
+    Returns:
+    - dict: The filter of the events of the cohort (see QueryBackend).
+    """
+    column.markdown('**Cohort ' + label + '**')
+    where = {}
+    for name, options, default in [
+        ('Teaching', teaching, [default_teaching] if default_teaching in teaching else []),
+        ('Institution', util_funcs.get_names(df, version, 'Institution'), []),
+        ('Course', util_funcs.get_names(df, version, 'Course'), [])
+    ]:
+        selected = column.multiselect(name, options, default, key='cohort_' + label + '_' + name,
+                                      placeholder='Any')
+        if selected:
+            where[name] = selected if len(selected) > 1 else selected[0]
+
+    if column.checkbox('Restrict the dates', key='cohort_' + label + '_dates'):
+        dates = column.date_input('From - to', (first.date(), last.date()), first.date(), last.date(),
+                                  key='cohort_' + label + '_range')
+        if len(dates) == 2:
+            where['timestamp'] = slice(pd.Timestamp(dates[0]), pd.Timestamp(dates[1]) + pd.Timedelta(days=1))
+    return where
+
+
+col1, col2 = st.columns(2)
+where_a = cohort_filter(col1, 'A', 'Flipped classroom')
+where_b = cohort_filter(col2, 'B', 'Project-based')
+
+n_resamples = st.select_slider('Number of resamples', [500, 1000, 2000, 5000, 10000], cohorts.DEFAULT_RESAMPLES)
+
+if where_a == where_b:
+    st.warning('The two cohorts are the same. Change one of the filters.')
+    st.stop()
+
+result, figure = util_funcs.cached_figures(cohorts.display, df, where_a, where_b, n_resamples)
+
+if figure is None:
+    st.info('Each cohort needs at least two students.')
+    st.stop()
+
+st.markdown('**A:** ' + cohorts.describe(where_a) + '  \n**B:** ' + cohorts.describe(where_b))
+
+col1, col2, col3 = st.columns(3)
+col1.metric('Students in A', int(result['Actors A'].max()))
+col2.metric('Students in B', int(result['Actors B'].max()))
+col3.metric('Significant differences', int((result['Adjusted p-value'] < 0.05).sum()))
+
+st.markdown('## Effect Sizes')
+
+st.markdown("Hedges' g is the difference of the means in pooled standard deviations (about 0.2 is small, 0.5 medium "
+            'and 0.8 large), with its 95% bootstrap interval. Red metrics differ significantly after adjusting for '
+            'the number of metrics.')
+
+util_funcs.show_figure(figure)
+
+st.markdown('## All Metrics')
+
+st.dataframe(result, use_container_width=True)
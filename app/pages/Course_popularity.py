@@ -2,22 +2,38 @@ import streamlit as st
 import util_funcs
 from utils import course_popularity
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Course Popularity')
 
 st.markdown('This module aims to analyze the popularity of courses within the dataset, providing insights into user '
             'interactions and engagement patterns.')
 
-fig1, fig2, fig3 = course_popularity.course_popularity(df)
+approximate = util_funcs.approximate_mode()
+
+statistics = util_funcs.get_popularity_statistics(df, util_funcs.filtered_version(), approximate)
+
+ready = util_funcs.parallel_figures({
+    'pie': (course_popularity.get_interaction_pie, df, approximate),
+    'boxplot': (course_popularity.get_interaction_boxplot, df, approximate),
+    'scatter': (course_popularity.get_median_scatter, df, approximate)
+}, statistics=statistics)
+
+if approximate:
+    st.caption('The numbers of students and the interaction counts per person are estimated from sketches (about 2% '
+               'error for the numbers of students, 1% rank error for the medians and boxes); outliers are not shown.')
 
 st.markdown('**Distribution of user interactions across courses:**')
-st.pyplot(fig1)
+slots = {'pie': st.empty()}
 
 st.markdown('**Distribution of user interactions by course:**')
-st.pyplot(fig2)
+slots['boxplot'] = st.empty()
 
 st.markdown('**Median interaction count per person vs the number of students enrolled in each course:**')
 st.markdown(':star: Flipped classroom course')
 st.markdown(':white_circle: Project-based course')
-st.pyplot(fig3)
+slots['scatter'] = st.empty()
+
+for key, figure in ready:
+    with slots[key]:
+        util_funcs.show_figure(figure)
@@ -2,17 +2,39 @@ import streamlit as st
 import util_funcs
 from utils import network_analysis
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Network Analysis')
 
-figure, data = network_analysis.get_network(df)
+st.markdown('This module generates a visualization of the flow of interactions from institutions to courses, '
+            'the types of objects interacted with and the verbs used. Each category is represented by a node, and the '
+            'interactions are represented by links between the nodes.')
 
-st.markdown('This module generates a visualization of the number of interactions per course and the types '
-            'of interactions. Each course is represented by a node, and the interactions are represented by links '
-            'between the nodes.')
+level_names = {
+    'Institution': 'Institution',
+    'Course': 'Course',
+    'object.definition.type': 'Object type',
+    'verb.id': 'Verb'
+}
 
-st.plotly_chart(figure, use_container_width=True)
+levels = st.multiselect(
+    'Select the levels of the diagram',
+    network_analysis.SANKEY_LEVELS,
+    network_analysis.SANKEY_LEVELS,
+    format_func=level_names.get
+)
+
+top_k = st.slider('Maximum number of nodes per level', 2, 30, 10)
+
+levels = [level for level in network_analysis.SANKEY_LEVELS if level in levels]
+
+figure, data = util_funcs.cached_figures(
+    network_analysis.get_network, df, levels if len(levels) >= 2 else None, top_k)
+
+if len(levels) < 2:
+    st.warning('Select at least two levels. Showing all levels instead.')
+
+util_funcs.show_figure(figure, use_container_width=True)
 
 st.markdown('## Data Display')
 
@@ -31,3 +53,22 @@ st.dataframe(
     data[data['Course'].isin(courses) & data['Interaction with'].isin(interactions)],
     use_container_width=True
 )
+
+st.markdown('## Interaction Graph')
+
+st.markdown('Actors are linked to the resources they interact with and to each other through the resources they '
+            'share. Centrality scores show the most connected actors and resources, and clusters group actors who '
+            'engage with the same resources, leaving out the resources used by most of the actors of their course.')
+
+min_shared = st.slider('Minimum number of shared resources to link two actors', 1, 10, 2)
+
+actors_df, resources_df, clusters_df = util_funcs.get_interaction_graph(df, util_funcs.filtered_version(), min_shared)
+
+st.markdown('**Most central actors:**')
+st.dataframe(actors_df.head(20), use_container_width=True)
+
+st.markdown('**Most connected resources per course:**')
+st.dataframe(resources_df, use_container_width=True)
+
+st.markdown('**Co-engagement clusters:**')
+st.dataframe(clusters_df, use_container_width=True)
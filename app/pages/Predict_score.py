@@ -2,22 +2,31 @@ import streamlit as st
 import util_funcs
 from utils import linear_regression
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Linear Regression Results')
 
-fig1, fig2, results = linear_regression.regression(df)
-
 st.markdown('This module conducts a regression analysis on a given dataset, employing the scikit-learn library for '
             'linear regression.')
 
+mode = st.radio('Training mode', ['In memory', 'Streaming'], horizontal=True,
+                help='Streaming trains on batches of sparse actor features with stochastic gradient descent, so the '
+                     'memory stays bounded for any number of actors, and updates the model when new events arrive.')
+
+if mode == 'Streaming':
+    st.caption('Features include the interaction counts per course, object type and verb, hashed into a fixed number '
+               'of columns. A fixed fifth of the actors is held out for the results.')
+    fig1, fig2, results = util_funcs.cached_figures(linear_regression.streaming_regression, df)
+else:
+    fig1, fig2, results = util_funcs.cached_figures(linear_regression.regression, df)
+
 if fig1 is not None:
     st.markdown('**Correlation of the dataset features:**')
-    st.pyplot(fig1)
+    util_funcs.show_figure(fig1)
 
 st.markdown('**Achieved linear regression results:**')
 st.markdown(results)
 
 if fig2 is not None:
     st.markdown('**Feature weights:**')
-    st.pyplot(fig2)
+    util_funcs.show_figure(fig2)
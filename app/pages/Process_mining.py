@@ -0,0 +1,67 @@
+import streamlit as st
+import util_funcs
+from utils import process_mining
+
+df = util_funcs.filtered_data()
+
+st.markdown('# Process Mining')
+
+st.markdown('This module looks at the order of the actions within study sessions: which action usually follows '
+            'which, the most common sequences of actions and how long students stay on each action before the next '
+            'one.')
+
+state_names = {'verb.id': 'Verbs', 'object.definition.type': 'Object types'}
+
+column = st.radio('Analyze the sequence of', list(state_names), format_func=state_names.get, horizontal=True)
+
+scope = st.selectbox('Select the events', ['All data', 'Institution', 'Course', 'Actor'])
+
+name = None
+if scope == 'Actor':
+    name = util_funcs.select_actor(df)
+    if name is None:
+        st.stop()
+    name = int(name)
+elif scope != 'All data':
+    name = st.selectbox(
+        f'Select {scope.lower()}',
+        util_funcs.get_names(df, util_funcs.filtered_version(), scope),
+        placeholder=f'Enter {scope.lower()} name here...',
+    )
+    util_funcs.record_visit('Process mining', name)
+
+length = st.slider('Length of the common paths', 2, 5, 3)
+
+figure, paths, dwell = util_funcs.cached_figures(process_mining.display, df, column, name, length)
+
+if figure is None:
+    st.info('There are no events to analyze.')
+    st.stop()
+
+st.markdown('## Transition Probabilities')
+
+st.markdown('Each row gives the probability of the next action of a session after the action of the row, from the '
+            'start of the session to its end. Hover over a cell to see the number of transitions.')
+
+util_funcs.show_figure(figure, use_container_width=True)
+
+if scope == 'Actor':
+    st.markdown('## Compared with the Course')
+
+    st.markdown('The transitions whose probability differs most between this actor and the actors of their course.')
+
+    st.dataframe(util_funcs.cached_figures(process_mining.compare_actor, df, column, name), hide_index=True,
+                 use_container_width=True)
+
+st.markdown('## Common Paths')
+
+st.markdown('Repeated actions are counted once, so a path shows a change of action at every step.')
+
+st.dataframe(paths, hide_index=True, use_container_width=True)
+
+st.markdown('## Dwell Times')
+
+st.markdown('The time from an action to the next action of the same session. The last action of a session has no '
+            'dwell time; the share of actions ending a session is shown instead.')
+
+st.dataframe(dwell, use_container_width=True)
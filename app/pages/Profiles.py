@@ -0,0 +1,62 @@
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+from utils import profiling
+
+st.markdown('# Profiles')
+
+st.markdown('Open any page with `?profile=1` added to its address (or `?profile=memory` to also trace memory '
+            'allocations) to record a sampling profile of that run, from loading the data to rendering the figures. '
+            'Setting the ILEDA_PROFILE environment variable to `cpu` or `memory` profiles every run.')
+
+profiles = profiling.list_profiles()
+
+if not profiles:
+    st.info('No profiles have been recorded yet.')
+    st.stop()
+
+summaries = {path: profiling.load_summary(path) for path in profiles}
+path = st.selectbox(
+    'Select profile',
+    profiles,
+    format_func=lambda path: f"{summaries[path]['name']} at "
+                             f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summaries[path]['started']))} "
+                             f"({summaries[path]['duration']:.2f} s)"
+)
+summary = summaries[path]
+
+col1, col2, col3 = st.columns(3)
+col1.metric('Duration', f"{summary['duration']:.2f} s")
+col2.metric('Samples', summary['samples'])
+col3.metric('Interval', f"{summary['interval'] * 1000:.0f} ms")
+
+st.markdown('## Flame Graph')
+
+st.markdown('Every box is a function and its width is the share of the run spent in it or in the functions it called '
+            '(shown below it). Click a box to zoom in.')
+
+st.plotly_chart(profiling.flame_graph(path), use_container_width=True)
+
+col1, col2 = st.columns(2)
+with open(path + '.speedscope.json', 'rb') as file:
+    col1.download_button('Download for speedscope.app', file.read(), os.path.basename(path) + '.speedscope.json',
+                         'application/json')
+with open(path + '.folded', 'rb') as file:
+    col2.download_button('Download folded stacks', file.read(), os.path.basename(path) + '.folded', 'text/plain')
+
+st.markdown('## Top Functions')
+
+for key, title in [('total', 'Including callees'), ('self', 'In the function itself')]:
+    st.markdown('**' + title + '**')
+    top = pd.DataFrame(summary[key])
+    if not top.empty:
+        top.insert(3, 'seconds', top['samples'] * summary['interval'])
+    st.dataframe(top, hide_index=True, use_container_width=True)
+
+if summary.get('memory') is not None:
+    st.markdown('## Memory')
+
+    st.metric('Peak traced memory', f"{summary['memory']['peak'] / 1024 ** 2:.1f} MiB")
+    st.dataframe(pd.DataFrame(summary['memory']['growth']), hide_index=True, use_container_width=True)
@@ -1,11 +1,11 @@
 import streamlit as st
 import util_funcs
-from utils import actor_engagement
+from utils import actor_engagement, early_warning, sessions, sketches
 
 if 'viz_type' not in st.session_state:
     st.session_state.viz_type = 'Course'
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Student Engagement')
 
@@ -19,31 +19,102 @@ st.radio(
 )
 
 selected = None
+approximate = False
 
 if st.session_state.viz_type in ['Course', 'Institution']:
     selected = st.selectbox(
         "Filter by " + st.session_state.viz_type.lower(),
-        (df['Course'].drop_duplicates().tolist() if st.session_state.viz_type == 'Course'
-         else df['Institution'].drop_duplicates().tolist()),
+        util_funcs.get_names(df, util_funcs.filtered_version(), st.session_state.viz_type),
         placeholder="Select " + st.session_state.viz_type.lower() + '...',
     )
 else:
-    selected = st.slider(
-        'Select actor index...',
-        0,
-        df['actor.id'].max(),
-        466
-    )
+    selected = util_funcs.select_actor(df)
+
+if st.session_state.viz_type in ['Course', 'Institution']:
+    util_funcs.record_visit('Student engagement', selected)
+    approximate = util_funcs.approximate_mode()
+
+if selected is None:
+    st.stop()
+
+by_group = st.session_state.viz_type in ['Course', 'Institution']
+
+calls = {'engagement': (actor_engagement.display, df, selected, approximate), 'sessions': (sessions.display, df, selected)}
+if by_group:
+    calls['early_warning'] = (early_warning.display, df, selected)
+ready = util_funcs.parallel_figures(calls)
+
+slots = {'engagement': st.empty()}
+
+if approximate:
+    store = sketches.get_store(df)
+    selection = (st.session_state.viz_type, selected, *sketches.date_range(df))
+    q1, median, q3 = store.score_sketch(*selection).quantile([0.25, 0.5, 0.75])
+    st.caption(f'About {store.distinct_actors(*selection, engaged=True):.0f} students and '
+               f'{store.count_events(*selection)} events; score quartiles {q1:.2f}, {median:.2f}, {q3:.2f} '
+               f'(estimated from sketches).')
+
+slots['details'] = st.empty()
+
+st.markdown('## Study Sessions')
+
+st.markdown('Events of the same actor and course less than 30 minutes apart are grouped into a study session.')
+
+slots['sessions'] = st.empty()
+
+if by_group:
+    st.markdown('## Early Warning')
+
+    st.markdown('Actors are ranked by a risk score combining their activity and assessment attempts over the last 7, '
+                '14 and 28 days compared to the rest of the ' + st.session_state.viz_type.lower() + ', the drop of '
+                'their activity in the last week and the trend of their scores.')
+
+    slots['early_warning'] = st.empty()
+else:
+    st.markdown('## Similar Students')
+
+    st.markdown('The students closest to this one across all courses by their numbers of actions per object type and '
+                'verb, their scores per object type, their course and its teaching type. The features are '
+                'standardized, so each one weighs the same.')
+
+    index = util_funcs.get_similarity_index(df, util_funcs.filtered_version())
+    k = st.slider('Number of similar students', 5, 50, 10)
+    st.dataframe(index.query(selected, k), hide_index=True, use_container_width=True)
+
+for key, result in ready:
+    if key == 'engagement':
+        treemap, bars, ranking = result
+
+        if treemap is not None:
+            with slots['engagement']:
+                util_funcs.show_figure(treemap)
+
+        with slots['details'].container():
+            if bars is not None:
+                with st.expander('Show scores'):
+                    util_funcs.show_figure(bars)
+
+            if ranking is not None:
+                with st.expander('Show students per course' if by_group else 'Show ranking'):
+                    util_funcs.show_figure(ranking)
+
+    elif key == 'sessions':
+        summary, hours, _ = result
+
+        with slots['sessions'].container():
+            util_funcs.show_session_summary(summary, per_actor=by_group)
 
-treemap, bars, ranking = actor_engagement.display(df, selected)
+            if hours is not None:
+                util_funcs.show_figure(hours)
 
-if treemap is not None:
-    st.plotly_chart(treemap)
+    else:
+        at_risk, risk = result
 
-if bars is not None:
-    with st.expander('Show scores'):
-        st.pyplot(bars)
+        with slots['early_warning'].container():
+            if at_risk.empty:
+                st.info('No actors to rank.')
+            else:
+                st.dataframe(at_risk, hide_index=True)
 
-if ranking is not None:
-    with st.expander('Show ranking'):
-        st.plotly_chart(ranking)
+            if risk is not None:
+                util_funcs.show_figure(risk)
@@ -1,8 +1,8 @@
 import streamlit as st
 import util_funcs
-from utils import time_series
+from utils import forecasting, sessions, time_series
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Time Series Analysis')
 
@@ -11,7 +11,7 @@ st.markdown('This module contains functions for analyzing and visualizing time s
 
 course = st.selectbox(
     "Select a course",
-    df['Course'].drop_duplicates().tolist(),
+    util_funcs.get_names(df, util_funcs.filtered_version(), 'Course'),
     placeholder="Enter course name here...",
 )
 
@@ -21,14 +21,85 @@ display_type = st.selectbox(
     placeholder="Enter assignment type here...",
 )
 
-st.pyplot(time_series.analyze_time_series(
-    df,
-    course,
-    util_funcs.text_to_display(display_type)
-))
-
-st.pyplot(time_series.display_course_or_institution_actions(
-    df,
-    course,
-    util_funcs.text_to_display(display_type)
-))
+util_funcs.record_visit('Time series', course)
+
+metric = util_funcs.text_to_display(display_type)
+
+ready = util_funcs.parallel_figures({
+    'autocorrelation': (time_series.analyze_time_series, df, course, metric),
+    'timeline': (time_series.display_course_or_institution_actions, df, course, metric),
+    'forecast': (forecasting.next_week, df),
+    'forecast_figure': (forecasting.display, df, course, metric),
+    'sessions': (sessions.display, df, course)
+})
+
+slots = {'autocorrelation': st.empty(), 'timeline': st.empty()}
+
+st.markdown('## Next Week')
+
+st.markdown('A trend and a weekly pattern fitted to the daily counts, with recent weeks weighing most, predict the '
+            'activity of the seven days after the last day of the data. The band shows the usual spread around the '
+            'prediction.')
+
+slots['forecast'] = st.empty()
+
+st.markdown('## Study Sessions')
+
+st.markdown('Events of the same actor and course less than 30 minutes apart are grouped into a study session.')
+
+slots['sessions'] = st.empty()
+
+
+def show_forecast(forecast, figure):
+    """
+    Show the forecast of the selected course.
+
+    Parameters:
+    - forecast (pd.DataFrame): The forecast of every course and institution (see forecasting.next_week).
+    - figure (RenderedFigure or None): The forecast of the course and its recent activity.
+    """
+    predicted = forecast[(forecast['Level'] == 'Course') & (forecast['Name'] == course)]
+
+    if predicted.empty:
+        st.info('There is no activity to forecast.')
+        return
+
+    col1, col2 = st.columns(2)
+    col1.metric('Graded assignments', int(predicted['assessments'].iloc[0]))
+    col2.metric('Non-graded activities', int(predicted['non_assessments'].iloc[0]))
+
+    util_funcs.show_figure(figure)
+
+    with st.expander('Show the forecast of every course and institution'):
+        st.dataframe(forecast, hide_index=True, use_container_width=True)
+
+
+def show_sessions(summary, hours, daily):
+    """
+    Show the study sessions of the selected course.
+
+    Parameters:
+    - summary (dict): The session metrics (see sessions.display).
+    - hours (RenderedFigure or None): The time-of-day profile.
+    - daily (RenderedFigure or None): The number of sessions per day.
+    """
+    util_funcs.show_session_summary(summary)
+
+    if daily is not None:
+        util_funcs.show_figure(daily)
+        with st.expander('Show time of day'):
+            util_funcs.show_figure(hours)
+
+
+results = {}
+for key, result in ready:
+    results[key] = result
+    if key in ['autocorrelation', 'timeline']:
+        with slots[key]:
+            util_funcs.show_figure(result)
+    elif key == 'sessions':
+        with slots['sessions'].container():
+            show_sessions(*result)
+    elif 'forecast' in results and 'forecast_figure' in results:
+        with slots['forecast'].container():
+            show_forecast(results['forecast'], results['forecast_figure'])
@@ -2,21 +2,56 @@ import streamlit as st
 import util_funcs
 from utils import verbs
 
-df = util_funcs.load_data()
+df = util_funcs.filtered_data()
 
 st.markdown('# Verbs')
 
 st.markdown('This module contains visualizations for analyzing interactions within the learning platform dataset, '
             'focusing on verbs, courses, and their relationships.')
 
-lollipop_fig = verbs.get_verb_lollipop(df)
-radar_fig_course = verbs.get_verb_radar_course(df)
-radar_fig_verb = verbs.get_verb_radar_verb(df)
+table = util_funcs.get_contingency_table(df, util_funcs.filtered_version())
 
-st.pyplot(lollipop_fig)
+ready = util_funcs.parallel_figures({
+    'lollipop': (verbs.get_verb_lollipop, df),
+    'radar_course': (verbs.get_verb_radar_course, df),
+    'radar_verb': (verbs.get_verb_radar_verb, df)
+}, table=table)
+
+slots = {'lollipop': st.empty()}
 
 with st.expander('Show the verb(s) associated with each course'):
-    st.plotly_chart(radar_fig_course, use_container_width=True)
+    slots['radar_course'] = st.empty()
 
 with st.expander('Show the course(s) associated with each verb'):
-    st.plotly_chart(radar_fig_verb, use_container_width=True)
+    slots['radar_verb'] = st.empty()
+
+st.markdown('## Independence Analysis')
+
+st.markdown('A chi-square test checks whether the verbs used depend on the course. Standardized residuals beyond ±2 '
+            'mark the verb-course combinations that occur significantly more (red) or less (blue) often than expected.')
+
+hypothesis = st.radio(
+    'Null hypothesis',
+    ['independence', 'uniform'],
+    format_func={
+        'independence': 'Verbs and courses are independent',
+        'uniform': 'Each verb is uniformly distributed across courses'
+    }.get
+)
+
+alpha = 0.01
+
+(chi_squared, dof, p), per_course, residuals = verbs.chi_square_test(table, hypothesis)
+
+st.markdown(f'**Chi-squared:** {chi_squared:.2f} (degrees of freedom: {dof}, p-value: {p:.4g}, '
+            f'reject the null hypothesis at α = {alpha}: {p < alpha})')
+
+st.plotly_chart(verbs.get_residual_heatmap(residuals), use_container_width=True)
+
+with st.expander('Show the test for each course'):
+    st.dataframe(per_course.assign(**{'Reject the null hypothesis': per_course['p-value'] < alpha}),
+                 use_container_width=True)
+
+for key, figure in ready:
+    with slots[key]:
+        util_funcs.show_figure(figure, **({} if key == 'lollipop' else {'use_container_width': True}))
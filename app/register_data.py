@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import versioning  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Register datasets and derived tables in the version registry, with '
+                                                 'the inputs they were computed from, and list the stale ones.')
+    parser.add_argument('paths', nargs='*',
+                        help='the files to register; the files of a directory are registered one by one')
+    parser.add_argument('--derived-from', nargs='+', default=[], metavar='PATH',
+                        help='the datasets or tables the files were computed from, e.g. data/processed.csv')
+    args = parser.parse_args()
+
+    registry = versioning.get_registry()
+    for path in args.paths:
+        files = sorted(entry.path for entry in os.scandir(path) if entry.is_file()) if os.path.isdir(path) else [path]
+        for file in files:
+            entry = registry.record(file, args.derived_from)
+            print(f"{file}: {entry['version']}" + ''.join(f' <- {parent} {version}'
+                                                          for parent, version in sorted(entry['parents'].items())))
+
+    status = registry.status()
+    stale = status['Path'][status['Stale']].tolist()
+    if stale:
+        print(f'{len(stale)} stale: ' + ', '.join(stale))
+    sys.exit(1 if stale else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import synthetic  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def events():
+    return synthetic.generate_events(n_events=20000, n_actors=300)
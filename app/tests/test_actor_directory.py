@@ -0,0 +1,30 @@
+import pandas as pd
+
+from utils import actor_directory
+
+
+def test_course_filter_finds_actors_of_several_courses():
+    df = pd.DataFrame({
+        'actor.id': [3, 3, 1, 2, 1],
+        'Course': ['B', 'A', 'A', 'B', 'A'],
+        'Institution': ['X'] * 5,
+        'timestamp': pd.date_range('2023-02-01', periods=5),
+        'object.definition.type': ['quiz', 'page', 'page', 'assessment', 'page']
+    })
+    directory = actor_directory.ActorDirectory(df)
+
+    assert directory.courses() == ['A', 'B']
+    assert directory.search(0, course='A')['actor.id'].tolist() == [1, 3]
+    assert directory.search(0, course='B')['actor.id'].tolist() == [2, 3]
+    assert directory.count('A') == 2
+    assert directory.get(3)['Events'] == 2
+
+
+def test_pages_cover_every_actor(events):
+    directory = actor_directory.ActorDirectory(events)
+    course = directory.courses()[0]
+    pages = -(-directory.count(course) // 7)
+
+    ids = [actor for number in range(pages) for actor in directory.page(number, 7, course)['actor.id']]
+    assert ids == directory.search(0, directory.count(course), course)['actor.id'].tolist()
+    assert directory.page(pages, 7, course).empty
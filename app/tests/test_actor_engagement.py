@@ -0,0 +1,35 @@
+import plotly.graph_objects as go
+
+from utils import actor_engagement, sketches
+
+
+def test_approximate_resume_uses_sketches(events, monkeypatch):
+    course = events['Course'].iloc[0]
+    exact = actor_engagement.resume_course_or_institution(events, course)
+
+    calls = []
+    get_store = sketches.get_store
+    monkeypatch.setattr(sketches, 'get_store', lambda df: calls.append(df) or get_store(df))
+    approximate = actor_engagement.resume_course_or_institution(events, course, approximate=True)
+
+    assert calls
+    assert abs(approximate[3] - exact[3]) <= 0.05 * exact[3]
+    assert approximate[1].equals(exact[1])
+
+
+def test_approximate_resume_of_institution(events):
+    institution = events['Institution'].iloc[0]
+    exact = actor_engagement.resume_course_or_institution(events, institution)
+    approximate = actor_engagement.resume_course_or_institution(events, institution, approximate=True)
+
+    assert list(approximate[4]['Course']) == list(exact[4]['Course'])
+    for estimate, count in zip(approximate[4]['Count'], exact[4]['Count']):
+        assert abs(estimate - count) <= max(1, 0.05 * count)
+
+
+def test_display_passes_approximate(events):
+    institution = events['Institution'].iloc[0]
+    treemap, _, students = actor_engagement.display(events, institution, approximate=True)
+
+    assert 'about' in treemap.layout.title.text
+    assert isinstance(students, go.Figure)
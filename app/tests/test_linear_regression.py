@@ -0,0 +1,45 @@
+from utils import linear_regression
+
+
+def count_calls(monkeypatch, module, name):
+    calls = []
+    original = getattr(module, name)
+    monkeypatch.setattr(module, name, lambda *args, **kwargs: calls.append(args) or original(*args, **kwargs))
+    return calls
+
+
+def test_fit_aggregates_the_batches_once(events, monkeypatch):
+    batches = count_calls(monkeypatch, linear_regression, 'actor_batches')
+    model = linear_regression.StreamingRegression(2 ** 10).fit(events, epochs=3)
+
+    assert len(batches) == 1
+    assert model.results is not None
+
+
+def test_spilled_batches_give_the_same_model(events, monkeypatch):
+    in_memory = linear_regression.StreamingRegression(2 ** 10).fit(events, epochs=2)
+
+    spilled_batches = []
+
+    class Spilled(linear_regression.FeatureBatches):
+        def __init__(self):
+            super().__init__(max_bytes=0)
+            spilled_batches.append(self)
+
+    monkeypatch.setattr(linear_regression, 'FeatureBatches', Spilled)
+    spilled = linear_regression.StreamingRegression(2 ** 10).fit(events, epochs=2)
+
+    assert spilled_batches and all(isinstance(batch, str) for batch in spilled_batches[0]._batches)
+    assert (spilled.model.coef_ == in_memory.model.coef_).all()
+
+
+def test_update_is_a_single_pass(events, monkeypatch):
+    cutoff = events['timestamp'].quantile(0.8)
+    model = linear_regression.StreamingRegression(2 ** 10).fit(events[events['timestamp'] <= cutoff], epochs=2)
+
+    updated_actors = events.loc[events['timestamp'] > cutoff, 'actor.id'].nunique()
+    fits = count_calls(monkeypatch, model.model, 'partial_fit')
+    model.update(events)
+
+    assert sum(features.shape[0] for features, _ in fits) <= updated_actors
+    assert model.last == events['timestamp'].max()
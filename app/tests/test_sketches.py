@@ -0,0 +1,17 @@
+import pandas as pd
+
+from utils import query_backend, sketches
+
+
+def test_store_is_shared_by_date_ranges(events):
+    ranges = [(pd.Timestamp('2023-03-01'), pd.Timestamp('2023-04-01')),
+              (pd.Timestamp('2023-04-01'), pd.Timestamp('2023-05-01'))]
+    restricted = [query_backend.restrict(events, start, stop) for start, stop in ranges]
+
+    store = sketches.get_store(events)
+    assert all(sketches.get_store(data) is store for data in restricted)
+
+    for data in restricted:
+        assert store.count_events(None, None, *sketches.date_range(data)) == len(data)
+        actors = data['actor.id'].nunique()
+        assert abs(store.distinct_actors(None, None, *sketches.date_range(data)) - actors) <= 0.05 * actors
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency, chisquare
+
+from utils import verbs
+
+TABLE = pd.DataFrame([[30, 10], [20, 40], [5, 15]], index=['viewed', 'answered', 'completed'],
+                     columns=['Course A', 'Course B'])
+
+
+def test_independence():
+    (statistic, dof, p), _, residuals = verbs.chi_square_test(TABLE, 'independence')
+    expected_statistic, expected_p, expected_dof, _ = chi2_contingency(TABLE, correction=False)
+
+    assert np.isclose(statistic, expected_statistic)
+    assert dof == expected_dof
+    assert np.isclose(p, expected_p)
+    # With two courses, the adjusted residuals of a verb are opposite and sum to zero.
+    assert np.allclose(residuals['Course A'], -residuals['Course B'])
+
+
+def test_uniform():
+    (statistic, dof, _), _, residuals = verbs.chi_square_test(TABLE, 'uniform')
+    row_statistics = chisquare(TABLE, axis=1).statistic
+
+    assert np.isclose(statistic, row_statistics.sum())
+    assert dof == len(TABLE)
+    # With two courses, the standardized residual of every cell is the square root of the chi-square of its verb.
+    assert np.allclose(residuals['Course A'].abs(), np.sqrt(row_statistics))
+    assert np.allclose(residuals['Course A'], -residuals['Course B'])
@@ -1,16 +1,442 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
 import pandas as pd
 import streamlit as st
+from utils import actor_directory, anomalies, compute_backend, course_popularity, figure_cache, network_analysis, \
+    profiling, query_backend, similarity, time_index, verbs, versioning, warmup
+
+DATA_PATH = os.environ.get('ILEDA_DATA_PATH', 'data/processed.csv')
+FULL_HISTORY = 'Full history'
+RECENT_DAYS = {'Last two weeks': 14, 'Last 30 days': 30}
+CUSTOM_RANGE = 'Custom range'
+FIGURE_WORKERS = int(os.environ.get('ILEDA_FIGURE_WORKERS', 4))
+ACTOR_PAGE_SIZE = 50
+
+
+@st.cache_resource(max_entries=1, show_spinner='Loading data...')
+def read_data(path, version):
+    """
+    Read a version of the dataset, shared by all sessions until the next version is read.
+
+    The returned DataFrame is not copied for each script run, so it must never be modified in place. A Parquet path
+    is not loaded into memory; the analyses query it through a ParquetBackend instead.
+
+    Parameters:
+    - path (str): The path of the data file (see query_backend.open_dataset).
+    - version (str): The version of the data file (see data_version).
+
+    Returns:
+    - pd.DataFrame or QueryBackend: The processed interaction data.
+    """
+    return query_backend.open_dataset(path)
 
 
-@st.cache_data
 def load_data():
-    df = pd.read_csv(
-        'data/processed.csv'
-    )
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    """
+    Load the current version of the dataset and start warming up the caches for it.
+
+    With the 'profile' query parameter (or ILEDA_PROFILE) set, the rest of the page run is profiled first (see
+    profiling.capture).
+
+    Returns:
+    - pd.DataFrame or QueryBackend: The processed interaction data.
+    """
+    if profiling.capture(profiling.get_mode(st.experimental_get_query_params().get('profile', [None])[0])):
+        st.sidebar.caption('This run is being profiled, see the Profiles page.')
+
+    version = data_version()
+    df = read_data(DATA_PATH, version)
+    if get_compute_client() is None:
+        start_warmup(df, version)
     return df
 
 
+def filtered_data():
+    """
+    Load the current version of the dataset restricted to the date range selected in the sidebar.
+
+    The range is chosen once and kept in the session state, so it applies to every page. Stops the page if the range
+    contains no events.
+
+    Returns:
+    - pd.DataFrame or QueryBackend: The processed interaction data in the selected range.
+    """
+    df = load_data()
+    version = data_version()
+    start, stop = select_date_range(*get_time_bounds(df, version))
+    exclude = exclude_anomalies_mode(df, version)
+
+    data = restrict_data(df, version, start, stop, exclude)
+    if not get_names(data, filtered_version(), 'Institution'):
+        st.warning('There are no events in the selected date range.')
+        st.stop()
+    return data
+
+
+def select_date_range(first, last):
+    """
+    Show the date range filter in the sidebar.
+
+    Parameters:
+    - first (pd.Timestamp): The timestamp of the first event.
+    - last (pd.Timestamp): The timestamp of the last event.
+
+    Returns:
+    - Tuple[pd.Timestamp, pd.Timestamp]: The start (inclusive) and end (exclusive) of the selected range, or
+      (None, None) for the full history.
+    """
+    if 'date_range' not in st.session_state:
+        st.session_state.date_range = FULL_HISTORY
+    if 'custom_date_range' not in st.session_state:
+        st.session_state.custom_date_range = (first.date(), last.date())
+
+    terms = {name: (start, stop) for name, start, stop in time_index.terms(first, last)}
+    options = [FULL_HISTORY] + list(RECENT_DAYS) + list(terms) + [CUSTOM_RANGE]
+    if st.session_state.date_range not in options:
+        st.session_state.date_range = FULL_HISTORY
+
+    st.session_state.date_range = st.sidebar.selectbox('Date range', options,
+                                                       index=options.index(st.session_state.date_range))
+
+    end_of_data = last.normalize() + pd.Timedelta(days=1)
+    if st.session_state.date_range in RECENT_DAYS:
+        start, stop = end_of_data - pd.Timedelta(days=RECENT_DAYS[st.session_state.date_range]), end_of_data
+    elif st.session_state.date_range in terms:
+        start, stop = terms[st.session_state.date_range]
+    elif st.session_state.date_range == CUSTOM_RANGE:
+        custom = st.sidebar.date_input('From - to', st.session_state.custom_date_range, first.date(), last.date())
+        if len(custom) == 2:
+            st.session_state.custom_date_range = tuple(custom)
+        start = pd.Timestamp(st.session_state.custom_date_range[0])
+        stop = pd.Timestamp(st.session_state.custom_date_range[1]) + pd.Timedelta(days=1)
+    else:
+        return None, None
+
+    st.sidebar.caption(f'{start:%Y-%m-%d} to {stop - pd.Timedelta(days=1):%Y-%m-%d}')
+    return start, stop
+
+
+def record_visit(page, selection):
+    """
+    Record a visit of a page with a given selection for the warm-up priorities (see warmup.VisitCounter). Reruns of
+    the page with the same selection, e.g. after another widget changed, are not counted again.
+
+    Parameters:
+    - page (str): The name of the page.
+    - selection (str): The selected course or institution.
+    """
+    visit = (page, str(selection))
+    if st.session_state.get('last_visit') != visit:
+        st.session_state.last_visit = visit
+        warmup.visits.record(page, selection)
+
+
+def select_actor(df):
+    """
+    Show the widgets selecting an actor: a course filter, a search by ID in the actor directory and the page of actors
+    containing it, with buttons to the previous and next pages and a caption describing the selected actor.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The processed interaction data, as returned by filtered_data.
+
+    Returns:
+    - int or None: The ID of the selected actor, or None if no actor matches the search.
+    """
+    directory = get_actor_directory(df, filtered_version())
+
+    course = st.selectbox('Filter by course', ['All courses'] + directory.courses())
+    course = None if course == 'All courses' else course
+
+    actor_id = st.number_input('Search by actor ID', 0, int(directory.ids[-1]), min(466, int(directory.ids[-1])))
+    position = directory.position(actor_id, course)
+    pages = max(1, -(-directory.count(course) // ACTOR_PAGE_SIZE))
+
+    # A new search or course jumps to the page of the searched ID; the buttons move from there.
+    if st.session_state.get('actor_search') != (course, actor_id):
+        st.session_state.actor_search = (course, actor_id)
+        st.session_state.actor_page = min(position // ACTOR_PAGE_SIZE, pages - 1)
+
+    previous, label, following = st.columns([1, 2, 1])
+    if previous.button('Previous', disabled=st.session_state.actor_page == 0, use_container_width=True):
+        st.session_state.actor_page -= 1
+    if following.button('Next', disabled=st.session_state.actor_page >= pages - 1, use_container_width=True):
+        st.session_state.actor_page += 1
+    st.session_state.actor_page = min(max(st.session_state.actor_page, 0), pages - 1)
+    label.caption(f'Page {st.session_state.actor_page + 1} of {pages}')
+
+    actors = directory.page(st.session_state.actor_page, ACTOR_PAGE_SIZE, course)
+    if actors.empty:
+        st.info('No actors' + ('.' if course is None else ' in ' + course + '.'))
+        return None
+
+    ids = actors['actor.id'].tolist()
+    index = int(np.searchsorted(ids, actor_id)) if st.session_state.actor_page == position // ACTOR_PAGE_SIZE else 0
+    selected = st.selectbox('Select actor', ids, index=min(index, len(ids) - 1))
+
+    entry = directory.get(selected)
+    st.caption(f"{entry['Institution']}, {course or entry['Course']}: {entry['Events']} events from "
+               f"{entry['First activity']:%Y-%m-%d} to {entry['Last activity']:%Y-%m-%d} "
+               f"({directory.count(course)} actors{'' if course is None else ' in the course'})")
+    return selected
+
+
+def approximate_mode():
+    """
+    Show the approximate analytics toggle in the sidebar. The choice is kept in the session state for every page.
+
+    Returns:
+    - bool: Whether the analyses that support it should use the sketches of the dataset (see sketches.SketchStore).
+    """
+    if 'approximate' not in st.session_state:
+        st.session_state.approximate = False
+
+    st.session_state.approximate = st.sidebar.toggle(
+        'Approximate analytics', st.session_state.approximate,
+        help='Estimate numbers of students and quantiles from mergeable sketches instead of the events.'
+    )
+    return st.session_state.approximate
+
+
+def exclude_anomalies_mode(df, version):
+    """
+    Show the toggle excluding the events flagged as anomalies in the sidebar. The choice is kept in the session state
+    for every page.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The processed interaction data.
+    - version (str): The data version.
+
+    Returns:
+    - bool: Whether the flagged events are left out of every analysis (see anomalies.flag). Always False if the data
+      has no anomaly flags.
+    """
+    if 'exclude_anomalies' not in st.session_state:
+        st.session_state.exclude_anomalies = False
+
+    summary = get_anomaly_summary(df, version)
+    st.session_state.exclude_anomalies = st.sidebar.toggle(
+        'Exclude anomalies', st.session_state.exclude_anomalies and summary is not None, disabled=summary is None,
+        help='Leave out bursts of events of an actor and repeats of the same statement a few seconds apart, e.g. '
+             'tracker glitches and scripted clients.' if summary is not None else
+             'The data has no anomaly flags. Convert it to Parquet again to compute them.'
+    )
+    if summary is not None:
+        st.sidebar.caption(f"{summary['flagged']} events of {summary['actors']} actors flagged ({summary['Burst']} in "
+                           f"bursts, {summary['Duplicate']} duplicates)")
+    return st.session_state.exclude_anomalies
+
+
+def filtered_version():
+    """
+    Get an identifier of the current data version, the date range selected in the sidebar and the exclusion of the
+    anomalies, for caching results computed from filtered_data.
+
+    Returns:
+    - str: The data version, followed by the range if one is selected and by a marker if anomalies are excluded.
+    """
+    date_range = st.session_state.get('date_range', FULL_HISTORY)
+    if date_range == CUSTOM_RANGE:
+        date_range += ' ' + ' - '.join(str(day) for day in st.session_state.custom_date_range)
+    version = data_version() if date_range == FULL_HISTORY else data_version() + '|' + date_range
+    return version + '|without anomalies' if st.session_state.get('exclude_anomalies', False) else version
+
+
+def data_version(path=DATA_PATH):
+    """
+    Get the version of a data file or directory of Parquet files from the version registry.
+
+    Parameters:
+    - path (str): The path of the data file. Default is DATA_PATH.
+
+    Returns:
+    - str: An identifier that changes whenever the content or the schema of the file, or of any file in the directory,
+      changes (see versioning.Registry).
+    """
+    return versioning.version(path)
+
+
+@st.cache_resource
+def get_compute_client():
+    return compute_backend.client_from_env()
+
+
+@st.cache_resource(show_spinner=False)
+def start_warmup(_df, version):
+    """
+    Precompute the figures of every course and institution in the background, once per data version and process.
+
+    Parameters:
+    - _df (pd.DataFrame): The processed interaction data.
+    - version (str): The data version.
+
+    Returns:
+    - WarmupScheduler: The started scheduler.
+    """
+    return warmup.start(warmup.page_tasks(_df), version)
+
+
+@st.cache_data(show_spinner=False)
+def get_time_bounds(_df, version):
+    return query_backend.time_bounds(_df)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def restrict_data(_df, version, start, stop, exclude_anomalies=False):
+    return query_backend.restrict(_df, start, stop, exclude_anomalies)
+
+
+@st.cache_data(show_spinner=False)
+def get_anomaly_summary(_df, version):
+    return anomalies.summarize(query_backend.get_backend(_df)) if query_backend.has_anomaly_flags(_df) else None
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_actor_directory(_df, version):
+    return actor_directory.get_directory(_df)
+
+
+@st.cache_resource(max_entries=4, show_spinner='Building the similarity index...')
+def get_similarity_index(_df, version):
+    return similarity.load_or_build(_df, version, [DATA_PATH])
+
+
+@st.cache_data(show_spinner=False)
+def get_names(_df, version, column):
+    return query_backend.values(_df, column)
+
+
+@st.cache_data(max_entries=8, show_spinner='Building the interaction graph...')
+def get_interaction_graph(_df, version, min_shared=2):
+    return network_analysis.interaction_graph(_df, min_shared)
+
+
+@st.cache_data(max_entries=8)
+def get_contingency_table(_df, version):
+    return verbs.verb_course_contingency(_df)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def get_popularity_statistics(_df, version, approximate):
+    return course_popularity.popularity_statistics(_df, approximate)
+
+
+def build_figures(client, version, func, args, kwargs):
+    """
+    Build figures through the compute backend or the shared figure cache (see cached_figures).
+
+    Does not use the Streamlit session, so it can run in worker threads.
+
+    Parameters:
+    - client (ComputeClient or None): The client of the compute backend, if one is configured.
+    - version (str): The data version.
+    - func (callable): The figure builder from utils.
+    - args (tuple): The positional arguments of the builder.
+    - kwargs (dict): The keyword arguments of the builder.
+
+    Returns:
+    - The rendered result of the builder.
+    """
+    if client is not None and compute_backend.builder_name(func) in compute_backend.BUILDERS:
+        try:
+            return client.call(func, *args, version=version, **kwargs)
+        except (ConnectionError, compute_backend.BackendError):
+            # Unreachable, busy or failing backends and backends serving other data fall back to this process.
+            pass
+
+    return figure_cache.cached(func, *args, version=version, **kwargs)
+
+
+def cached_figures(func, *args, **kwargs):
+    """
+    Build figures through the shared figure cache, keyed by the builder, its arguments and the data version.
+
+    When a compute backend is configured (ILEDA_BACKEND_ADDRESS), the figures are computed there and shared by all
+    sessions; if it cannot be reached, is busy or fails, they are computed in this process.
+
+    Parameters:
+    - func (callable): The figure builder from utils.
+    - args: The positional arguments of the builder. DataFrames and query backends must be the loaded data, optionally
+      restricted to a date range (see filtered_data).
+    - kwargs: The keyword arguments of the builder.
+
+    Returns:
+    - The rendered result of the builder, to be displayed with show_figure.
+    """
+    return build_figures(get_compute_client(), data_version(), func, args, kwargs)
+
+
+@st.cache_resource
+def get_figure_executor():
+    return ThreadPoolExecutor(FIGURE_WORKERS, thread_name_prefix='figures')
+
+
+def parallel_figures(calls, **kwargs):
+    """
+    Start building the independent figures of a page concurrently, to show each one as soon as it is ready.
+
+    The figures are built by a thread pool shared by all sessions (ILEDA_FIGURE_WORKERS threads), through the figure
+    cache or the compute backend like cached_figures, so a page costs its slowest figure instead of the sum of all of
+    them. Pages reserve a placeholder for every figure (st.empty), show the rest of the page and then fill the
+    placeholders as the results arrive.
+
+    Parameters:
+    - calls (dict): The call of every figure, as a tuple of the builder and its positional arguments (see
+      cached_figures).
+    - kwargs: Keyword arguments passed to every builder, e.g. an intermediate result they share that the page computed
+      once. They are sent to the compute backend as they are.
+
+    Returns:
+    - Iterator[Tuple[object, object]]: The key of every call and the rendered result of its builder, in the order they
+      complete.
+    """
+    client, version, executor = get_compute_client(), data_version(), get_figure_executor()
+    # The threads building the figures of a profiled run are sampled with it (see profiling.capture).
+    profiler = profiling.current()
+    build = build_figures if profiler is None else partial(profiler.call, build_figures)
+    futures = {executor.submit(build, client, version, func, tuple(args), kwargs): key
+               for key, (func, *args) in calls.items()}
+    return ((futures[future], future.result()) for future in as_completed(futures))
+
+
+def show_figure(figure, **kwargs):
+    """
+    Display a figure rendered by the figure cache.
+
+    Parameters:
+    - figure (RenderedFigure or None): The rendered figure.
+    - kwargs: Additional arguments for st.plotly_chart.
+    """
+    if figure is None:
+        return
+    if figure.kind == 'png':
+        st.image(figure.data, use_column_width=True)
+    else:
+        st.plotly_chart(figure_cache.to_plotly(figure), **kwargs)
+
+
+def show_session_summary(summary, per_actor=True):
+    """
+    Display the session metrics of an actor, course or institution.
+
+    Parameters:
+    - summary (dict): The metrics, as returned by sessions.display.
+    - per_actor (bool): Whether to show the number of sessions per actor. Default is True.
+    """
+    if not summary:
+        st.info('No study sessions found.')
+        return
+
+    columns = st.columns(4 if per_actor else 3)
+    columns[0].metric('Sessions', f"{summary['Sessions']:.0f}")
+    columns[1].metric('Median duration', f"{summary['Median duration (min)']:.0f} min")
+    columns[2].metric('Events per session', f"{summary['Events per session']:.1f}")
+    if per_actor:
+        columns[3].metric('Sessions per actor', f"{summary['Sessions per actor']:.1f}")
+
+
 def text_to_display(text):
     if text == 'Graded assignments':
         return 'assessments'
@@ -20,4 +446,3 @@ def text_to_display(text):
         return 'total'
     if text == 'Both types (separate plots)':
         return 'both'
-
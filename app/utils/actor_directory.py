@@ -0,0 +1,202 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from utils import query_backend
+
+ASSESSMENT_TYPES = ['quiz', 'assessment']
+DIRECTORY_COLUMNS = ['actor.id', 'Course', 'Institution', 'timestamp', 'object.definition.type']
+
+
+class ActorDirectory:
+    """
+    An index of the actors of a dataset, sorted by actor ID.
+
+    For every actor it stores the course and institution of their first event, the range of their events in the
+    actor-sorted row order, the first and last activity and the event counts. Every course an actor has events in is
+    indexed, so filtering by course also finds the actors taking several courses. Lookups and searching, optionally
+    within a course, use binary search and take O(log n) time.
+    """
+
+    def __init__(self, df):
+        actor_ids = df['actor.id'].to_numpy()
+        self.order = np.argsort(actor_ids, kind='stable')
+        sorted_ids = actor_ids[self.order]
+
+        self.ids, starts, counts = np.unique(sorted_ids, return_index=True, return_counts=True)
+        first_rows = self.order[starts]
+
+        assessments = df['object.definition.type'].isin(ASSESSMENT_TYPES).to_numpy()[self.order]
+        timestamps = df['timestamp'].to_numpy()[self.order]
+
+        self.table = pd.DataFrame({
+            'actor.id': self.ids,
+            'Course': df['Course'].to_numpy()[first_rows],
+            'Institution': df['Institution'].to_numpy()[first_rows],
+            'First activity': np.minimum.reduceat(timestamps, starts) if len(starts) else timestamps[:0],
+            'Last activity': np.maximum.reduceat(timestamps, starts) if len(starts) else timestamps[:0],
+            'Events': counts,
+            'Assessment events': np.add.reduceat(assessments, starts) if len(starts) else counts[:0],
+            'start': starts,
+            'stop': starts + counts
+        })
+
+        # Every (course, actor) pair with events, sorted by course and then by ID, so a course is searched without
+        # copying its IDs and actors taking several courses are found in each of them.
+        course_codes, course_names = pd.factorize(df['Course'].to_numpy()[self.order], sort=True)
+        pairs = np.lexsort((sorted_ids, course_codes))
+        pair_ids, pair_codes = sorted_ids[pairs], course_codes[pairs]
+        distinct = np.ones(len(pairs), dtype=bool)
+        distinct[1:] = (pair_ids[1:] != pair_ids[:-1]) | (pair_codes[1:] != pair_codes[:-1])
+        distinct &= pair_codes >= 0
+        self._course_ids = pair_ids[distinct]
+        self._by_course = np.searchsorted(self.ids, self._course_ids)
+        self._course_names = np.asarray(course_names, dtype=object)
+        self._course_starts = np.searchsorted(pair_codes[distinct], np.arange(len(course_names)))
+        self._course_stops = np.append(self._course_starts[1:], len(self._course_ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def courses(self):
+        """
+        Get the courses of the actors.
+
+        Returns:
+        - List[str]: The course names in alphabetical order.
+        """
+        return self._course_names.tolist()
+
+    def _bounds(self, course):
+        index = np.searchsorted(self._course_names, course)
+        if index == len(self._course_names) or self._course_names[index] != course:
+            return slice(0, 0)
+        return slice(self._course_starts[index], self._course_stops[index])
+
+    def _positions(self, course=None):
+        return None if course is None else self._by_course[self._bounds(course)]
+
+    def count(self, course=None):
+        """
+        Get the number of actors, optionally within a course.
+
+        Parameters:
+        - course (str, optional): The course to filter by.
+
+        Returns:
+        - int: The number of actors.
+        """
+        positions = self._positions(course)
+        return len(self) if positions is None else len(positions)
+
+    def get(self, actor_id):
+        """
+        Look up an actor.
+
+        Parameters:
+        - actor_id (int): The ID of the actor.
+
+        Returns:
+        - pd.Series or None: The directory entry of the actor, or None if the actor has no events.
+        """
+        index = np.searchsorted(self.ids, actor_id)
+        if index == len(self.ids) or self.ids[index] != actor_id:
+            return None
+        return self.table.iloc[index]
+
+    def rows(self, df, actor_id):
+        """
+        Get the events of an actor.
+
+        Parameters:
+        - df (pd.DataFrame): The DataFrame the directory was built from.
+        - actor_id (int): The ID of the actor.
+
+        Returns:
+        - pd.DataFrame: The events of the actor in their original order (empty if the actor is unknown).
+        """
+        entry = self.get(actor_id)
+        if entry is None:
+            return df.iloc[:0]
+        return df.iloc[self.order[entry['start']:entry['stop']]]
+
+    def page(self, number, size=50, course=None):
+        """
+        Get a page of actors sorted by ID, optionally within a course.
+
+        Parameters:
+        - number (int): The page number, starting at 0.
+        - size (int): The number of actors per page. Default is 50.
+        - course (str, optional): The course to filter by.
+
+        Returns:
+        - pd.DataFrame: The directory entries on the page.
+        """
+        return self._slice(number * size, size, course)
+
+    def position(self, actor_id, course=None):
+        """
+        Get the position of an ID among the actors sorted by ID, optionally within a course.
+
+        Parameters:
+        - actor_id (int): The ID to search for.
+        - course (str, optional): The course to filter by.
+
+        Returns:
+        - int: The position of the first actor whose ID is at least actor_id.
+        """
+        ids = self.ids if course is None else self._course_ids[self._bounds(course)]
+        return int(np.searchsorted(ids, actor_id))
+
+    def search(self, actor_id, size=50, course=None):
+        """
+        Get the actors with the given ID and the following IDs, optionally within a course.
+
+        Parameters:
+        - actor_id (int): The ID to search for.
+        - size (int): The maximum number of actors returned. Default is 50.
+        - course (str, optional): The course to filter by.
+
+        Returns:
+        - pd.DataFrame: The directory entries, starting at the first actor whose ID is at least actor_id.
+        """
+        return self._slice(self.position(actor_id, course), size, course)
+
+    def _slice(self, start, size, course):
+        positions = self._positions(course)
+        if positions is None:
+            return self.table.iloc[start:start + size]
+        return self.table.iloc[positions[start:start + size]]
+
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+def get_directory(df):
+    """
+    Get the actor directory of a DataFrame, building it on first use.
+
+    The directory is kept for as long as the DataFrame itself. Only the needed columns are loaded from an out-of-core
+    backend.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - ActorDirectory: The directory.
+    """
+    key = id(df)
+    with _directories_lock:
+        directory = _directories.get(key)
+    if directory is not None:
+        return directory
+
+    directory = ActorDirectory(query_backend.to_frame(df, DIRECTORY_COLUMNS))
+    with _directories_lock:
+        if key not in _directories:
+            _directories[key] = directory
+            weakref.finalize(df, _directories.pop, key, None)
+        return _directories[key]
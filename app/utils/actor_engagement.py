@@ -1,7 +1,11 @@
 import numpy as np
 import pandas as pd
 import plotly.express as px
-from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+
+from utils import actor_directory, query_backend, sketches
+
+EXCLUDED_TYPES = ['page', 'review', 'meeting', 'survey', 'lesson']
 
 
 def change_assessment(verb, object_def_type):
@@ -25,6 +29,69 @@ def change_assessment(verb, object_def_type):
     return object_def_type
 
 
+def count_assessments(df, by=(), where=None):
+    """
+    Count the events and summarize the scores per object definition type and verb, with the assessment types changed
+    as in change_assessment and the types without engagement (pages, reviews, meetings, surveys, lessons) left out.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing relevant data.
+    - by (Tuple[str]): Additional columns to group by. Default is none.
+    - where (dict, optional): The filter of the events (see QueryBackend).
+
+    Returns:
+    - pd.DataFrame: The columns of by, 'object.definition.type', 'verb.id' and the number of events ('count'), of
+      scores ('n') and their 'sum', 'min' and 'max'.
+    """
+    by = list(by)
+    columns = by + ['object.definition.type', 'verb.id']
+    counts = query_backend.get_backend(df).aggregate(columns, 'result.score.scaled', where)
+    counts['object.definition.type'] = [change_assessment(verb, object_def_type) for verb, object_def_type in
+                                        zip(counts['verb.id'], counts['object.definition.type'])]
+    counts = counts[~counts['object.definition.type'].isin(EXCLUDED_TYPES)]
+    return counts.groupby(columns, sort=False, dropna=False).agg(
+        count=('count', 'sum'), n=('n', 'sum'), sum=('sum', 'sum'), min=('min', 'min'), max=('max', 'max')
+    ).reset_index()
+
+
+def summarize_assessments(counts, object_def_types_w_verbs):
+    """
+    Build the action summary, score summary and successful assessment counts from aggregated counts.
+
+    Parameters:
+    - counts (pd.DataFrame): The counts, as returned by count_assessments without additional columns.
+    - object_def_types_w_verbs (List[Tuple[str, str]]): The object definition types and verbs of the action summary.
+
+    Returns:
+    - Tuple[pd.DataFrame, pd.DataFrame, List[int]]: Action summary, Score summary and Successful assessments count.
+    """
+    counts = counts.set_index(['object.definition.type', 'verb.id'])
+
+    actions_df = pd.DataFrame({
+        'Type': [object_def_type for object_def_type, _ in object_def_types_w_verbs],
+        'Verb': [verb for _, verb in object_def_types_w_verbs],
+        'Count': [counts['count'].get(pair, 0) for pair in object_def_types_w_verbs]
+    }).sort_values(by=['Count'], ascending=False).reset_index(drop=True)
+
+    scores = []
+    for pair in [('homework', 'scored'), ('test', 'completed'), ('quiz', 'completed')]:
+        if pair not in counts.index:
+            scores.append((None, None, None))
+            continue
+        row = counts.loc[pair]
+        scores.append((row['min'], row['sum'] / row['n'] if row['n'] else np.nan, row['max']))
+
+    scores_df = pd.DataFrame({'Type': ['homework', 'test', 'quiz'],
+                              'Min_Score': [score[0] for score in scores],
+                              'Avg_Score': [score[1] for score in scores],
+                              'Max_Score': [score[2] for score in scores]})
+
+    successful_assessments = [int(counts['count'].get(pair, 0)) for pair in
+                              [('quiz', 'completed'), ('homework', 'scored'), ('test', 'completed')]]
+
+    return actions_df, scores_df, successful_assessments
+
+
 def get_count(actor_df, object_def_type, verb):
     """
     Get the count of occurrences for a specific object definition type and verb.
@@ -106,6 +173,49 @@ def get_ratio(actor_df: pd.DataFrame, object_definition_type: str, verb_id1: str
     return None if n2 == 0 else n1 / n2
 
 
+def get_actor_scores(df):
+    """
+    Calculate the score of every actor, as calculate_score does for a single actor's assessments.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing relevant data.
+
+    Returns:
+    - pd.Series: The score of every actor with at least one assessment, indexed by actor ID.
+    """
+    counts = count_assessments(df, ['actor.id', 'result.success'],
+                               {'object.definition.type': ['homework', 'quiz', 'test', 'assessment']})
+    assessed = counts[counts['object.definition.type'].isin(['homework', 'quiz', 'test'])]
+    successful = assessed[assessed['result.success'] == True]
+    totals = successful.groupby('actor.id')[['sum', 'count']].sum()
+    means = totals['sum'] / totals['count']
+    return means.reindex(assessed['actor.id'].unique()).fillna(0).clip(lower=0)
+
+
+def get_place(df, actor_id, column, name):
+    """
+    Get the place of an actor in terms of scores among the actors of a course or institution.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing relevant data.
+    - actor_id (int): The ID of the actor.
+    - column (str): 'Course' or 'Institution'.
+    - name (str): The name of the course or institution.
+
+    Returns:
+    - Tuple[int, int] or None: The place of the actor and the total number of actors, or None if the actor has no
+      events in the course or institution.
+    """
+    actors = count_assessments(df, ['actor.id'], {column: name})['actor.id'].unique()
+    if actor_id not in actors:
+        return None
+
+    # Scores aggregated in a different order can differ in the last bits; round them so that equal scores tie.
+    scores = get_actor_scores(df).reindex(actors).fillna(0).round(12)
+    distinct_scores = np.unique(scores.to_numpy())[::-1]
+    return int(np.flatnonzero(distinct_scores == scores[actor_id])[0]) + 1, len(actors)
+
+
 def get_place_in_course(df, actor_id, course):
     """
     Get the place of an actor in terms of scores within a specific course.
@@ -116,22 +226,10 @@ def get_place_in_course(df, actor_id, course):
     - course (str): The name of the course.
 
     Returns:
-    - Tuple[int, int]: The place of the actor and the total number of actors in the course.
+    - Tuple[int, int] or None: The place of the actor and the total number of actors in the course, or None if the
+      actor has no events in the course.
     """
-    course_df = df[df['Course'] == course]
-
-    scores = []
-    actor_score = 0
-    for actor in set(course_df['actor.id']):
-        actor_df = df[(df['actor.id'] == actor)]
-        score = calculate_score(actor_df[actor_df['object.definition.type'].isin(['homework', 'quiz', 'test'])][
-                                    ['result.score.scaled', 'result.success']])
-        if actor == actor_id:
-            actor_score = score
-
-        scores.append(score)
-
-    return sorted(list(dict.fromkeys(scores)))[::-1].index(actor_score) + 1, len(scores)
+    return get_place(df, actor_id, 'Course', course)
 
 
 def get_place_in_institution(df, actor_id, instituiton):
@@ -144,22 +242,10 @@ def get_place_in_institution(df, actor_id, instituiton):
     - institution (str): The name of the institution.
 
     Returns:
-    - Tuple[int, int]: The place of the actor and the total number of actors in the institution.
+    - Tuple[int, int] or None: The place of the actor and the total number of actors in the institution, or None if
+      the actor has no events in the institution.
     """
-    instituiton_df = df[df['Institution'] == instituiton]
-
-    scores = []
-    actor_score = 0
-    for actor in set(instituiton_df['actor.id']):
-        actor_df = df[(df['actor.id'] == actor)]
-        score = calculate_score(actor_df[actor_df['object.definition.type'].isin(['homework', 'quiz', 'test'])][
-                                    ['result.score.scaled', 'result.success']])
-        if actor == actor_id:
-            actor_score = score
-
-        scores.append(score)
-
-    return sorted(list(dict.fromkeys(scores)))[::-1].index(actor_score) + 1, len(scores)
+    return get_place(df, actor_id, 'Institution', instituiton)
 
 
 def get_successful_assessments(actor_df, type_of_assessment):
@@ -184,122 +270,92 @@ def resume_actor(df, actor_id):
     Generate a summary of an actor's performance.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame containing relevant data.
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing relevant data.
     - actor_id (int): The ID of the actor.
 
     Returns:
     - Tuple[pd.DataFrame, pd.DataFrame, List[int], Tuple[int, int]]: Action summary, Score summary, Successful assessments count, and Place summary.
+      The place summary is None if the actor has no events other than pages, reviews, meetings, surveys and lessons.
     """
-    df = df.copy()
-    df['object.definition.type'] = df.apply(
-        lambda row: change_assessment(row['verb.id'], row['object.definition.type']), axis=1)
-    df = df[~df['object.definition.type'].isin(['page', 'review', 'meeting', 'survey', 'lesson'])]
-
-    object_definition_types = set(df['object.definition.type'])
-    object_def_types_w_verbs = [(object_def_type, verb) for object_def_type in object_definition_types for verb in
-                                set(df[df['object.definition.type'] == object_def_type]['verb.id'])]
-
-    items = []  # (object_def_type, verb, count)
-
-    actor_df = df[df['actor.id'] == actor_id]
-
-    for object_def_type, verb in object_def_types_w_verbs:
-        object_def_type_with_count = get_count(actor_df, object_def_type, verb)
-        items.append(object_def_type_with_count)
-
-    actions_df = pd.DataFrame({'Type': [item[0] for item in items],
-                               'Verb': [item[1] for item in items],
-                               'Count': [item[2] for item in items]}).sort_values(by=['Count'],
-                                                                                  ascending=False).reset_index().drop(
-        'index', axis=1)
-
-    min_score_homework, avg_score_homework, max_score_homework = get_score(actor_df, 'homework', 'scored')
-    min_score_test, avg_score_test, max_score_test = get_score(actor_df, 'test', 'completed')
-    min_score_quiz, avg_score_quiz, max_score_quiz = get_score(actor_df, 'quiz', 'completed')
-
-    successful_assessments = [get_successful_assessments(actor_df, type_of_assessment) for type_of_assessment in
-                              [('quiz', 'completed'), ('homework', 'scored'), ('test', 'completed')]]
-
-    scores_df = pd.DataFrame({'Type': ['homework', 'test', 'quiz'],
-                              'Min_Score': [min_score_homework, min_score_test, min_score_quiz],
-                              'Avg_Score': [avg_score_homework, avg_score_test, avg_score_quiz],
-                              'Max_Score': [max_score_homework, max_score_test, max_score_quiz]})
+    if isinstance(df, pd.DataFrame):
+        actor_df = actor_directory.get_directory(df).rows(df, actor_id)
+    else:
+        actor_df = df.frame(where={'actor.id': actor_id})
 
-    course = actor_df['Course'].iloc[0]
-    institution = actor_df['Institution'].iloc[0]
+    object_def_types_w_verbs = list(count_assessments(df)[['object.definition.type', 'verb.id']].itertuples(
+        index=False, name=None))
+    actions_df, scores_df, successful_assessments = summarize_assessments(count_assessments(actor_df),
+                                                                          object_def_types_w_verbs)
 
-    place_in_course = get_place_in_course(df, actor_id, course)
-    place_in_institution = get_place_in_institution(df, actor_id, institution)
-    place = [place_in_course, place_in_institution]
+    place = None
+    if not actor_df.empty:
+        place_in_course = get_place_in_course(df, actor_id, actor_df['Course'].iloc[0])
+        place_in_institution = get_place_in_institution(df, actor_id, actor_df['Institution'].iloc[0])
+        if place_in_course is not None and place_in_institution is not None:
+            place = [place_in_course, place_in_institution]
 
     return actions_df, scores_df, successful_assessments, place
 
 
-def resume_course_or_institution(df, id):
+def resume_course_or_institution(df, id, approximate=False):
     """
     Generate a summary of a course or institution's performance.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame containing relevant data.
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing relevant data.
     - id_or_name (int or str): The ID or name of the course or institution.
+    - approximate (bool): Whether to estimate the numbers of students from the sketches of the dataset (see
+      sketches.SketchStore). Default is False.
 
     Returns:
     - Tuple[pd.DataFrame, pd.DataFrame, List[int], int, pd.DataFrame]: Action summary, Score summary, Successful assessments count, Total students, and Total students in courses (if applicable).
     """
-    institutions = set(df['Institution'])
+    institutions = query_backend.values(df, 'Institution')
 
     type_object = 'Institution' if id in institutions else 'Course'
 
-    df = df.copy()
-    df['object.definition.type'] = df.apply(
-        lambda row: change_assessment(row['verb.id'], row['object.definition.type']), axis=1)
-    df = df[~df['object.definition.type'].isin(['page', 'review', 'meeting', 'survey', 'lesson'])]
-
-    object_definition_types = set(df['object.definition.type'])
-    object_def_types_w_verbs = [(object_def_type, verb) for object_def_type in object_definition_types for verb in
-                                set(df[df['object.definition.type'] == object_def_type]['verb.id'])]
-
-    items = []  # (object_def_type, verb, count)
-
-    object_df = df[df[type_object] == id]
-    total_students = len(set(object_df['actor.id']))
-    total_students_in_courses = None if type_object == 'Course' else object_df.groupby('Course')[
-        'actor.id'].nunique().reset_index().rename(columns={'actor.id': 'Count'})
-
-    for object_def_type, verb in object_def_types_w_verbs:
-        object_def_type_with_count = get_count(object_df, object_def_type, verb)
-        items.append(object_def_type_with_count)
-
-    actions_df = pd.DataFrame({'Type': [item[0] for item in items],
-                               'Verb': [item[1] for item in items],
-                               'Count': [item[2] for item in items]}).sort_values(by=['Count'],
-                                                                                  ascending=False).reset_index().drop(
-        'index', axis=1)
-
-    min_score_homework, avg_score_homework, max_score_homework = get_score(object_df, 'homework', 'scored')
-    min_score_test, avg_score_test, max_score_test = get_score(object_df, 'test', 'completed')
-    min_score_quiz, avg_score_quiz, max_score_quiz = get_score(object_df, 'quiz', 'completed')
-
-    successful_assessments = [get_successful_assessments(object_df, type_of_assessment) for type_of_assessment in
-                              [('quiz', 'completed'), ('homework', 'scored'), ('test', 'completed')]]
+    object_def_types_w_verbs = list(count_assessments(df)[['object.definition.type', 'verb.id']].itertuples(
+        index=False, name=None))
+
+    if approximate:
+        store = sketches.get_store(df)
+        start, stop = sketches.date_range(df)
+        total_students = round(store.distinct_actors(type_object, id, start, stop, engaged=True))
+        total_students_in_courses = None
+        if type_object == 'Institution':
+            courses = store.courses.loc[store.courses['Institution'] == id, 'Course']
+            total_students_in_courses = pd.DataFrame({
+                'Course': courses,
+                'Count': [round(store.distinct_actors('Course', course, start, stop, engaged=True))
+                          for course in courses]
+            })
+            total_students_in_courses = total_students_in_courses[total_students_in_courses['Count'] > 0].sort_values(
+                'Course').reset_index(drop=True)
+    else:
+        students = count_assessments(df, ['Course', 'actor.id'], {type_object: id})
+        total_students = students['actor.id'].nunique()
+        total_students_in_courses = None if type_object == 'Course' else students.groupby('Course')[
+            'actor.id'].nunique().reset_index().rename(columns={'actor.id': 'Count'})
 
-    scores_df = pd.DataFrame({'Type': ['homework', 'test', 'quiz'],
-                              'Min_Score': [min_score_homework, min_score_test, min_score_quiz],
-                              'Avg_Score': [avg_score_homework, avg_score_test, avg_score_quiz],
-                              'Max_Score': [max_score_homework, max_score_test, max_score_quiz]})
+    actions_df, scores_df, successful_assessments = summarize_assessments(
+        count_assessments(df, where={type_object: id}), object_def_types_w_verbs)
 
     return actions_df, scores_df, successful_assessments, total_students, total_students_in_courses
 
 
-def display(df, id_or_name):  # Тук подаваш оригиналната df и после е все тая дали ще е актьор или курс или институция
+def display(df, id_or_name, approximate=False):  # Тук подаваш оригиналната df и после е все тая дали ще е актьор или курс или институция
     """
     Display a visual summary of an actor, course, or institution's performance.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame containing relevant data.
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing relevant data.
     - id_or_name (int or str): The ID or name of the actor, course, or institution.
+    - approximate (bool): Whether to estimate the numbers of students of a course or institution from the sketches of
+      the dataset (see resume_course_or_institution). Default is False.
+
     Returns:
-    - Tuple[fig1, fig2, fig3]: The plots of each summary.
+    - Tuple[fig1, fig2, fig3]: The plots of each summary. fig3 ranks an actor in their course and institution, or
+      counts the students per course of an institution.
     """
     actions_df = None
     scores_df = None
@@ -312,9 +368,12 @@ def display(df, id_or_name):  # Тук подаваш оригиналната d
         actions_df, scores_df, successful_assessments, place = resume_actor(df, id_or_name)
     else:
         actions_df, scores_df, successful_assessments, total_students, total_students_in_courses = resume_course_or_institution(
-            df, id_or_name)
+            df, id_or_name, approximate)
 
-    fig1 = px.treemap(data_frame=actions_df, path=['Verb', 'Type'], values='Count', title='Actions')
+    title = 'Actions'
+    if total_students is not None:
+        title += ' of ' + ('about ' if approximate else '') + str(total_students) + ' students'
+    fig1 = px.treemap(data_frame=actions_df, path=['Verb', 'Type'], values='Count', title=title)
 
     scores_df = scores_df.fillna(0)
     scores_df = scores_df[(scores_df['Min_Score'] != 0) | (scores_df['Avg_Score'] != 0) | (scores_df['Max_Score'] != 0)]
@@ -322,7 +381,8 @@ def display(df, id_or_name):  # Тук подаваш оригиналната d
     bar_width = 0.2
     bar_positions = range(len(scores_df))
 
-    fig2, ax = plt.subplots()
+    fig2 = Figure()
+    ax = fig2.subplots()
 
     ax.bar([pos - bar_width for pos in bar_positions], scores_df['Min_Score'], width=bar_width, label='Min Score')
     ax.bar(bar_positions, scores_df['Avg_Score'], width=bar_width, label='Avg Score')
@@ -330,22 +390,23 @@ def display(df, id_or_name):  # Тук подаваш оригиналната d
 
     for pos, min_score, avg_score, max_score in zip(bar_positions, scores_df['Min_Score'], scores_df['Avg_Score'],
                                                     scores_df['Max_Score']):
-        plt.text(pos - bar_width, min_score, str(min_score)[:5], ha='center', va='bottom')
-        plt.text(pos, avg_score, str(avg_score)[:5], ha='center', va='bottom')
-        plt.text(pos + bar_width, max_score, str(max_score)[:5], ha='center', va='bottom')
+        ax.text(pos - bar_width, min_score, str(min_score)[:5], ha='center', va='bottom')
+        ax.text(pos, avg_score, str(avg_score)[:5], ha='center', va='bottom')
+        ax.text(pos + bar_width, max_score, str(max_score)[:5], ha='center', va='bottom')
 
-    plt.xlabel('Type')
-    plt.ylabel('Score')
-    plt.title('Scores')
+    ax.set_xlabel('Type')
+    ax.set_ylabel('Score')
+    ax.set_title('Scores')
 
-    plt.yticks([])
-    plt.xticks(bar_positions, scores_df['Type'])
-    plt.legend(loc=8)
+    ax.set_yticks([])
+    ax.set_xticks(bar_positions, scores_df['Type'])
+    ax.legend(loc=8)
 
     fig3 = None
 
     if place is not None:
-        fig3, ax = plt.subplots(nrows=2, ncols=1)
+        fig3 = Figure()
+        ax = fig3.subplots(nrows=2, ncols=1)
 
         x = [1, place[0][0], place[0][1]]
         y = [1, place[1][0], place[1][1]]
@@ -364,6 +425,9 @@ def display(df, id_or_name):  # Тук подаваш оригиналната d
         ax[1].scatter(y, np.zeros(len(x)), c='white')
         ax[1].scatter(y[1], 0, s=300, c='lightsteelblue')
         ax[1].set_title('Place in Institution')
-        plt.subplots_adjust(top=0.99, bottom=0.01, hspace=1.5, wspace=0.4)
+        fig3.subplots_adjust(top=0.99, bottom=0.01, hspace=1.5, wspace=0.4)
+    elif total_students_in_courses is not None:
+        fig3 = px.bar(total_students_in_courses, x='Course', y='Count', title='Students per course',
+                      labels={'Count': 'Students'})
 
     return fig1, fig2, fig3
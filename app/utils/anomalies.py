@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+BURST = 1
+DUPLICATE = 2
+NAMES = {BURST: 'Burst', DUPLICATE: 'Duplicate'}
+BURST_EVENTS = int(os.environ.get('ILEDA_BURST_EVENTS', 20))
+BURST_SECONDS = float(os.environ.get('ILEDA_BURST_SECONDS', 60))
+DUPLICATE_SECONDS = float(os.environ.get('ILEDA_DUPLICATE_SECONDS', 5))
+TEXT_COLUMNS = ['Course', 'verb.id', 'object.definition.type']
+RESULT_COLUMNS = ['result.score.scaled', 'result.success', 'result.completion']
+STATEMENT_COLUMNS = TEXT_COLUMNS + RESULT_COLUMNS
+
+
+def event_keys(frame):
+    """
+    Get the arrays the anomalies are detected on.
+
+    Parameters:
+    - frame (pd.DataFrame): Events with the actor, the timestamp and the statement columns.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray, np.ndarray]: The actor ID of every event (NaN as -1), its time in milliseconds and
+      a hash of its statement: the course, verb, object type and result. Texts are hashed once per distinct value and
+      results as numbers, so the hash does not depend on the types inferred for the chunk of a file it was read in.
+    """
+    actors = frame['actor.id'].fillna(-1).to_numpy(dtype=np.int64)
+    times = pd.to_datetime(frame['timestamp']).to_numpy(dtype='datetime64[ms]').astype(np.int64)
+
+    statements = np.zeros(len(frame), dtype=np.uint64)
+    for column in STATEMENT_COLUMNS:
+        if column in TEXT_COLUMNS:
+            codes, values = pd.factorize(frame[column])
+            hashes = np.append(pd.util.hash_array(np.asarray(values.astype(str), dtype=object)), np.uint64(0))[codes]
+        else:
+            hashes = pd.util.hash_array(frame[column].astype(float).to_numpy())
+        statements = statements * np.uint64(1000003) ^ hashes
+    return actors, times, statements
+
+
+def burst_flags(actors, times, events=BURST_EVENTS, seconds=BURST_SECONDS):
+    """
+    Flag the events of every window in which an actor has an unusually high event rate.
+
+    The events are sorted by actor and time, and the number of events of the actor in the sliding window ending at
+    every event is found by binary search on a combined actor and time key.
+
+    Parameters:
+    - actors (np.ndarray): The actor ID of every event.
+    - times (np.ndarray): The time of every event in milliseconds.
+    - events (int): The number of events within the window that makes a burst. Default is ILEDA_BURST_EVENTS or 20.
+    - seconds (float): The length of the window. Default is ILEDA_BURST_SECONDS or 60.
+
+    Returns:
+    - np.ndarray: Whether every event belongs to a burst.
+    """
+    n = len(actors)
+    flags = np.zeros(n, dtype=bool)
+    if n < events:
+        return flags
+
+    order = np.lexsort((times, actors))
+    window = int(seconds * 1000)
+    offsets = times[order] - times.min()
+    span = int(offsets.max()) + window + 1
+    codes = np.unique(actors, return_inverse=True)[1].astype(np.int64)
+    keys = codes[order] * span + offsets
+
+    # The window of an event covers the events of the same actor in the preceding `seconds`, itself included.
+    starts = np.searchsorted(keys, keys - window + 1, side='left')
+    ends = np.arange(n)
+    bursts = ends - starts + 1 >= events
+
+    # Flag every event of every window that reaches the threshold, not just the event closing it.
+    coverage = np.cumsum(np.bincount(starts[bursts], minlength=n + 1) - np.bincount(ends[bursts] + 1,
+                                                                                    minlength=n + 1))[:n]
+    flags[order] = coverage > 0
+    return flags
+
+
+def duplicate_flags(actors, times, statements, seconds=DUPLICATE_SECONDS):
+    """
+    Flag the repeats of a statement sent by the same actor shortly after the previous identical one.
+
+    Parameters:
+    - actors (np.ndarray): The actor ID of every event.
+    - times (np.ndarray): The time of every event in milliseconds.
+    - statements (np.ndarray): A hash of the statement of every event.
+    - seconds (float): The largest time between two identical statements of a repeat. Default is
+      ILEDA_DUPLICATE_SECONDS or 5.
+
+    Returns:
+    - np.ndarray: Whether every event repeats the previous identical statement of its actor. The first statement of a
+      sequence of repeats is not flagged.
+    """
+    flags = np.zeros(len(actors), dtype=bool)
+    if len(actors) < 2:
+        return flags
+
+    order = np.lexsort((times, statements, actors))
+    sorted_actors, sorted_statements, sorted_times = actors[order], statements[order], times[order]
+    flags[order[1:]] = ((sorted_actors[1:] == sorted_actors[:-1]) & (sorted_statements[1:] == sorted_statements[:-1]) &
+                        (np.diff(sorted_times) <= seconds * 1000))
+    return flags
+
+
+def flag(actors, times, statements):
+    """
+    Detect the anomalies of a log of events.
+
+    Parameters:
+    - actors (np.ndarray): The actor ID of every event.
+    - times (np.ndarray): The time of every event in milliseconds.
+    - statements (np.ndarray): A hash of the statement of every event.
+
+    Returns:
+    - np.ndarray: The anomalies of every event, as a combination of the BURST and DUPLICATE bits (0 for a normal
+      event).
+    """
+    return (burst_flags(actors, times) * BURST + duplicate_flags(actors, times, statements) * DUPLICATE).astype(np.int8)
+
+
+def flag_events(frame):
+    """
+    Detect the anomalies of the events of a DataFrame (see flag).
+
+    Parameters:
+    - frame (pd.DataFrame): The events, with the columns of processed.csv.
+
+    Returns:
+    - np.ndarray: The anomalies of every row.
+    """
+    return flag(*event_keys(frame))
+
+
+def summarize(backend):
+    """
+    Count the flagged events and actors of a dataset.
+
+    Parameters:
+    - backend (QueryBackend): The query backend of a dataset with an 'anomaly' column.
+
+    Returns:
+    - dict: The number of events, of flagged events, of events per kind of anomaly and of actors with flagged events.
+    """
+    counts = backend.count(['anomaly'])
+    codes, events = counts['anomaly'].fillna(0).to_numpy(dtype=int), counts['count'].to_numpy()
+    flagged = [int(code) for code in codes if code]
+    return {
+        'events': int(events.sum()),
+        'flagged': int(events[codes > 0].sum()),
+        **{name: int(events[(codes & bit) > 0].sum()) for bit, name in NAMES.items()},
+        'actors': len(backend.distinct(['actor.id'], {'anomaly': flagged})) if flagged else 0
+    }
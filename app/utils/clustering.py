@@ -1,12 +1,14 @@
 import os
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import plotly.express as px
+from matplotlib.figure import Figure
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
 
+CLUSTERING_DIRECTORY = 'data/clustering_data'
+
 
 def load_courses(directory):
     """
@@ -39,6 +41,19 @@ def load_courses(directory):
     return courses
 
 
+def clustering_path(course):
+    """
+    Get the path of the clustering features of a course.
+
+    Parameters:
+    - course (str): The name of the course.
+
+    Returns:
+    - str: The path of the CSV file read by cluster.
+    """
+    return os.path.join(CLUSTERING_DIRECTORY, course.replace(' ', '_') + '.csv')
+
+
 def cluster(course_name, number_of_clusters=3):
     """
     Perform K-means clustering on course data and generate 3D visualization with PCA.
@@ -50,7 +65,7 @@ def cluster(course_name, number_of_clusters=3):
     Returns:
     - tuple: Two figures - 3D scatter plot and bar plot of the most important features.
     """
-    courses = load_courses('data/clustering_data')  # Tук пътя трябва да оправим
+    courses = load_courses(CLUSTERING_DIRECTORY)
     course_name = course_name.replace(' ', '_')
     df = courses[course_name]
 
@@ -91,7 +106,8 @@ def cluster(course_name, number_of_clusters=3):
         'second': [first_axis[1][1], second_axis[1][1], third_axis[1][1]],
         'third': [first_axis[2][1], second_axis[2][1], third_axis[2][1]]
     })
-    fig2, ax = plt.subplots()
+    fig2 = Figure()
+    ax = fig2.subplots()
 
     bar_width = 0.2
     bar_positions = range(3)
@@ -116,7 +132,7 @@ def cluster(course_name, number_of_clusters=3):
     )
 
     for pos in bar_positions:
-        plt.text(
+        ax.text(
             pos + bar_width,
             0 + first_axis[pos][1] / 10,
             all_axis[pos][0][0],
@@ -124,7 +140,7 @@ def cluster(course_name, number_of_clusters=3):
             va='bottom',
             rotation=90
         )
-        plt.text(
+        ax.text(
             pos,
             0 + second_axis[pos][1] / 10,
             all_axis[pos][1][0],
@@ -132,7 +148,7 @@ def cluster(course_name, number_of_clusters=3):
             va='bottom',
             rotation=90
         )
-        plt.text(
+        ax.text(
             pos - bar_width,
             0 + third_axis[pos][1] / 10,
             all_axis[pos][2][0],
@@ -141,9 +157,9 @@ def cluster(course_name, number_of_clusters=3):
             rotation=90
         )
 
-    plt.xticks(bar_positions, ['X', 'Y', 'Z'])
-    plt.xlabel('Axis')
-    plt.ylabel('Value')
-    plt.title('Most Important Features')
+    ax.set_xticks(bar_positions, ['X', 'Y', 'Z'])
+    ax.set_xlabel('Axis')
+    ax.set_ylabel('Value')
+    ax.set_title('Most Important Features')
 
     return fig1, fig2
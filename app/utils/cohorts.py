@@ -0,0 +1,380 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from utils import query_backend, sessions, time_series
+
+DEFAULT_WORKERS = int(os.environ.get('ILEDA_COHORT_WORKERS', os.cpu_count() or 1))
+DEFAULT_RESAMPLES = 2000
+TASK_RESAMPLES = 250
+POOL_THRESHOLD = 20_000_000
+CHUNK_CELLS = 2_000_000
+CONFIDENCE = 0.95
+
+
+def actor_metrics(df, where=None):
+    """
+    Compute the metrics of every actor from the events matching a filter.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - where (dict, optional): The filter of the events (see QueryBackend). A 'timestamp' slice also selects the
+      sessions starting in that range.
+
+    Returns:
+    - pd.DataFrame: One row per actor with their interaction counts (in total, per verb and per object type), active
+      days, graded and non-graded activities, mean score, success and completion rates and session metrics. Metrics
+      that are undefined for an actor (e.g. the mean score of an actor without scores) are NaN.
+    """
+    backend = query_backend.get_backend(df)
+    counts = backend.aggregate(['actor.id', 'verb.id', 'object.definition.type', 'scored', 'result.success',
+                                'result.completion'], 'result.score.scaled', where).dropna(subset=['actor.id'])
+    if counts.empty:
+        return pd.DataFrame(index=pd.Index([], name='actor.id'))
+
+    assessments, non_assessments = time_series.classify_actions(counts)
+    scored = counts['scored'].astype(bool)
+    grouped = counts.assign(
+        assessments=counts['count'].where(assessments, 0),
+        non_assessments=counts['count'].where(non_assessments, 0),
+        scored_count=counts['count'].where(scored, 0),
+        successes=counts['count'].where(scored & (counts['result.success'] == True), 0),
+        completions=counts['count'].where(counts['result.completion'] == True, 0),
+        score_sum=counts['sum'].fillna(0)
+    ).groupby('actor.id')
+    totals = grouped[['count', 'assessments', 'non_assessments', 'scored_count', 'successes', 'completions',
+                      'score_sum', 'n']].sum()
+
+    metrics = pd.DataFrame({'Events': totals['count']}, index=totals.index)
+    days = backend.count(['actor.id', 'date'], where).dropna().groupby('actor.id').size()
+    metrics['Active days'] = days.reindex(metrics.index).fillna(0)
+    metrics['Events per active day'] = metrics['Events'] / metrics['Active days'].where(metrics['Active days'] > 0)
+    metrics['Graded assessments'] = totals['assessments']
+    metrics['Non-graded activities'] = totals['non_assessments']
+    metrics['Mean score'] = totals['score_sum'] / totals['n'].where(totals['n'] > 0)
+    metrics['Success rate'] = totals['successes'] / totals['scored_count'].where(totals['scored_count'] > 0)
+    metrics['Completion rate'] = totals['completions'] / totals['count']
+
+    for column, prefix in [('verb.id', 'Verb: '), ('object.definition.type', 'Object: ')]:
+        table = counts.pivot_table(index='actor.id', columns=column, values='count', aggfunc='sum', fill_value=0)
+        metrics = metrics.join(table.add_prefix(prefix)).fillna({prefix + name: 0 for name in table.columns})
+
+    return metrics.join(session_metrics(df, where))
+
+
+def session_metrics(df, where=None):
+    """
+    Summarize the study sessions of every actor matching a filter (see sessions.sessionize).
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - where (dict, optional): The filter. Only the 'Institution', 'Course', 'Teaching' and 'timestamp' keys apply to
+      sessions.
+
+    Returns:
+    - pd.DataFrame: The number of sessions, median session duration in minutes and events per session of every actor.
+    """
+    selected = sessions.get_sessions(df)
+    where = where or {}
+
+    if 'Teaching' in where:
+        courses = query_backend.get_backend(df).distinct(['Course'], {'Teaching': where['Teaching']})['Course']
+        selected = selected[selected['Course'].isin(courses)]
+    for column in ['Institution', 'Course']:
+        if column in where:
+            values = where[column] if isinstance(where[column], (list, tuple, set)) else [where[column]]
+            selected = selected[selected[column].isin(values)]
+    if 'timestamp' in where:
+        start, stop = where['timestamp'].start, where['timestamp'].stop
+        if start is not None:
+            selected = selected[selected['start'] >= start]
+        if stop is not None:
+            selected = selected[selected['start'] < stop]
+
+    summary = sessions.session_metrics(selected, 'actor.id')
+    return pd.DataFrame({
+        'Sessions': summary['Sessions'],
+        'Median session (min)': summary['Median duration (min)'],
+        'Events per session': summary['Events per session']
+    })
+
+
+def _moments(weights, values, known):
+    """
+    Compute the weighted means and variances of every metric for a batch of resamples at once.
+
+    Parameters:
+    - weights (np.ndarray): The weight of every actor in every resample, with shape (resamples, actors).
+    - values (np.ndarray): The metrics, with NaN replaced by 0, with shape (actors, metrics).
+    - known (np.ndarray): Whether every metric is defined, with the same shape.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray, np.ndarray]: The means, variances and numbers of values, with shape
+      (resamples, metrics).
+    """
+    n = weights @ known
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (weights @ values) / n
+        variances = ((weights @ values ** 2) - n * means ** 2) / (n - 1)
+    return means, np.clip(variances, 0, None), n
+
+
+def _effects(moments_a, moments_b):
+    """
+    Compute the difference of means and Hedges' g of every metric from the moments of two groups.
+    """
+    (mean_a, var_a, n_a), (mean_b, var_b, n_b) = moments_a, moments_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled = np.sqrt(((n_a - 1) * var_a + (n_b - 1) * var_b) / (n_a + n_b - 2))
+        correction = 1 - 3 / (4 * (n_a + n_b) - 9)
+        return mean_a - mean_b, (mean_a - mean_b) / pooled * correction
+
+
+def _prepare(values):
+    known = ~np.isnan(values)
+    return np.where(known, values, 0), known.astype(float)
+
+
+def _percentile(samples, q):
+    defined = ~np.isnan(samples).all(axis=0)
+    result = np.full(samples.shape[1], np.nan)
+    result[defined] = np.nanpercentile(samples[:, defined], q, axis=0)
+    return result
+
+
+def _bootstrap_weights(rng, n, size):
+    draws = rng.integers(0, n, (size, n)) + np.arange(size)[:, None] * n
+    return np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(float)
+
+
+def _resample(values_a, values_b, n_resamples, seed):
+    """
+    Run a task of bootstrap and permutation resamples. Runs in the worker processes.
+
+    Parameters:
+    - values_a (np.ndarray): The metrics of the first cohort, with shape (actors, metrics).
+    - values_b (np.ndarray): The metrics of the second cohort.
+    - n_resamples (int): The number of resamples of each kind.
+    - seed (np.random.SeedSequence): The seed of the task.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray, np.ndarray]: The bootstrapped differences and Hedges' g, with shape
+      (resamples, metrics), and the number of permutations whose difference is at least as extreme as the observed one,
+      for every metric.
+    """
+    rng = np.random.default_rng(seed)
+    (a, known_a), (b, known_b) = _prepare(values_a), _prepare(values_b)
+    n_a, n_b = len(a), len(b)
+    pooled, known = np.vstack([a, b]), np.vstack([known_a, known_b])
+    observed, _ = _effects(_moments(np.ones((1, n_a)), a, known_a), _moments(np.ones((1, n_b)), b, known_b))
+    totals = np.ones((1, n_a + n_b)) @ pooled, np.ones((1, n_a + n_b)) @ known
+
+    chunk = max(1, CHUNK_CELLS // (n_a + n_b))
+    differences, effects, extreme = [], [], np.zeros(a.shape[1])
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+
+        # Bootstrap: every resample draws the actors of each cohort with replacement, counted as weights.
+        weights_a, weights_b = _bootstrap_weights(rng, n_a, size), _bootstrap_weights(rng, n_b, size)
+        difference, effect = _effects(_moments(weights_a, a, known_a), _moments(weights_b, b, known_b))
+        differences.append(difference)
+        effects.append(effect)
+
+        # Permutation: every resample relabels the pooled actors; the second cohort gets the remaining sums.
+        labels = rng.permuted(np.tile(np.repeat([1.0, 0.0], [n_a, n_b]), (size, 1)), axis=1)
+        sums, counts = labels @ pooled, labels @ known
+        with np.errstate(invalid='ignore', divide='ignore'):
+            permuted = sums / counts - (totals[0] - sums) / (totals[1] - counts)
+        extreme += (np.abs(permuted) >= np.abs(observed) - 1e-12).sum(axis=0)
+
+    return np.vstack(differences), np.vstack(effects), extreme
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers=DEFAULT_WORKERS):
+    """
+    Get the process pool running the resamples, starting it on first use.
+
+    The workers are spawned rather than forked, so that they never inherit locks held by the threads of the app.
+
+    Parameters:
+    - workers (int): The number of worker processes. Default is ILEDA_COHORT_WORKERS or the number of CPUs.
+
+    Returns:
+    - ProcessPoolExecutor: The pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def reset_pool():
+    """
+    Shut down the process pool, if started. The next comparison starts a new one.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def adjust(p_values):
+    """
+    Adjust p-values for the number of metrics compared, with the Benjamini-Hochberg procedure.
+
+    Parameters:
+    - p_values (np.ndarray): The p-values.
+
+    Returns:
+    - np.ndarray: The adjusted p-values (false discovery rates).
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    adjusted = np.empty_like(p_values)
+    adjusted[order] = np.minimum(1, np.minimum.accumulate(ranked[::-1])[::-1])
+    return adjusted
+
+
+def compare(metrics_a, metrics_b, n_resamples=DEFAULT_RESAMPLES, seed=0, workers=DEFAULT_WORKERS):
+    """
+    Compare every metric of two cohorts of actors with bootstrap confidence intervals and permutation tests.
+
+    The resamples are split into tasks of 250 with their own seeds, so the results only depend on the seed. The tasks
+    run on the process pool when there are enough of them and enough actors to make it worthwhile, and in this process
+    otherwise.
+
+    Parameters:
+    - metrics_a (pd.DataFrame): The metrics of the first cohort, one row per actor (see actor_metrics).
+    - metrics_b (pd.DataFrame): The metrics of the second cohort.
+    - n_resamples (int): The number of bootstrap and of permutation resamples. Default is 2000.
+    - seed (int): The seed. Default is 0.
+    - workers (int): The number of worker processes. 0 or 1 runs every task in this process.
+
+    Returns:
+    - pd.DataFrame: For every metric, the number of actors and the mean in each cohort, the difference of means with
+      its 95% bootstrap interval, Hedges' g with its interval, and the permutation p-value, raw and adjusted for the
+      number of metrics.
+    """
+    columns = metrics_a.columns.union(metrics_b.columns, sort=False)
+    values_a = metrics_a.reindex(columns=columns).to_numpy(dtype=float)
+    values_b = metrics_b.reindex(columns=columns).to_numpy(dtype=float)
+
+    tasks = [min(TASK_RESAMPLES, n_resamples - start) for start in range(0, n_resamples, TASK_RESAMPLES)]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    arguments = [(values_a, values_b, size, task_seed) for size, task_seed in zip(tasks, seeds)]
+
+    if workers > 1 and len(tasks) > 1 and n_resamples * (len(values_a) + len(values_b)) * len(columns) > \
+            POOL_THRESHOLD:
+        try:
+            results = list(get_pool(workers).map(_resample, *zip(*arguments)))
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a new pool next time and finish here.
+            reset_pool()
+            results = [_resample(*task) for task in arguments]
+    else:
+        results = [_resample(*task) for task in arguments]
+
+    differences = np.vstack([result[0] for result in results])
+    effects = np.vstack([result[1] for result in results])
+    extreme = sum(result[2] for result in results)
+
+    moments_a = _moments(np.ones((1, len(values_a))), *_prepare(values_a))
+    moments_b = _moments(np.ones((1, len(values_b))), *_prepare(values_b))
+    difference, effect = _effects(moments_a, moments_b)
+
+    tail = (1 - CONFIDENCE) / 2 * 100
+    with np.errstate(invalid='ignore'):
+        p_values = (extreme + 1) / (n_resamples + 1)
+    result = pd.DataFrame({
+        'Actors A': moments_a[2][0].astype(int),
+        'Actors B': moments_b[2][0].astype(int),
+        'Mean A': moments_a[0][0],
+        'Mean B': moments_b[0][0],
+        'Difference': difference[0],
+        'CI low': _percentile(differences, tail),
+        'CI high': _percentile(differences, 100 - tail),
+        "Hedges' g": effect[0],
+        'g CI low': _percentile(effects, tail),
+        'g CI high': _percentile(effects, 100 - tail),
+        'p-value': p_values
+    }, index=pd.Index(columns, name='Metric'))
+
+    testable = result[['Actors A', 'Actors B']].min(axis=1) >= 2
+    result.loc[~testable, ['CI low', 'CI high', "Hedges' g", 'g CI low', 'g CI high', 'p-value']] = np.nan
+    result['Adjusted p-value'] = np.nan
+    result.loc[testable, 'Adjusted p-value'] = adjust(result.loc[testable, 'p-value'].to_numpy())
+    return result
+
+
+def describe(where):
+    """
+    Describe a cohort filter in words.
+
+    Parameters:
+    - where (dict): The filter.
+
+    Returns:
+    - str: The description, e.g. 'Teaching: Flipped classroom; Institution: UEF, SU'.
+    """
+    parts = []
+    for column, value in where.items():
+        if column == 'timestamp':
+            value = ' to '.join('...' if bound is None else f'{bound:%Y-%m-%d}' for bound in [value.start, value.stop])
+        elif isinstance(value, (list, tuple, set)):
+            value = ', '.join(str(element) for element in value)
+        parts.append(column + ': ' + str(value))
+    return '; '.join(parts) or 'All actors'
+
+
+def display(df, where_a, where_b, n_resamples=DEFAULT_RESAMPLES, seed=0):
+    """
+    Compare two cohorts of actors.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - where_a (dict): The filter of the events of the first cohort (see QueryBackend), e.g. {'Teaching': 'Flipped
+      classroom'}. Any of 'Teaching', 'Institution', 'Course' and 'timestamp' can be combined.
+    - where_b (dict): The filter of the second cohort.
+    - n_resamples (int): The number of bootstrap and of permutation resamples. Default is 2000.
+    - seed (int): The seed. Default is 0.
+
+    Returns:
+    - Tuple[pd.DataFrame, Figure]: The comparison of every metric (see compare), ordered by adjusted p-value, and a
+      forest plot of the effect sizes. The figure is None if a cohort has fewer than two actors.
+    """
+    metrics_a, metrics_b = actor_metrics(df, where_a or None), actor_metrics(df, where_b or None)
+    if len(metrics_a) < 2 or len(metrics_b) < 2:
+        return pd.DataFrame(), None
+
+    result = compare(metrics_a, metrics_b, n_resamples, seed).sort_values(['Adjusted p-value', 'p-value'])
+    shown = result.dropna(subset=["Hedges' g"]).iloc[::-1]
+
+    fig = Figure(figsize=(8, max(4, 0.3 * len(shown) + 1)))
+    ax = fig.subplots()
+    positions = np.arange(len(shown))
+    significant = (shown['Adjusted p-value'] < 0.05).to_numpy()
+    for mask, colour in [(significant, 'indianred'), (~significant, 'gray')]:
+        effect = shown["Hedges' g"].to_numpy()[mask]
+        errors = np.abs(shown[['g CI low', 'g CI high']].to_numpy()[mask].T - effect)
+        ax.errorbar(effect, positions[mask], xerr=errors, fmt='o', color=colour, capsize=2)
+    ax.axvline(0, c='black', linewidth=0.8)
+    ax.set_yticks(positions)
+    ax.set_yticklabels(shown.index)
+    ax.set_xlabel("Hedges' g (A - B)")
+    ax.set_title('Effect Sizes')
+    fig.tight_layout()
+
+    return result.round(4), fig
@@ -0,0 +1,402 @@
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import pandas as pd
+
+from utils import actor_engagement, clustering, cohorts, course_popularity, early_warning, figure_cache, forecasting, \
+    linear_regression, network_analysis, process_mining, query_backend, sessions, time_series, verbs, versioning, \
+    warmup
+
+ADDRESS = os.environ.get('ILEDA_BACKEND_ADDRESS')
+AUTHKEY_PATH = os.environ.get('ILEDA_BACKEND_KEY_PATH', 'data/backend.key')
+
+
+class BackendError(RuntimeError):
+    """
+    A request failed on the compute backend.
+    """
+
+
+class BackendBusy(ConnectionError):
+    """
+    The compute backend could not start a request before its queue timeout.
+    """
+
+
+class VersionMismatch(BackendError):
+    """
+    The compute backend serves another version of the data than the client's.
+    """
+
+
+def read_authkey(path=AUTHKEY_PATH):
+    """
+    Get the key clients and the backend authenticate with: ILEDA_BACKEND_AUTHKEY if it is set, else the content of the
+    key file written by the backend.
+
+    Parameters:
+    - path (str): The path of the key file. Default is ILEDA_BACKEND_KEY_PATH or data/backend.key.
+
+    Returns:
+    - bytes or None: The key, or None if there is none.
+    """
+    if os.environ.get('ILEDA_BACKEND_AUTHKEY'):
+        return os.environ['ILEDA_BACKEND_AUTHKEY'].encode()
+    try:
+        with open(path, 'rb') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def create_authkey(path=AUTHKEY_PATH):
+    """
+    Get the key of the backend, generating a random one readable only by its owner if there is none.
+
+    The backend unpickles the requests of authenticated clients, so the key must not be guessable: there is no
+    default key.
+
+    Parameters:
+    - path (str): The path of the key file. Default is ILEDA_BACKEND_KEY_PATH or data/backend.key.
+
+    Returns:
+    - bytes: The key.
+
+    Raises:
+    - PermissionError: If the existing key file can be read by other users.
+    """
+    key = read_authkey(path)
+    if key is not None:
+        if not os.environ.get('ILEDA_BACKEND_AUTHKEY') and os.stat(path).st_mode & 0o077:
+            raise PermissionError(f'The key file {path} must only be accessible by its owner (chmod 600).')
+        return key
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    key = secrets.token_hex(32).encode()
+    temporary = path + '.' + str(os.getpid()) + '.tmp'
+    descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(key)
+    os.replace(temporary, path)
+    return key
+
+
+def builder_name(func):
+    """
+    Get the name under which a figure builder is exposed by the backend.
+
+    Parameters:
+    - func (callable): The figure builder.
+
+    Returns:
+    - str: The name, e.g. 'clustering.cluster'.
+    """
+    return func.__module__.split('.')[-1] + '.' + func.__name__
+
+
+BUILDERS = {builder_name(func): func for func in [
+    actor_engagement.display,
+    clustering.cluster,
+    cohorts.display,
+    early_warning.display,
+    course_popularity.course_popularity,
+    course_popularity.get_interaction_boxplot,
+    course_popularity.get_interaction_pie,
+    course_popularity.get_median_scatter,
+    forecasting.display,
+    forecasting.next_week,
+    linear_regression.regression,
+    linear_regression.streaming_regression,
+    network_analysis.get_network,
+    process_mining.compare_actor,
+    process_mining.display,
+    sessions.display,
+    time_series.analyze_time_series,
+    time_series.display_course_or_institution_actions,
+    verbs.get_verb_figures,
+    verbs.get_verb_lollipop,
+    verbs.get_verb_radar_course,
+    verbs.get_verb_radar_verb
+]}
+
+
+class DatasetRef:
+    """
+    Placeholder sent instead of the dataset; the backend substitutes its own copy of the data, restricted to the same
+    date range and leaving out the anomalies if the client's copy does.
+    """
+
+    def __init__(self, time_range=None, exclude_anomalies=False):
+        self.time_range = time_range
+        self.exclude_anomalies = exclude_anomalies
+
+    def __eq__(self, other):
+        return (isinstance(other, DatasetRef) and other.time_range == self.time_range and
+                other.exclude_anomalies == self.exclude_anomalies)
+
+    def __hash__(self):
+        return hash((DatasetRef, self.time_range, self.exclude_anomalies))
+
+
+def parse_address(address):
+    """
+    Parse a 'host:port' address.
+
+    Parameters:
+    - address (str): The address.
+
+    Returns:
+    - Tuple[str, int]: The host and the port.
+    """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class ComputeServer:
+    """
+    A compute backend shared by all dashboard sessions.
+
+    Requests for the same figure are coalesced into one computation and the results are kept in the backend's figure
+    cache. At most max_workers figures are computed at a time and at most max_queue further requests wait for a slot.
+    """
+
+    def __init__(self, data_path, max_workers=4, max_queue=64, queue_timeout=120, warmup_workers=2):
+        self.data_path = data_path
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.warmup_workers = warmup_workers
+        self.pending = 0
+        self._df = None
+        self._version = None
+        self._restricted = OrderedDict()
+        self._data_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='compute')
+
+    def dataset(self, version):
+        """
+        Get the dataset, reloading it when the data file changes.
+
+        The backend follows the version of its own data file, so clients that loaded another version cannot make it
+        reload back and forth: their requests are rejected and they compute the figures themselves.
+
+        Parameters:
+        - version (str): The data version reported by the client.
+
+        Returns:
+        - pd.DataFrame or QueryBackend: The dataset (see query_backend.open_dataset).
+
+        Raises:
+        - VersionMismatch: If the client's version is not the current version of the data file.
+        """
+        current = versioning.version(self.data_path)
+        if version != current:
+            raise VersionMismatch(f'The backend serves data version {current}, not {version}.')
+
+        with self._data_lock:
+            if current != self._version:
+                df = query_backend.open_dataset(self.data_path)
+                self._df, self._version = df, current
+                self._restricted.clear()
+                warmup.start(warmup.page_tasks(df), current, self.warmup_workers)
+            return self._df
+
+    def restricted(self, df, time_range, exclude_anomalies=False, max_entries=4):
+        """
+        Get the dataset restricted to a date range, keeping the most recently used ranges.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): The dataset, as returned by dataset.
+        - time_range (Tuple[pd.Timestamp, pd.Timestamp] or None): The range, or None for the full dataset.
+        - exclude_anomalies (bool): Whether to leave out the events flagged as anomalies. Default is False.
+        - max_entries (int): The number of ranges kept. Default is 4.
+
+        Returns:
+        - pd.DataFrame or QueryBackend: The restricted dataset.
+        """
+        if time_range is None and not exclude_anomalies:
+            return df
+
+        key = (time_range, exclude_anomalies)
+        with self._data_lock:
+            if df is not self._df:
+                return query_backend.restrict(df, *(time_range or (None, None)), exclude_anomalies)
+            restricted = self._restricted.get(key)
+            if restricted is None:
+                restricted = query_backend.restrict(df, *(time_range or (None, None)), exclude_anomalies)
+                self._restricted[key] = restricted
+                while len(self._restricted) > max_entries:
+                    self._restricted.popitem(last=False)
+            self._restricted.move_to_end(key)
+            return restricted
+
+    def call(self, name, args, kwargs, version):
+        """
+        Compute a figure builder call, or take it from the cache.
+
+        Parameters:
+        - name (str): The name of the builder (see BUILDERS).
+        - args (tuple): The positional arguments, with DatasetRef in place of the dataset.
+        - kwargs (dict): The keyword arguments.
+        - version (str): The data version reported by the client.
+
+        Returns:
+        - The rendered result of the builder.
+        """
+        func = BUILDERS[name]
+        df = self.dataset(version)
+        args = [self.restricted(df, arg.time_range, arg.exclude_anomalies) if isinstance(arg, DatasetRef) else arg
+                for arg in args]
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise BackendBusy('The compute backend is busy, try again later.')
+
+        with self._pending_lock:
+            self.pending += 1
+
+        try:
+            return self._executor.submit(figure_cache.cached, func, *args, version=version, **kwargs).result()
+        finally:
+            with self._pending_lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def status(self):
+        """
+        Get the state of the backend.
+
+        Returns:
+        - dict: The data version, the warm-up status, the figure cache statistics, the number of distinct
+          computations in flight and the number of requests being computed or queued.
+        """
+        scheduler = warmup.current()
+        return {
+            'version': self._version,
+            'warmup': None if scheduler is None else scheduler.status(),
+            'cache': figure_cache.figure_cache.stats(),
+            'in_flight': figure_cache.coalescer.in_flight(),
+            'pending': self.pending,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue
+        }
+
+    def handle(self, connection):
+        """
+        Answer the requests sent over a connection until the client closes it.
+
+        Parameters:
+        - connection (Connection): The client connection.
+        """
+        try:
+            while True:
+                request = connection.recv()
+                try:
+                    if request[0] == 'status':
+                        response = ('ok', self.status())
+                    else:
+                        response = ('ok', self.call(*request[1:]))
+                except BackendBusy as error:
+                    response = ('busy', str(error))
+                except VersionMismatch as error:
+                    response = ('version', str(error))
+                except Exception as error:
+                    response = ('error', repr(error))
+                connection.send(response)
+        except EOFError:
+            pass
+        finally:
+            connection.close()
+
+    def serve_forever(self, address, authkey=None):
+        """
+        Accept client connections, each served on its own thread.
+
+        Parameters:
+        - address (str): The 'host:port' address to listen on.
+        - authkey (bytes, optional): The key clients must authenticate with. Default is the key of create_authkey.
+        """
+        authkey = authkey or create_authkey()
+        backlog = self.max_workers + self.max_queue
+        with Listener(parse_address(address), backlog=backlog, authkey=authkey) as listener:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    continue
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+
+class ComputeClient:
+    """
+    A client of the compute backend, used by the page scripts.
+    """
+
+    def __init__(self, address, authkey=None):
+        self.address = parse_address(address)
+        self.authkey = authkey
+
+    def _request(self, request):
+        # The key file is read on every request, as the backend may create it after the client.
+        authkey = self.authkey or read_authkey()
+        if authkey is None:
+            raise ConnectionError('No key to authenticate with the compute backend (see ILEDA_BACKEND_AUTHKEY).')
+
+        try:
+            with Client(self.address, authkey=authkey) as connection:
+                connection.send(request)
+                status, value = connection.recv()
+        except (AuthenticationError, EOFError) as error:
+            raise ConnectionError(str(error)) from error
+
+        if status == 'busy':
+            raise BackendBusy(value)
+        if status == 'version':
+            raise VersionMismatch(value)
+        if status == 'error':
+            raise BackendError(value)
+        return value
+
+    def call(self, func, *args, version=None, **kwargs):
+        """
+        Compute a figure builder call on the backend.
+
+        Parameters:
+        - func (callable): The figure builder, one of BUILDERS.
+        - args: The positional arguments. DataFrames and query backends must be the full dataset or the full dataset
+          restricted to a date range (see query_backend.restrict) and are not sent.
+        - version (str, optional): The data version.
+        - kwargs: The keyword arguments.
+
+        Returns:
+        - The rendered result of the builder.
+        """
+        args = tuple(DatasetRef(query_backend.time_range(arg), query_backend.excludes_anomalies(arg))
+                     if isinstance(arg, (pd.DataFrame, query_backend.QueryBackend)) else arg for arg in args)
+        return self._request(('call', builder_name(func), args, kwargs, version))
+
+    def status(self):
+        """
+        Get the state of the backend (see ComputeServer.status).
+
+        Returns:
+        - dict: The state of the backend.
+        """
+        return self._request(('status',))
+
+
+def client_from_env():
+    """
+    Create a client for the backend configured in ILEDA_BACKEND_ADDRESS.
+
+    Returns:
+    - ComputeClient or None: The client, or None if no backend is configured.
+    """
+    return None if not ADDRESS else ComputeClient(ADDRESS)
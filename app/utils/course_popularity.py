@@ -1,74 +1,198 @@
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib.figure import Figure
 
+from utils import network_analysis, query_backend, sketches
 
-def course_popularity(df):
+
+def box_statistics(sketch, label):
     """
-    Analyzes course popularity based on user interactions and visualizes the results through three plots.
+    Get the statistics of a notched box plot from a sketch of a distribution, for Axes.bxp.
 
     Parameters:
-    - df (pd.DataFrame): Input DataFrame containing the dataset.
+    - sketch (KLL): The sketch.
+    - label (str): The label of the box.
 
     Returns:
-    - fig1 (plt.Figure): Pie chart depicting the distribution of user interactions across courses.
-    - fig2 (plt.Figure): Boxplot illustrating the variation in user interactions by course.
-    - fig3 (plt.Figure): Scatter plot showing the relationship between the median interaction count per person
-                        and the number of students enrolled in each course.
+    - dict: The quartiles, the whiskers (the furthest values within 1.5 times the interquartile range, estimated by
+      the minimum and maximum when they are closer) and the confidence interval of the median.
+    """
+    q1, median, q3 = sketch.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    return {
+        'label': label,
+        'q1': q1,
+        'med': median,
+        'q3': q3,
+        'whislo': max(sketch.min, q1 - 1.5 * iqr),
+        'whishi': min(sketch.max, q3 + 1.5 * iqr),
+        'cilo': median - 1.57 * iqr / np.sqrt(sketch.n),
+        'cihi': median + 1.57 * iqr / np.sqrt(sketch.n),
+        'fliers': []
+    }
+
+
+def popularity_statistics(df, approximate=False):
+    """
+    Compute the statistics behind the course popularity plots.
+
+    All statistics are derived from the number of interactions of every actor in every course, aggregated by the
+    query backend in a single pass. In approximate mode they come from the sketches of the dataset instead (see
+    sketches.SketchStore): the numbers of students are HyperLogLog estimates, the medians and boxes KLL estimates
+    (without outliers) and the interaction totals are exact. The interactions per person are not additive over days,
+    so in a date range their sketches are built from the per-actor counts of the range.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing the dataset.
+    - approximate (bool): Whether to use the sketches. Default is False.
+
+    Returns:
+    - dict: The interactions per course ('course_counts', most first), the colour of the institution of every course
+      ('color_df'), the interactions per person of every course ('actor_interactions', the boxes and their labels) and
+      the median interaction count, the number of students and the teaching type of every course ('median_count').
     """
+    if approximate:
+        store = sketches.get_store(df)
+        start, stop = sketches.date_range(df)
+        groups = store.select(None, None, start, stop)
+        events = pd.Series(store.events[groups], index=store.groups['Course'].to_numpy()[groups])
+        counts = store.courses[store.courses['Course'].isin(events.index)]
+        course_counts = events.groupby(level=0, sort=False).sum().reindex(counts['Course']).sort_values(
+            ascending=False, kind='stable')
+    else:
+        counts = query_backend.get_backend(df).count(['Institution', 'Course', 'Teaching', 'actor.id'])
+        actor_counts = counts.groupby(['Course', 'actor.id'], sort=False)['count'].sum()
+        course_counts = actor_counts.groupby(level=0, sort=False).sum().sort_values(ascending=False, kind='stable')
+
+    institutions = sorted(counts['Institution'].dropna().unique())
     color_df = pd.DataFrame({
-        'Institution': df['Institution'].unique(),
-        'color': ['red', 'blue', 'green', 'yellow']
+        'Institution': institutions,
+        'color': network_analysis.get_palette(len(institutions))
     })
-    color_df = color_df.merge(df[['Course', 'Institution']].drop_duplicates(), how='left')
+    color_df = color_df.merge(counts[['Course', 'Institution']].drop_duplicates(), how='left')
+
+    if approximate:
+        if start is None and stop is None:
+            interactions = {course: store.interaction_sketch('Course', course) for course in counts['Course']}
+        else:
+            per_actor = query_backend.get_backend(df).count(['Course', 'actor.id'])
+            interactions = {course: sketches.KLL(store.k).add(values['count'].to_numpy())
+                            for course, values in per_actor.groupby('Course', sort=False)}
+        df_actor_count = pd.DataFrame({'actor.id': [round(store.distinct_actors('Course', course, start, stop))
+                                                    for course in counts['Course']]},
+                                      index=pd.Index(counts['Course'], name='Course'))
+        actor_interactions = [
+            [box_statistics(interactions[course], course) for course in counts['Course']],
+            counts['Course'].tolist()
+        ]
+    else:
+        df_actor_count = actor_counts.groupby(level=0).size().to_frame('actor.id')
+        actor_interactions = [
+            [
+                actor_counts[course_name].sort_index().rename('size')
+                for course_name in counts['Course'].unique()
+            ],
+            [
+                course_name
+                for course_name in counts['Course'].unique()
+            ],
+        ]
+
+    if approximate:
+        df_median_interaction = pd.DataFrame({
+            'Course': counts['Course'],
+            'median': [interactions[course].quantile(0.5) for course in counts['Course']]
+        })
+    else:
+        df_median_interaction = actor_counts.groupby(level=0).median().to_frame('median').reset_index()
+
+    df_median_count = df_median_interaction.merge(df_actor_count.reset_index().drop_duplicates(), how='left')
+    df_median_count = df_median_count.merge(counts[['Course', 'Teaching']].drop_duplicates(), how='right')
+
+    return {'course_counts': course_counts, 'color_df': color_df, 'actor_interactions': actor_interactions,
+            'median_count': df_median_count}
+
+
+def get_interaction_pie(df, approximate=False, statistics=None):
+    """
+    Generate a pie chart of the distribution of user interactions across courses.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing the dataset.
+    - approximate (bool): Whether to use the sketches. Default is False.
+    - statistics (dict, optional): The statistics of popularity_statistics, computed if not given.
+
+    Returns:
+    - Figure: The pie chart.
+    """
+    statistics = popularity_statistics(df, approximate) if statistics is None else statistics
+    course_counts, color_df = statistics['course_counts'], statistics['color_df']
 
     colors = [color_df[color_df['Course'] == course].iloc[0][['color']].iloc[0] for course in
-              list(df['Course'].value_counts().to_frame().index)]
+              list(course_counts.index)]
 
-    fig1, ax = plt.subplots()
-    fig1.set_figwidth(10)
-    fig1.set_figheight(10)
-    plt.title("Number of user interactions by course")
+    fig1 = Figure(figsize=(10, 10))
+    ax = fig1.subplots()
+    ax.set_title("Number of user interactions by course")
     ax.pie(
-        list(df['Course'].value_counts()),
-        labels=df['Course'].value_counts().to_frame().index.tolist(),
+        list(course_counts),
+        labels=course_counts.index.tolist(),
         autopct='%.0f%%',
         colors=colors
     )
-    plt.plot()
-
-    df_actor_count = df[['Course', 'actor.id']].groupby(['Course']).nunique()
-    actor_interactions = [
-        [
-            df[df['Course'] == course_name].groupby(['actor.id']).size().to_frame('size')['size']
-            for course_name in df['Course'].unique()
-        ],
-        [
-            course_name
-            for course_name in df['Course'].unique()
-        ],
-    ]
+    return fig1
+
+
+def get_interaction_boxplot(df, approximate=False, statistics=None):
+    """
+    Generate a boxplot of the number of interactions per person in every course.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing the dataset.
+    - approximate (bool): Whether to use the sketches. Default is False.
+    - statistics (dict, optional): The statistics of popularity_statistics, computed if not given.
+
+    Returns:
+    - Figure: The boxplot.
+    """
+    statistics = popularity_statistics(df, approximate) if statistics is None else statistics
+    actor_interactions, color_df = statistics['actor_interactions'], statistics['color_df']
 
     colors = [color_df[color_df['Course'] == course].iloc[0][['color']].iloc[0] for course in actor_interactions[1]]
 
-    fig2, ax = plt.subplots()
-    fig2.set_figwidth(10)
-    fig2.set_figheight(10)
-    plt.title("Number of user interactions by course")
-    boxpl = ax.boxplot(
-        actor_interactions[0],
-        notch=True,
-        patch_artist=True,
-        labels=actor_interactions[1],
-    )
+    fig2 = Figure(figsize=(10, 10))
+    ax = fig2.subplots()
+    ax.set_title("Number of user interactions by course")
+    if approximate:
+        boxpl = ax.bxp(actor_interactions[0], shownotches=True, patch_artist=True)
+    else:
+        boxpl = ax.boxplot(
+            actor_interactions[0],
+            notch=True,
+            patch_artist=True,
+            labels=actor_interactions[1],
+        )
     for patch, color in zip(boxpl['boxes'], colors):
         patch.set_facecolor(color)
-    plt.xticks(rotation=90)
+    ax.tick_params(axis='x', labelrotation=90)
+    return fig2
 
-    df_median_interaction = df.groupby(['Course', 'actor.id']).size().groupby(level=0).median().to_frame(
-        'median').reset_index()
 
-    df_median_count = df_median_interaction.merge(df_actor_count.reset_index().drop_duplicates(), how='left')
-    df_median_count = df_median_count.merge(df[['Course', 'Teaching']].drop_duplicates(), how='right')
+def get_median_scatter(df, approximate=False, statistics=None):
+    """
+    Generate a scatter plot of the median interaction count per person against the number of students of every
+    course.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing the dataset.
+    - approximate (bool): Whether to use the sketches. Default is False.
+    - statistics (dict, optional): The statistics of popularity_statistics, computed if not given.
+
+    Returns:
+    - Figure: The scatter plot, with stars for flipped classroom courses.
+    """
+    statistics = popularity_statistics(df, approximate) if statistics is None else statistics
+    df_median_count, color_df = statistics['median_count'], statistics['color_df']
 
     colors = [
         color_df[color_df['Course'] == course].iloc[0][['color']].iloc[0]
@@ -86,9 +210,8 @@ def course_popularity(df):
         in list(df_median_count['Course'].value_counts().to_frame().index)
     ]
 
-    fig3, ax = plt.subplots()
-    fig3.set_figwidth(10)
-    fig3.set_figheight(10)
+    fig3 = Figure(figsize=(10, 10))
+    ax = fig3.subplots()
     for xp, yp, color, marker in zip(
             df_median_count['median'],
             df_median_count['actor.id'],
@@ -102,7 +225,28 @@ def course_popularity(df):
             marker=marker,
             s=100
         )
-    plt.xlabel('Interaction count per person (median)', fontsize=15)
-    plt.ylabel('Number of students enrolled in course', fontsize=15)
+    ax.set_xlabel('Interaction count per person (median)', fontsize=15)
+    ax.set_ylabel('Number of students enrolled in course', fontsize=15)
+    return fig3
+
+
+def course_popularity(df, approximate=False):
+    """
+    Analyzes course popularity based on user interactions and visualizes the results through three plots.
 
-    return fig1, fig2, fig3
+    The statistics are computed once for the three plots (see popularity_statistics). Pages build the plots
+    separately instead, so that they are computed concurrently.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing the dataset.
+    - approximate (bool): Whether to use the sketches. Default is False.
+
+    Returns:
+    - fig1 (Figure): Pie chart depicting the distribution of user interactions across courses.
+    - fig2 (Figure): Boxplot illustrating the variation in user interactions by course.
+    - fig3 (Figure): Scatter plot showing the relationship between the median interaction count per person
+                        and the number of students enrolled in each course.
+    """
+    statistics = popularity_statistics(df, approximate)
+    return (get_interaction_pie(df, approximate, statistics), get_interaction_boxplot(df, approximate, statistics),
+            get_median_scatter(df, approximate, statistics))
@@ -0,0 +1,352 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from utils import query_backend, time_series
+
+WINDOWS = [7, 14, 28]
+METRICS = ['events', 'attempts', 'score_sum', 'score_count']
+RISK_WEIGHTS = {
+    'inactivity': 0.35,
+    'decline': 0.25,
+    'no_attempts': 0.2,
+    'falling_scores': 0.2
+}
+
+
+def daily_values(df, where=None):
+    """
+    Get the daily activity of every actor: events, assessment attempts and the sum and number of scores.
+
+    Assessment attempts are the graded assessments of time_series.get_actions.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - where (dict, optional): The filter of the events (see QueryBackend).
+
+    Returns:
+    - Tuple[pd.Index, pd.DatetimeIndex, np.ndarray]: The actor IDs, the consecutive days from the first to the last day
+      with activity and the values, with shape (actors, days, metrics).
+    """
+    counts = query_backend.get_backend(df).aggregate(
+        ['actor.id', 'date', 'object.definition.type', 'scored'], 'result.score.scaled', where
+    ).dropna(subset=['actor.id', 'date'])
+    if counts.empty:
+        return pd.Index([], name='actor.id'), pd.DatetimeIndex([]), np.zeros((0, 0, len(METRICS)))
+
+    assessments, _ = time_series.classify_actions(counts)
+    actor_codes, actors = pd.factorize(counts['actor.id'], sort=True)
+    dates = pd.DatetimeIndex(counts['date'])
+    day_codes = ((dates - dates.min()) // pd.Timedelta(days=1)).to_numpy()
+    n_days = int(day_codes.max()) + 1
+
+    cells = actor_codes * n_days + day_codes
+    values = np.stack([
+        np.bincount(cells, weights=column.to_numpy(dtype=float), minlength=len(actors) * n_days)
+        for column in [counts['count'], counts['count'].where(assessments, 0), counts['sum'].fillna(0), counts['n']]
+    ], axis=-1).reshape(len(actors), n_days, len(METRICS))
+
+    return pd.Index(actors, name='actor.id'), pd.date_range(dates.min(), periods=n_days), values
+
+
+class RollingState:
+    """
+    Rolling 7, 14 and 28-day sums of the daily activity of every actor, updated one day at a time.
+
+    The last 28 days are kept in a ring buffer. Adding a day adds it to every window and subtracts the days that leave
+    the windows, for all actors at once, so a new day costs O(actors) instead of a recomputation over the history.
+    """
+
+    def __init__(self):
+        self.actors = pd.Index([], name='actor.id')
+        self.courses = pd.DataFrame(columns=['Course', 'Institution'], index=self.actors)
+        self.day = None
+        self.position = max(WINDOWS) - 1
+        self.buffer = np.zeros((0, max(WINDOWS), len(METRICS)))
+        self.sums = np.zeros((0, len(WINDOWS), len(METRICS)))
+        self.last_active = np.full(0, np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    @classmethod
+    def build(cls, df):
+        """
+        Compute the state at the last day of a dataset from scratch.
+
+        Only the last 28 days are aggregated per day; the window sums are differences of cumulative sums over them.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+        Returns:
+        - RollingState: The state.
+        """
+        state = cls()
+        _, last = query_backend.time_bounds(df)
+        if last is None:
+            return state
+
+        span = max(WINDOWS)
+        state.day = last.normalize()
+        first_day = state.day - pd.Timedelta(days=span - 1)
+
+        state._add_actors(df)
+        actors, days, values = daily_values(df, {'timestamp': slice(first_day, None)})
+
+        rows = state.actors.get_indexer(actors)
+        offset = (days[0] - first_day).days if len(days) else 0
+        state.buffer[rows, offset:offset + len(days)] = values
+
+        cumulative = np.concatenate([np.zeros_like(state.buffer[:, :1]), np.cumsum(state.buffer, axis=1)], axis=1)
+        state.sums = np.stack([cumulative[:, -1] - cumulative[:, -1 - window] for window in WINDOWS], axis=1)
+
+        active = query_backend.get_backend(df).count(['actor.id', 'date']).dropna().groupby('actor.id')['date'].max()
+        state.last_active[state.actors.get_indexer(active.index)] = active.to_numpy(dtype='datetime64[ns]')
+        return state
+
+    def copy(self):
+        """
+        Copy the state, so that it can be updated while the original stays unchanged.
+
+        Returns:
+        - RollingState: The copy.
+        """
+        state = RollingState()
+        state.actors, state.courses, state.day, state.position = self.actors, self.courses, self.day, self.position
+        state.buffer, state.sums, state.last_active = self.buffer.copy(), self.sums.copy(), self.last_active.copy()
+        return state
+
+    def _add_actors(self, df, where=None):
+        known = query_backend.get_backend(df).distinct(['actor.id', 'Course', 'Institution'], where)
+        known = known.dropna(subset=['actor.id']).drop_duplicates('actor.id').set_index('actor.id')
+        new = known.loc[~known.index.isin(self.actors)]
+        if new.empty:
+            return
+
+        self.actors = self.actors.append(new.index) if len(self.actors) else new.index
+        self.courses = pd.concat([self.courses, new]) if len(self.courses) else new
+        self.buffer = np.concatenate([self.buffer, np.zeros((len(new),) + self.buffer.shape[1:])])
+        self.sums = np.concatenate([self.sums, np.zeros((len(new),) + self.sums.shape[1:])])
+        self.last_active = np.concatenate([self.last_active, np.full(len(new), np.datetime64('NaT'),
+                                                                     dtype='datetime64[ns]')])
+
+    def push(self, day, actors, values):
+        """
+        Add the activity of a day. Days without activity since the last day are added as zeros; the activity of the
+        last day replaces its previous value (e.g. when the day was incomplete).
+
+        Parameters:
+        - day (pd.Timestamp): The day, not before the last day of the state.
+        - actors (pd.Index): The actors with activity on that day. They must be known to the state.
+        - values (np.ndarray): Their activity, with shape (actors, metrics).
+        """
+        span = max(WINDOWS)
+        full = np.zeros((len(self.actors), len(METRICS)))
+        full[self.actors.get_indexer(actors)] = values
+
+        if self.day is not None and day < self.day:
+            raise ValueError('Cannot add ' + str(day.date()) + ' before the last day ' + str(self.day.date()) + '.')
+
+        if self.day is not None and day == self.day:
+            self.sums += (full - self.buffer[:, self.position])[:, None]
+            self.buffer[:, self.position] = full
+        else:
+            gap = span if self.day is None else (day - self.day).days
+            if gap >= span:
+                # Every window starts over.
+                self.buffer[:] = 0
+                self.buffer[:, self.position] = full
+                self.sums[:] = full[:, None]
+            else:
+                for _ in range(gap - 1):
+                    self._advance(np.zeros_like(full))
+                self._advance(full)
+            self.day = day
+
+        self.last_active[full[:, 0] > 0] = np.datetime64(day, 'ns')
+
+    def _advance(self, full):
+        span = max(WINDOWS)
+        self.position = (self.position + 1) % span
+        leaving = self.buffer[:, (self.position - np.array(WINDOWS)) % span]
+        self.sums += full[:, None] - leaving
+        self.buffer[:, self.position] = full
+
+    def update(self, df):
+        """
+        Bring the state up to date with a newer version of the dataset, aggregating only the days since its last day.
+
+        The dataset must contain the events the state was computed from; newer events are expected to be appended.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+        Returns:
+        - RollingState: The state itself.
+        """
+        if self.day is None:
+            built = RollingState.build(df)
+            self.__dict__.update(built.__dict__)
+            return self
+
+        where = {'timestamp': slice(self.day, None)}
+        self._add_actors(df, where)
+        actors, days, values = daily_values(df, where)
+        for index, day in enumerate(days):
+            active = values[:, index, 0] > 0
+            self.push(day, actors[active], values[active, index])
+        return self
+
+    def features(self):
+        """
+        Get the rolling features of every actor at the last day.
+
+        Returns:
+        - pd.DataFrame: The events and assessment attempts in the last 7, 14 and 28 days, the mean score in the last 14
+          days, the score trend (the mean score in the last 14 days minus the mean score in the 14 days before) and the
+          number of days since the last activity, with the course and institution of every actor.
+        """
+        columns = {}
+        for index, window in enumerate(WINDOWS):
+            columns[f'Events ({window}d)'] = self.sums[:, index, 0]
+        for index, window in enumerate(WINDOWS):
+            columns[f'Attempts ({window}d)'] = self.sums[:, index, 1]
+
+        recent = self.sums[:, WINDOWS.index(14)]
+        previous = self.sums[:, WINDOWS.index(28)] - recent
+        # The running score sums may keep a rounding residue once every score has left a window, so the counts decide.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            recent_mean = np.where(recent[:, 3] > 0, recent[:, 2] / recent[:, 3], np.nan)
+            previous_mean = np.where(previous[:, 3] > 0, previous[:, 2] / previous[:, 3], np.nan)
+        columns['Mean score (14d)'] = recent_mean
+        columns['Score trend'] = recent_mean - previous_mean
+
+        if self.day is None:
+            columns['Days inactive'] = np.full(len(self.actors), np.nan)
+        else:
+            columns['Days inactive'] = (np.datetime64(self.day, 'ns') - self.last_active) / np.timedelta64(1, 'D')
+
+        return self.courses.join(pd.DataFrame(columns, index=self.actors))
+
+
+def risk_scores(features, by='Course'):
+    """
+    Combine the rolling features into a risk score between 0 (engaged) and 1 (at risk).
+
+    Activity and attempts are ranked against the other actors of the same course or institution; a drop of the last
+    week's activity below the 28-day average and falling scores add to the risk.
+
+    Parameters:
+    - features (pd.DataFrame): The features, as returned by RollingState.features.
+    - by (str): 'Course' or 'Institution', the group the actors are compared within. Default is 'Course'.
+
+    Returns:
+    - pd.DataFrame: The risk components and the 'Risk' of every actor.
+    """
+    groups = features[by]
+    weekly_average = features['Events (28d)'] / 4
+    with np.errstate(invalid='ignore', divide='ignore'):
+        decline = (1 - features['Events (7d)'] / weekly_average).where(weekly_average > 0, 1.0)
+
+    components = pd.DataFrame({
+        'inactivity': features['Events (7d)'].groupby(groups).rank(method='max', ascending=False, pct=True),
+        'decline': decline.clip(0, 1),
+        'no_attempts': features['Attempts (28d)'].groupby(groups).rank(method='max', ascending=False, pct=True),
+        'falling_scores': (-2 * features['Score trend']).clip(0, 1).fillna(0)
+    }, index=features.index)
+
+    components['Risk'] = sum(components[name] * weight for name, weight in RISK_WEIGHTS.items())
+    return components
+
+
+def rank(state, column, name):
+    """
+    Rank the actors of a course or institution by risk.
+
+    Parameters:
+    - state (RollingState): The rolling state.
+    - column (str): 'Course' or 'Institution'.
+    - name (str): The name of the course or institution.
+
+    Returns:
+    - pd.DataFrame: The risk and the features of the actors, highest risk first.
+    """
+    features = state.features()
+    ranked = risk_scores(features, column)[['Risk']].join(features)
+    ranked = ranked[ranked[column] == name].sort_values(['Risk', 'Days inactive'], ascending=False)
+    return ranked.reset_index()
+
+
+_states = {}
+_latest = None
+_states_lock = threading.Lock()
+
+
+def get_state(df):
+    """
+    Get the rolling state at the last day of a DataFrame, computing it on first use.
+
+    For the full dataset, the state of the previously loaded version is updated with the days since its last day
+    instead of being recomputed, as long as the new version ends no earlier. A dataset restricted to a date range is
+    always computed from scratch. The state is kept for as long as the DataFrame itself.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - RollingState: The state.
+    """
+    global _latest
+
+    key = id(df)
+    with _states_lock:
+        state = _states.get(key)
+        previous = _latest
+    if state is not None:
+        return state
+
+    full = query_backend.is_full(df)
+    last = query_backend.time_bounds(df)[1] if full and previous is not None and previous.day is not None else None
+    if last is not None and previous.day <= last.normalize():
+        state = previous.copy().update(df)
+    else:
+        state = RollingState.build(df)
+
+    with _states_lock:
+        if key not in _states:
+            _states[key] = state
+            weakref.finalize(df, _states.pop, key, None)
+            if full:
+                _latest = state
+        return _states[key]
+
+
+def display(df, name, top=20):
+    """
+    List the actors of a course or institution most at risk of disengaging.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - name (str): The name of the course or institution.
+    - top (int): The number of actors listed. Default is 20.
+
+    Returns:
+    - Tuple[pd.DataFrame, Figure]: The actors with the highest risk and the distribution of the risk scores. The figure
+      is None if the course or institution has no actors.
+    """
+    column = 'Institution' if name in query_backend.values(df, 'Institution') else 'Course'
+    ranked = rank(get_state(df), column, name)
+    if ranked.empty:
+        return ranked, None
+
+    fig = Figure(figsize=(10, 4))
+    ax = fig.subplots()
+    ax.hist(ranked['Risk'], bins=np.linspace(0, 1, 21), color='indianred')
+    ax.set_xlabel('Risk')
+    ax.set_ylabel('Actors')
+    ax.set_title('Risk Scores')
+    fig.tight_layout()
+
+    table = ranked.head(top).drop(columns=['Course', 'Institution'] if column == 'Course' else ['Institution'])
+    return table.round(2), fig
@@ -0,0 +1,291 @@
+import hashlib
+import io
+import os
+import pickle
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+import matplotlib.backends.backend_agg  # noqa: F401
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from matplotlib.figure import Figure
+
+from utils import payload, query_backend, versioning
+
+# Plotly and Matplotlib import their JSON engine and canvas on the first render. Figures are rendered concurrently
+# (see util_funcs.parallel_figures), and concurrent first imports of a module can see it partially initialized, so
+# they are imported here instead.
+try:
+    import orjson  # noqa: F401
+except ImportError:
+    pass
+
+DEFAULT_MAX_BYTES = int(os.environ.get('ILEDA_FIGURE_CACHE_BYTES', 256 * 1024 ** 2))
+
+RenderedFigure = namedtuple('RenderedFigure', ['kind', 'data'])
+
+
+def render(item):
+    """
+    Convert a figure into a serialized form that can be cached and shared across sessions.
+
+    Matplotlib figures are cleared once rendered, so their artists are released immediately. Plotly figures are fitted
+    to the payload budget (see payload.fit), so large figures are downsampled before they are cached and sent.
+
+    Parameters:
+    - item: A matplotlib figure, a Plotly figure, or any other picklable value (returned unchanged).
+      Tuples and lists are rendered element-wise.
+
+    Returns:
+    - RenderedFigure or object: ('png', bytes) for matplotlib figures, ('plotly', json) for Plotly figures.
+    """
+    if isinstance(item, (tuple, list)):
+        return type(item)(render(element) for element in item)
+
+    if isinstance(item, Figure):
+        buffer = io.BytesIO()
+        item.savefig(buffer, format='png', dpi=200, bbox_inches='tight')
+        item.clear()
+        return RenderedFigure('png', buffer.getvalue())
+
+    if isinstance(item, go.Figure):
+        return RenderedFigure('plotly', payload.fit(item))
+
+    return item
+
+
+def to_plotly(rendered):
+    """
+    Rebuild a Plotly figure from its cached JSON.
+
+    Parameters:
+    - rendered (RenderedFigure): A rendered Plotly figure.
+
+    Returns:
+    - go.Figure: The Plotly figure.
+    """
+    return pio.from_json(rendered.data)
+
+
+def get_size(value):
+    """
+    Estimate the memory taken by a cached value.
+
+    Parameters:
+    - value: A value as returned by render.
+
+    Returns:
+    - int: The size in bytes.
+    """
+    if isinstance(value, RenderedFigure):
+        return len(value.data)
+    if isinstance(value, (tuple, list)):
+        return sum(get_size(element) for element in value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    return len(pickle.dumps(value))
+
+
+def make_key(func, args, kwargs, version):
+    """
+    Build a content-addressed key for a call of a figure builder.
+
+    DataFrame and query backend arguments are represented by the data version, the date range they are restricted to
+    and whether anomalies are left out instead of their content. Builders reading other files are keyed by the
+    versions of those files instead of the data version (see versioning.builder_version).
+
+    Parameters:
+    - func (callable): The figure builder.
+    - args (tuple): The positional arguments of the call.
+    - kwargs (dict): The keyword arguments of the call.
+    - version (str): The version of the data the call depends on.
+
+    Returns:
+    - str: The cache key.
+    """
+    def describe(value):
+        if isinstance(value, (pd.DataFrame, pd.Series, query_backend.QueryBackend)):
+            time_range = query_backend.time_range(value)
+            description = 'data' if time_range is None else 'data ' + str(time_range[0]) + '..' + str(time_range[1])
+            return '<' + description + (' without anomalies' if query_backend.excludes_anomalies(value) else '') + '>'
+        return repr(value)
+
+    description = '|'.join([
+        func.__module__ + '.' + func.__qualname__,
+        str(versioning.builder_version(func, args, kwargs, version)),
+        ','.join(describe(arg) for arg in args),
+        ','.join(key + '=' + describe(value) for key, value in sorted(kwargs.items()))
+    ])
+    return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+class FigureCache:
+    """
+    A thread-safe LRU cache of rendered figures bounded by a memory budget.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached value and mark it as most recently used.
+
+        Parameters:
+        - key (str): The cache key.
+
+        Returns:
+        - Tuple[bool, object]: Whether the key was found and the cached value.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key][0]
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries to stay within the budget.
+
+        Parameters:
+        - key (str): The cache key.
+        - value: The rendered value.
+        """
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        """
+        Remove all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Get usage statistics of the cache.
+
+        Returns:
+        - dict: The number of entries, used and maximum bytes, hits and misses.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class Coalescer:
+    """
+    Run at most one computation per key at a time; concurrent callers with the same key share its result.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        """
+        Run func for a key, or wait for the computation already in flight for that key.
+
+        Parameters:
+        - key (str): The key identifying the computation.
+        - func (callable): The computation, called without arguments.
+
+        Returns:
+        - The result of the computation.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def in_flight(self):
+        """
+        Get the number of computations currently running.
+
+        Returns:
+        - int: The number of keys in flight.
+        """
+        with self._lock:
+            return len(self._in_flight)
+
+
+figure_cache = FigureCache()
+coalescer = Coalescer()
+
+
+def cached(func, *args, version=None, cache=None, **kwargs):
+    """
+    Call a figure builder, returning its rendered result from the cache when available.
+
+    Identical calls made concurrently (e.g. by several sessions opening the same course) are computed only once.
+
+    Parameters:
+    - func (callable): The figure builder.
+    - args: The positional arguments of the builder.
+    - version (str, optional): The version of the data the builder depends on.
+    - cache (FigureCache, optional): The cache to use. Default is the process-wide figure_cache.
+    - kwargs: The keyword arguments of the builder.
+
+    Returns:
+    - The rendered result of the builder (see render).
+    """
+    cache = figure_cache if cache is None else cache
+    key = make_key(func, args, kwargs, version)
+
+    found, value = cache.get(key)
+    if found:
+        return value
+
+    def compute():
+        found_now, value_now = cache.get(key)
+        if found_now:
+            return value_now
+
+        rendered = render(func(*args, **kwargs))
+        cache.put(key, rendered)
+        return rendered
+
+    return coalescer.run(key, compute)
@@ -0,0 +1,350 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from utils import query_backend, time_series
+
+METRICS = ['assessments', 'non_assessments', 'total']
+HALF_LIFE_DAYS = 56
+DECAY = 0.5 ** (1 / HALF_LIFE_DAYS)
+RIDGE = 1.0
+HORIZON = 7
+HISTORY_DAYS = 56
+N_FEATURES = 8
+
+
+def daily_counts(df, where=None):
+    """
+    Get the daily activity counts of every course and institution, as count_daily_actions does for one of them.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - where (dict, optional): The filter of the events (see QueryBackend).
+
+    Returns:
+    - Tuple[pd.MultiIndex, pd.DatetimeIndex, np.ndarray]: The ('Course' or 'Institution', name) of every series, the
+      consecutive days from the first to the last day with activity and the counts, with shape (days, series, metrics).
+    """
+    counts = query_backend.get_backend(df).count(
+        ['Institution', 'Course', 'date', 'object.definition.type', 'scored'], where
+    ).dropna(subset=['date'])
+    if counts.empty:
+        return (pd.MultiIndex.from_tuples([], names=['Level', 'Name']), pd.DatetimeIndex([]),
+                np.zeros((0, 0, len(METRICS))))
+
+    assessments, non_assessments = time_series.classify_actions(counts)
+    columns = [counts['count'].where(assessments, 0), counts['count'].where(non_assessments, 0), counts['count']]
+
+    dates = pd.DatetimeIndex(counts['date'])
+    day_codes = ((dates - dates.min()) // pd.Timedelta(days=1)).to_numpy()
+    n_days = int(day_codes.max()) + 1
+
+    names, codes = [], []
+    for level in ['Course', 'Institution']:
+        level_codes, level_names = pd.factorize(counts[level], sort=True)
+        codes.append(np.where(level_codes < 0, -1, level_codes + len(names)))
+        names += [(level, name) for name in level_names]
+
+    values = np.zeros((n_days * len(names), len(METRICS)))
+    for level_codes in codes:
+        valid = level_codes >= 0
+        cells = day_codes[valid] * len(names) + level_codes[valid]
+        for index, column in enumerate(columns):
+            values[:, index] += np.bincount(cells, weights=column.to_numpy(dtype=float)[valid],
+                                            minlength=len(values))
+
+    keys = pd.MultiIndex.from_tuples(names, names=['Level', 'Name'])
+    return keys, pd.date_range(dates.min(), periods=n_days), values.reshape(n_days, len(names), len(METRICS))
+
+
+class ForecastState:
+    """
+    Weighted least squares fits of a trend and a weekly pattern to the daily counts of every course and institution,
+    updated one day at a time.
+
+    Every series is modelled as an intercept, a linear trend in weeks and an offset for each day of the week. Only the
+    sufficient statistics of the fits are kept (X'WX, X'Wy and y'Wy for every series), with weights halving every 56
+    days so that recent terms count most. Adding a day decays them and adds its terms, so new days cost O(series)
+    instead of a refit over the history, and all series are solved at once as a batch of 8x8 systems.
+
+    The last day may still be incomplete, so it is kept aside and only added to the statistics once a later day
+    arrives.
+    """
+
+    def __init__(self):
+        self.keys = pd.MultiIndex.from_tuples([], names=['Level', 'Name'])
+        self.origin = None
+        self.day = None
+        self.pending = np.zeros((0, len(METRICS)))
+        self.started = np.zeros((0, len(METRICS)), dtype=bool)
+        self.xtx = np.zeros((0, len(METRICS), N_FEATURES, N_FEATURES))
+        self.xty = np.zeros((0, len(METRICS), N_FEATURES))
+        self.yty = np.zeros((0, len(METRICS)))
+        self.weights = np.zeros((0, len(METRICS)))
+
+    @classmethod
+    def build(cls, df):
+        """
+        Fit the series of a dataset from scratch.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+        Returns:
+        - ForecastState: The state.
+        """
+        state = cls()
+        keys, days, values = daily_counts(df)
+        if not len(days):
+            return state
+
+        state.origin = days[0]
+        state._add_series(keys)
+        state._add_days(days[:-1], values[:-1])
+        state.day, state.pending = days[-1], values[-1]
+        return state
+
+    def copy(self):
+        """
+        Copy the state, so that it can be updated while the original stays unchanged.
+
+        Returns:
+        - ForecastState: The copy.
+        """
+        state = ForecastState()
+        state.keys, state.origin, state.day = self.keys, self.origin, self.day
+        for name in ['pending', 'started', 'xtx', 'xty', 'yty', 'weights']:
+            setattr(state, name, getattr(self, name).copy())
+        return state
+
+    def design(self, days):
+        """
+        Get the features of days: an intercept, the weeks since the first day and the day of the week (Tuesday to
+        Sunday, relative to Monday).
+
+        Parameters:
+        - days (pd.DatetimeIndex): The days.
+
+        Returns:
+        - np.ndarray: The features, with shape (days, 8).
+        """
+        features = np.zeros((len(days), N_FEATURES))
+        features[:, 0] = 1
+        features[:, 1] = (days - self.origin) / pd.Timedelta(weeks=1)
+        weekdays = days.weekday.to_numpy()
+        features[weekdays > 0, weekdays[weekdays > 0] + 1] = 1
+        return features
+
+    def _add_series(self, keys):
+        new = keys[~keys.isin(self.keys)]
+        if new.empty:
+            return
+
+        self.keys = self.keys.append(new) if len(self.keys) else new
+        for name in ['pending', 'started', 'xtx', 'xty', 'yty', 'weights']:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros((len(new),) + array.shape[1:], dtype=array.dtype)]))
+
+    def _add_days(self, days, values):
+        """
+        Decay the statistics and add consecutive complete days, following the last added day.
+
+        Parameters:
+        - days (pd.DatetimeIndex): The days.
+        - values (np.ndarray): The counts of every series, with shape (days, series, metrics).
+        """
+        if not len(days):
+            return
+
+        # A series enters the fit from its first day with activity.
+        active = np.logical_or.accumulate(values > 0, axis=0) | self.started
+        weights = DECAY ** np.arange(len(days) - 1, -1, -1)[:, None, None] * active
+        features = self.design(days)
+
+        decay = DECAY ** len(days)
+        self.xtx = decay * self.xtx + np.tensordot(weights, features[:, :, None] * features[:, None, :], axes=(0, 0))
+        self.xty = decay * self.xty + np.tensordot(weights * values, features, axes=(0, 0))
+        self.yty = decay * self.yty + (weights * values ** 2).sum(axis=0)
+        self.weights = decay * self.weights + weights.sum(axis=0)
+        self.started = active[-1]
+
+    def update(self, df):
+        """
+        Bring the state up to date with a newer version of the dataset, aggregating only the days since its last day.
+
+        The dataset must contain the events the state was computed from; newer events are expected to be appended.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+        Returns:
+        - ForecastState: The state itself.
+        """
+        if self.day is None:
+            built = ForecastState.build(df)
+            self.__dict__.update(built.__dict__)
+            return self
+
+        keys, days, values = daily_counts(df, {'timestamp': slice(self.day, None)})
+        if not len(days) or days[-1] < self.day:
+            return self
+
+        self._add_series(keys)
+        span = pd.date_range(self.day, days[-1])
+        full = np.zeros((len(span), len(self.keys), len(METRICS)))
+        full[0] = self.pending
+        full[np.ix_(span.get_indexer(days), self.keys.get_indexer(keys))] = values
+
+        self._add_days(span[:-1], full[:-1])
+        self.day, self.pending = span[-1], full[-1]
+        return self
+
+    def coefficients(self):
+        """
+        Solve the fits of every series, including the last day.
+
+        Returns:
+        - Tuple[np.ndarray, np.ndarray]: The coefficients, with shape (series, metrics, 8), and the residual standard
+          deviations, with shape (series, metrics).
+        """
+        state = self.copy()
+        state._add_days(pd.DatetimeIndex([self.day]), self.pending[None])
+
+        penalty = RIDGE * np.diag([0] + [1] * (N_FEATURES - 1))
+        coefficients = np.linalg.solve(state.xtx + penalty, state.xty[..., None])[..., 0]
+        residuals = (state.yty - 2 * (coefficients * state.xty).sum(axis=-1) +
+                     np.einsum('smp,smpq,smq->sm', coefficients, state.xtx, coefficients))
+        deviations = np.sqrt(np.clip(residuals, 0, None) / np.maximum(state.weights - N_FEATURES, 1))
+        return coefficients, deviations
+
+    def forecast(self, horizon=HORIZON):
+        """
+        Predict the daily counts of every series after the last day.
+
+        Parameters:
+        - horizon (int): The number of days predicted. Default is 7.
+
+        Returns:
+        - Tuple[pd.DatetimeIndex, np.ndarray, np.ndarray]: The predicted days, the predictions, with shape
+          (days, series, metrics), and the residual standard deviations, with shape (series, metrics). Predictions are
+          never negative.
+        """
+        days = pd.date_range(self.day + pd.Timedelta(days=1), periods=horizon)
+        if not len(self.keys):
+            return days, np.zeros((horizon, 0, len(METRICS))), np.zeros((0, len(METRICS)))
+
+        coefficients, deviations = self.coefficients()
+        predictions = np.einsum('dp,smp->dsm', self.design(days), coefficients)
+        return days, np.clip(predictions, 0, None), deviations
+
+
+_states = {}
+_latest = None
+_states_lock = threading.Lock()
+
+
+def get_state(df):
+    """
+    Get the fits at the last day of a DataFrame, computing them on first use.
+
+    For the full dataset, the fits of the previously loaded version are updated with the days since its last day
+    instead of being recomputed, as long as the new version ends no earlier. A dataset restricted to a date range is
+    always fitted from scratch. The state is kept for as long as the DataFrame itself.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - ForecastState: The state.
+    """
+    global _latest
+
+    key = id(df)
+    with _states_lock:
+        state = _states.get(key)
+        previous = _latest
+    if state is not None:
+        return state
+
+    full = query_backend.is_full(df)
+    last = query_backend.time_bounds(df)[1] if full and previous is not None and previous.day is not None else None
+    if last is not None and previous.day <= last.normalize():
+        state = previous.copy().update(df)
+    else:
+        state = ForecastState.build(df)
+
+    with _states_lock:
+        if key not in _states:
+            _states[key] = state
+            weakref.finalize(df, _states.pop, key, None)
+            if full:
+                _latest = state
+        return _states[key]
+
+
+def next_week(df):
+    """
+    Predict the activity of every course and institution in the seven days after the last day of the data.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - pd.DataFrame: The predicted numbers of graded assessments, non-graded activities and events of every course and
+      institution, busiest first.
+    """
+    state = get_state(df)
+    days, predictions, _ = state.forecast()
+    table = pd.DataFrame(predictions.sum(axis=0), index=state.keys, columns=METRICS).round().astype(int)
+    table.insert(0, 'From', days[0].date())
+    return table.sort_values('total', ascending=False).reset_index()
+
+
+def display(df, name, metric):
+    """
+    Display the recent daily activity counts of a course or institution and their forecast for the next seven days.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - name (str): The name of the course or institution.
+    - metric (str): The type of activity count to display ('assessments', 'non_assessments', 'total', 'both').
+
+    Returns:
+    - Figure: The generated plot, with a band of about 95% around the forecast, or None if there is no activity.
+    """
+    state = get_state(df)
+    level = 'Institution' if name in query_backend.values(df, 'Institution') else 'Course'
+    if state.day is None or (level, name) not in state.keys:
+        return None
+
+    history, institution_colour = time_series.course_or_institution_timeline(df, name)
+    history = history.loc[state.day - pd.Timedelta(days=HISTORY_DAYS - 1):state.day]
+    days, predictions, deviations = state.forecast()
+    series = state.keys.get_loc((level, name))
+
+    colours = {'non_assessments': institution_colour, 'assessments': 'purple'}
+    metrics = ['non_assessments', 'assessments'] if metric == 'both' else [metric]
+
+    fig = Figure()
+    ax = fig.subplots()
+    for column in metrics:
+        index = METRICS.index(column)
+        colour = colours.get(column, institution_colour)
+        predicted = predictions[:, series, index]
+        band = 1.96 * deviations[series, index]
+
+        ax.plot(history.index, history[column], c=colour)
+        ax.plot(days, predicted, c=colour, linestyle='--')
+        ax.fill_between(days, np.clip(predicted - band, 0, None), predicted + band, color=colour, alpha=0.2)
+
+    ax.axvline(state.day + pd.Timedelta(hours=12), c='gray', linewidth=0.8)
+    fig.autofmt_xdate(rotation=45, ha='right')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Count')
+    ax.set_title('Forecast')
+
+    fig.tight_layout()
+    return fig
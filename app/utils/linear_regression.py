@@ -1,10 +1,28 @@
-import matplotlib.pyplot as plt
+import copy
+import os
+import tempfile
+import threading
+import weakref
+import zlib
+
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import sklearn.metrics as metrics
-from sklearn.linear_model import LinearRegression
+from matplotlib.figure import Figure
+from scipy import sparse
+from sklearn.linear_model import LinearRegression, SGDRegressor
 from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import MaxAbsScaler
+
+from utils import query_backend
+
+N_FEATURES = 2 ** 16
+ACTOR_BATCH = 5000
+EPOCHS = 10
+UPDATE_EPOCHS = 1
+SPILL_BYTES = int(os.environ.get('ILEDA_REGRESSION_SPILL_BYTES', 256 * 1024 ** 2))
+TEST_SHARE = 5
 
 
 def regression_results(y_true, y_pred):
@@ -35,29 +53,25 @@ def regression(df):
     Perform linear regression analysis on the given DataFrame and visualize the results.
 
     Parameters:
-    - df (pd.DataFrame): Input DataFrame containing regression data.
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
 
     Returns:
     - tuple: Two matplotlib figures (heatmap and barplot) and a string of regression evaluation metrics.
     """
+    df = query_backend.to_frame(df, ['Course', 'Teaching', 'actor.id', 'object.definition.type',
+                                     'result.score.scaled'])
     df_reg = pd.get_dummies(df['Course']).astype(int)
     df_reg = pd.concat([df_reg, pd.get_dummies(df['Teaching']).astype(int)], axis=1)
     df_reg['actor.id'] = df['actor.id']
     df_reg = df_reg.groupby('actor.id').max()
-    df_object_by_actor = df.groupby('actor.id')['object.definition.type'].value_counts().unstack(
-        fill_value=0).stack().reset_index()
-    df_object_by_actor = pd.concat([
-        pd.Series(v.values, name=k) for k, v in df_object_by_actor.groupby('object.definition.type')[0]
-    ],
-        axis=1
-    )
+    df_object_by_actor = df.groupby('actor.id')['object.definition.type'].value_counts().unstack(fill_value=0)
+    df_object_by_actor.columns.name = None
     df_reg = pd.concat([df_reg, df_object_by_actor], axis=1)
     df_reg['score'] = df.groupby('actor.id')['result.score.scaled'].mean()
-    df_reg = df_reg.loc[df_reg['score'].notnull()].reset_index().drop(columns=['index', 'lesson'], axis=1)
+    df_reg = df_reg.loc[df_reg['score'].notnull()].reset_index(drop=True).drop(columns=['lesson'], errors='ignore')
 
-    fig1, ax = plt.subplots()
-    fig1.set_figwidth(15)
-    fig1.set_figheight(15)
+    fig1 = Figure(figsize=(15, 15))
+    ax = fig1.subplots()
     sns.heatmap(df_reg.corr(), annot=True, ax=ax)
 
     X = df_reg.drop('score', axis=1)
@@ -71,11 +85,356 @@ def regression(df):
     coef_df = pd.DataFrame(zip(regression_1.coef_, X_train.columns))
     y_pred = regression_1.predict(X_test)
 
-    fig2, ax = plt.subplots()
+    fig2 = Figure()
+    ax = fig2.subplots()
 
     coeff = coef_df.iloc[(coef_df[0].abs() * -1.0).argsort()]
-    sns.barplot(x=coeff[0], y=coeff[1], orient='h', palette='flare', hue=coeff[0], legend=None)
-    plt.xlabel('Value')
-    plt.ylabel('Parameter')
+    sns.barplot(x=coeff[0], y=coeff[1], orient='h', palette='flare', hue=coeff[0], legend=None, ax=ax)
+    ax.set_xlabel('Value')
+    ax.set_ylabel('Parameter')
 
     return fig1, fig2, regression_results(y_test, y_pred)
+
+
+def actor_batches(df, where=None, batch_size=ACTOR_BATCH):
+    """
+    Aggregate the events of the actors in batches of consecutive actor IDs, so that only one batch is held at a time.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
+    - where (dict, optional): The filter of the actors: only actors with matching events are included, with all their
+      events (see QueryBackend).
+    - batch_size (int): The number of actors per batch. Default is 5000.
+
+    Returns:
+    - Generator[pd.DataFrame]: The event counts and score sums of every actor of a batch per course, teaching type,
+      object type and verb.
+    """
+    backend = query_backend.get_backend(df)
+    actors = np.sort(backend.distinct(['actor.id'], where)['actor.id'].dropna().unique())
+    for start in range(0, len(actors), batch_size):
+        stop = actors[start + batch_size] if start + batch_size < len(actors) else None
+        batch = {'actor.id': slice(actors[start], stop)}
+        if where:
+            batch['actor.id'] = actors[start:start + batch_size].tolist()
+        yield backend.aggregate(['actor.id', 'Course', 'Teaching', 'object.definition.type', 'verb.id'],
+                                'result.score.scaled', batch)
+
+
+def feature_column(names, n_features=N_FEATURES):
+    """
+    Hash feature names into columns of a fixed-size feature space, with a hash that is stable across processes.
+
+    Parameters:
+    - names (pd.Index): The feature names.
+    - n_features (int): The number of columns. Default is 2 ** 16.
+
+    Returns:
+    - np.ndarray: The column of every name.
+    """
+    return np.array([zlib.crc32(str(name).encode()) % n_features for name in names], dtype=np.int64)
+
+
+def sparse_features(counts, n_features=N_FEATURES):
+    """
+    Build the sparse feature rows and the target of a batch of actors.
+
+    The features are the course and teaching type of the actor (as in regression), the logarithm of its number of
+    events per object type and, as high-cardinality features, per course, object type and verb. They are hashed into
+    a fixed number of columns, so the memory does not grow with the catalogue.
+
+    Parameters:
+    - counts (pd.DataFrame): A batch, as returned by actor_batches.
+    - n_features (int): The number of columns. Default is 2 ** 16.
+
+    Returns:
+    - Tuple[pd.Index, sparse.csr_matrix, np.ndarray, dict]: The actor IDs, their features, their mean score and the
+      name of every column used.
+    """
+    counts = counts.dropna(subset=['actor.id'])
+    rows, actors = pd.factorize(counts['actor.id'])
+    one_hot = ['Course=' + counts['Course'].astype(str), 'Teaching=' + counts['Teaching'].astype(str)]
+    summed = [counts['object.definition.type'].astype(str),
+              counts['Course'].astype(str) + ' / ' + counts['object.definition.type'].astype(str) + ' / ' +
+              counts['verb.id'].astype(str)]
+
+    names, values = {}, []
+    for labels_list, aggregate in [(one_hot, 'max'), (summed, 'sum')]:
+        entries = []
+        for labels in labels_list:
+            codes, unique = pd.factorize(labels)
+            columns = feature_column(unique, n_features)
+            names.update(zip(columns.tolist(), unique))
+            entries.append(pd.DataFrame({'row': rows, 'column': columns[codes], 'value': counts['count'].to_numpy()}))
+        grouped = pd.concat(entries).groupby(['row', 'column'])['value']
+        # One-hot features are 1 for the actor; counts are summed over the groups of the actor, then log-scaled.
+        values.append(grouped.max().clip(upper=1) if aggregate == 'max' else np.log1p(grouped.sum()))
+    values = pd.concat(values).groupby(level=[0, 1]).sum()
+
+    features = sparse.csr_matrix((values.to_numpy(dtype=float), (values.index.get_level_values(0),
+                                                                 values.index.get_level_values(1))),
+                                 shape=(len(actors), n_features))
+    totals = counts.groupby(rows)[['sum', 'n']].sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        target = (totals['sum'] / totals['n'].where(totals['n'] > 0)).to_numpy()
+    return pd.Index(actors, name='actor.id'), features, target, names
+
+
+def is_test(actors):
+    """
+    Assign a fixed fifth of the actors to the test set, by a hash of their ID.
+
+    Parameters:
+    - actors (pd.Index): The actor IDs.
+
+    Returns:
+    - np.ndarray: Whether every actor is in the test set.
+    """
+    return (pd.util.hash_pandas_object(actors.to_series(), index=False).to_numpy() % TEST_SHARE) == 0
+
+
+class FeatureBatches:
+    """
+    The sparse feature batches of a dataset, built once per fit and read again on every epoch.
+
+    Batches are kept in memory up to a budget (ILEDA_REGRESSION_SPILL_BYTES) and written to a temporary directory
+    beyond it, so memory stays bounded whatever the number of actors.
+    """
+
+    def __init__(self, max_bytes=SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._batches = []
+        self._directory = None
+
+    def append(self, features, target, test):
+        """
+        Add a batch.
+
+        Parameters:
+        - features (sparse.csr_matrix): The features of the actors of the batch.
+        - target (np.ndarray): Their mean score.
+        - test (np.ndarray): Whether every actor is in the test set (see is_test).
+        """
+        size = features.data.nbytes + features.indices.nbytes + features.indptr.nbytes + target.nbytes + test.nbytes
+        if self.size + size <= self.max_bytes:
+            self.size += size
+            self._batches.append((features, target, test))
+            return
+
+        if self._directory is None:
+            self._directory = tempfile.TemporaryDirectory(prefix='ileda-regression-')
+        path = os.path.join(self._directory.name, str(len(self._batches)))
+        sparse.save_npz(path + '-features.npz', features, compressed=False)
+        np.savez(path + '-rows.npz', target=target, test=test)
+        self._batches.append(path)
+
+    def __iter__(self):
+        for batch in self._batches:
+            if isinstance(batch, str):
+                with np.load(batch + '-rows.npz') as rows:
+                    batch = sparse.load_npz(batch + '-features.npz'), rows['target'], rows['test']
+            yield batch
+
+    def close(self):
+        """
+        Remove the batches written to disk.
+        """
+        if self._directory is not None:
+            self._directory.cleanup()
+            self._directory = None
+
+
+class StreamingRegression:
+    """
+    A linear regression of the mean score of the actors trained on batches of sparse actor features.
+
+    The features are streamed in batches of actors (see actor_batches and sparse_features) and fitted with stochastic
+    gradient descent, so memory stays bounded by the batch size and the hashed feature space whatever the number of
+    actors, courses or resources. The model is updated in place when new events arrive.
+    """
+
+    def __init__(self, n_features=N_FEATURES):
+        self.n_features = n_features
+        self.scaler = MaxAbsScaler()
+        self.model = SGDRegressor(alpha=1e-4, eta0=0.03, random_state=42)
+        self.names = {}
+        self.last = None
+        self.results = None
+
+    def _batches(self, df, where=None):
+        batches = FeatureBatches()
+        for counts in actor_batches(df, where):
+            actors, features, target, names = sparse_features(counts, self.n_features)
+            self.names.update(names)
+            scored = ~np.isnan(target)
+            if scored.any():
+                batches.append(features[scored], target[scored], is_test(actors[scored]))
+        return batches
+
+    def fit(self, df, where=None, epochs=EPOCHS):
+        """
+        Train the model on the actors of a dataset (or only those with matching events), and evaluate it on the test
+        actors.
+
+        The batches are aggregated once (see FeatureBatches); building them fits the scaling of the features and every
+        epoch is another pass over them.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
+        - where (dict, optional): The filter of the actors to train on (see actor_batches). Default is all actors.
+        - epochs (int): The number of passes over the batches. Default is 10.
+
+        Returns:
+        - StreamingRegression: The model itself.
+        """
+        batches = self._batches(df, where)
+        try:
+            for features, _, _ in batches:
+                self.scaler.partial_fit(features)
+
+            for _ in range(epochs):
+                for features, target, test in batches:
+                    if not test.all():
+                        self.model.partial_fit(self.scaler.transform(features[~test]), target[~test])
+
+            self.last = query_backend.time_bounds(df)[1]
+            self.results = self._evaluate(batches) if where is None else self.evaluate(df)
+        finally:
+            batches.close()
+        return self
+
+    def update(self, df):
+        """
+        Bring the model up to date with a newer version of the dataset, with a single pass over the actors with events
+        since the last one it was trained on.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
+
+        Returns:
+        - StreamingRegression: The model itself.
+        """
+        if self.last is None or not hasattr(self.model, 'coef_'):
+            return self.fit(df)
+        _, last = query_backend.time_bounds(df)
+        if last is None or last <= self.last:
+            return self
+        return self.fit(df, {'timestamp': slice(self.last + pd.Timedelta(1), None)}, UPDATE_EPOCHS)
+
+    def evaluate(self, df):
+        """
+        Evaluate the model on the test actors.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
+
+        Returns:
+        - str: The regression evaluation metrics (see regression_results), or None if there are no test actors.
+        """
+        batches = self._batches(df)
+        try:
+            return self._evaluate(batches)
+        finally:
+            batches.close()
+
+    def _evaluate(self, batches):
+        if not hasattr(self.model, 'coef_'):
+            return None
+
+        y_true, y_pred = [], []
+        for features, target, test in batches:
+            if test.any():
+                y_true.append(target[test])
+                y_pred.append(self.model.predict(self.scaler.transform(features[test])))
+        if not y_true or len(np.concatenate(y_true)) < 2:
+            return None
+        return regression_results(np.concatenate(y_true), np.concatenate(y_pred))
+
+    def weights(self, top=20):
+        """
+        Get the largest weights of the model.
+
+        Parameters:
+        - top (int): The number of weights. Default is 20.
+
+        Returns:
+        - pd.DataFrame: The weights (per unit of the scaled features) and the names of their features, largest first.
+        """
+        coefficients = self.model.coef_
+        columns = np.argsort(-np.abs(coefficients))[:top]
+        columns = columns[coefficients[columns] != 0]
+        return pd.DataFrame({0: coefficients[columns], 1: [self.names.get(column, str(column)) for column in columns]})
+
+
+_models = {}
+_latest = None
+_models_lock = threading.Lock()
+
+
+def get_streaming_model(df):
+    """
+    Get the streaming regression model of a DataFrame, training it on first use.
+
+    For the full dataset, the model of the previously loaded version is updated with the actors that have new events
+    instead of being retrained, as long as the new version ends no earlier. A dataset restricted to a date range is
+    always trained from scratch. The model is kept for as long as the DataFrame itself.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
+
+    Returns:
+    - StreamingRegression: The trained model.
+    """
+    global _latest
+
+    key = id(df)
+    with _models_lock:
+        model = _models.get(key)
+        previous = _latest
+    if model is not None:
+        return model
+
+    full = query_backend.is_full(df)
+    last = query_backend.time_bounds(df)[1] if full and previous is not None and previous.last is not None else None
+    if last is not None and previous.last <= last:
+        model = copy.deepcopy(previous).update(df)
+    else:
+        model = StreamingRegression().fit(df)
+
+    with _models_lock:
+        if key not in _models:
+            _models[key] = model
+            weakref.finalize(df, _models.pop, key, None)
+            if full:
+                _latest = model
+        return _models[key]
+
+
+def streaming_regression(df):
+    """
+    Perform the regression analysis of regression with a model trained on streamed batches of sparse actor features
+    (see StreamingRegression).
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): Input DataFrame containing regression data.
+
+    Returns:
+    - tuple: None (the correlations of the hashed features are not computed), a barplot of the largest feature
+      weights and a string of regression evaluation metrics. The barplot is None and the string explains why if the
+      model could not be trained.
+    """
+    model = get_streaming_model(df)
+    if model.results is None:
+        return None, None, 'Not enough actors with scores to train and evaluate the model.'
+
+    fig2 = Figure(figsize=(8, 8))
+    ax = fig2.subplots()
+
+    coeff = model.weights()
+    sns.barplot(x=coeff[0], y=coeff[1], orient='h', palette='flare', hue=coeff[0], legend=None, ax=ax)
+    ax.set_xlabel('Value')
+    ax.set_ylabel('Parameter')
+    fig2.tight_layout()
+
+    return None, fig2, model.results
@@ -1,72 +1,353 @@
+import matplotlib as mpl
 import matplotlib.colors as cls
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
 
+from utils import query_backend
 
-def get_network(df):
+SANKEY_LEVELS = ['Institution', 'Course', 'object.definition.type', 'verb.id']
+
+
+def get_palette(n):
     """
-    Generate a Sankey diagram visualizing the number of interactions per course.
+    Generate a list of distinct colours for an arbitrary number of categories.
+
+    Parameters:
+    - n (int): The number of colours needed.
+
+    Returns:
+    - List[str]: Hex colours, qualitative for small n and evenly sampled from a continuous colormap otherwise.
+    """
+    if n <= 10:
+        colormap = mpl.colormaps['tab10']
+        return [cls.to_hex(colormap(i)) for i in range(n)]
+    if n <= 20:
+        colormap = mpl.colormaps['tab20']
+        return [cls.to_hex(colormap(i)) for i in range(n)]
+
+    colormap = mpl.colormaps['turbo']
+    return [cls.to_hex(colormap(x)) for x in np.linspace(0.05, 0.95, n)]
+
+
+def aggregate_interactions(df, levels=None):
+    """
+    Count the interactions for every combination of the given levels.
 
     Parameters:
     - df (pd.DataFrame): The DataFrame containing interaction data.
+    - levels (List[str], optional): The columns to group by. Default is SANKEY_LEVELS.
 
     Returns:
-    - Tuple[go.Figure, pd.DataFrame]: A Plotly figure representing the Sankey diagram and a DataFrame summarizing interactions.
+    - pd.DataFrame: One row per observed combination of the levels with a 'count' column.
     """
-    color_df = pd.DataFrame({
-        'Institution': df['Institution'].unique(),
-        'color': ['yellow', 'blue', 'red', 'green']
-    })
-    color_df = color_df.merge(df[['Course', 'Institution']].drop_duplicates(), how='left')
+    levels = SANKEY_LEVELS if levels is None else list(levels)
+    return query_backend.get_backend(df).count(levels).dropna(subset=levels).reset_index(drop=True)
+
+
+def prune_levels(counts, levels, top_k=10, min_share=0.01):
+    """
+    Keep only the largest categories of each level and merge the rest into an 'Other' bucket.
+
+    Parameters:
+    - counts (pd.DataFrame): Aggregated counts as returned by aggregate_interactions.
+    - levels (List[str]): The level columns of counts.
+    - top_k (int): The maximum number of categories kept per level. Default is 10.
+    - min_share (float): Categories with a smaller share of all interactions are merged. Default is 0.01.
+
+    Returns:
+    - pd.DataFrame: The counts re-aggregated over the pruned categories.
+    """
+    counts = counts.copy()
+    total = counts['count'].sum()
+
+    for level in levels:
+        level_totals = counts.groupby(level, observed=True)['count'].sum().sort_values(ascending=False)
+        kept = level_totals.index[:top_k][level_totals.iloc[:top_k] >= min_share * total]
+        counts[level] = counts[level].astype(str).where(counts[level].isin(kept), 'Other')
+
+    return counts.groupby(levels, sort=False)['count'].sum().reset_index()
 
-    df_obj = (df
-              .groupby(['Course', 'object.definition.type'])['object.definition.type']
-              .count()
-              .unstack(fill_value=0)
-              .stack()
-              .reset_index()
-              .rename(columns={0: 'count'}))
 
-    df_obj_merged = df_obj.merge(color_df[['Course', 'color']], how='left')
+def get_sankey_links(counts, levels):
+    """
+    Build the nodes and links of a multi-level Sankey diagram from aggregated counts.
+
+    Parameters:
+    - counts (pd.DataFrame): Aggregated (and optionally pruned) counts.
+    - levels (List[str]): The level columns, in flow order.
+
+    Returns:
+    - Tuple[pd.DataFrame, pd.DataFrame]: Nodes (level, label) and links (source, target, value).
+    """
+    nodes = pd.concat(
+        [pd.DataFrame({'level': level, 'label': counts[level].drop_duplicates()}) for level in levels],
+        ignore_index=True
+    )
+    node_ids = {
+        level: pd.Series(level_nodes.index, index=level_nodes['label'])
+        for level, level_nodes in nodes.groupby('level', sort=False)
+    }
+
+    links = []
+    for source_level, target_level in zip(levels[:-1], levels[1:]):
+        pairs = counts.groupby([source_level, target_level], sort=False)['count'].sum().reset_index()
+        links.append(pd.DataFrame({
+            'source': pairs[source_level].map(node_ids[source_level]).values,
+            'target': pairs[target_level].map(node_ids[target_level]).values,
+            'value': pairs['count'].values
+        }))
+
+    links = pd.concat(links, ignore_index=True) if links else pd.DataFrame(columns=['source', 'target', 'value'])
+    return nodes, links
+
+
+def get_node_colors(counts, nodes):
+    """
+    Colour institution nodes and their course nodes by institution; all other nodes are light gray.
+
+    Parameters:
+    - counts (pd.DataFrame): Unpruned aggregated counts including the 'Institution' and 'Course' columns.
+    - nodes (pd.DataFrame): The nodes as returned by get_sankey_links.
 
-    unique_source_target = list(pd.unique(df_obj_merged[['Course', 'object.definition.type']].values.ravel('k')))
+    Returns:
+    - List[str]: One hex colour per node.
+    """
+    institutions = counts['Institution'].drop_duplicates()
+    institution_colors = pd.Series(get_palette(len(institutions)), index=institutions.values)
+    course_colors = (counts[['Course', 'Institution']]
+                     .drop_duplicates('Course')
+                     .set_index('Course')['Institution']
+                     .map(institution_colors))
 
-    mapping_dict = {k: v for v, k in enumerate(unique_source_target)}
+    colors = nodes['label'].map(institution_colors).where(nodes['level'] == 'Institution')
+    colors = colors.fillna(nodes['label'].map(course_colors).where(nodes['level'] == 'Course'))
+    return colors.fillna(cls.to_hex('lightgray')).tolist()
 
-    links = pd.DataFrame()
-    links['source'] = df_obj_merged['Course'].map(mapping_dict)
-    links['target'] = df_obj_merged['object.definition.type'].map(mapping_dict)
-    links['value'] = df_obj_merged['count']
 
-    color_df['Course'] = color_df['Course'].map(mapping_dict)
+def get_network(df, levels=None, top_k=10, min_share=0.01):
+    """
+    Generate a multi-level Sankey diagram visualizing the flow of interactions.
 
-    links = links.to_dict(orient='list')
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - levels (List[str], optional): The columns shown as Sankey levels, in flow order. Default is SANKEY_LEVELS.
+    - top_k (int): The maximum number of nodes per level before merging into 'Other'. Default is 10.
+    - min_share (float): Nodes with a smaller share of all interactions are merged into 'Other'. Default is 0.01.
+
+    Returns:
+    - Tuple[go.Figure, pd.DataFrame]: A Plotly figure representing the Sankey diagram and a DataFrame summarizing interactions.
+    """
+    levels = SANKEY_LEVELS if levels is None else list(levels)
+
+    counts = aggregate_interactions(
+        df, list(dict.fromkeys(levels + ['Institution', 'Course', 'object.definition.type'])))
+    pruned = prune_levels(counts, levels, top_k, min_share)
+    nodes, links = get_sankey_links(pruned, levels)
 
     fig = go.Figure(data=[go.Sankey(
         textfont=dict(color="rgba(0,0,0,1)", size=13),
         node=dict(
             pad=10,
             thickness=15,
-            label=unique_source_target,
-            color=[cls.to_hex(cls.to_rgba(color_df[color_df['Course'] == i].iloc[0]['color'])) for i in range(8)]
+            label=nodes['label'].tolist(),
+            color=get_node_colors(counts, nodes)
         ),
         link=dict(
-            source=links['source'],
-            target=links['target'],
-            value=links['value'],
+            source=links['source'].tolist(),
+            target=links['target'].tolist(),
+            value=links['value'].tolist(),
             color='lightgray'
         ),
     )
     ])
 
     fig.update_layout(
-        title='Number of interactions per course',
+        title='Number of interactions per ' + ' → '.join(level.split('.')[0].lower() for level in levels),
         autosize=False,
         width=1000,
         height=800,
         hovermode='x'
     )
 
-    df_obj = df_obj.rename(columns={'object.definition.type': 'Interaction with'})
+    df_obj = (counts
+              .groupby(['Course', 'object.definition.type'])['count']
+              .sum()
+              .unstack(fill_value=0)
+              .stack()
+              .reset_index()
+              .rename(columns={0: 'count', 'object.definition.type': 'Interaction with'}))
 
     return fig, df_obj
+
+
+def build_interaction_matrix(df, object_columns=('Course', 'object.definition.type')):
+    """
+    Build a sparse actor x object matrix of interaction counts.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - object_columns (Tuple[str]): The columns identifying an object. Default is (course, object type).
+
+    Returns:
+    - Tuple[sp.csr_matrix, pd.Index, pd.DataFrame]: The interaction matrix, the actor ids (rows) and the objects (columns).
+    """
+    object_columns = list(object_columns)
+    counts = aggregate_interactions(df, ['actor.id'] + object_columns)
+    actor_codes, actors = pd.factorize(counts['actor.id'], sort=True)
+    object_codes = counts.groupby(object_columns, sort=True, observed=True).ngroup().to_numpy()
+    objects = counts[object_columns].drop_duplicates().sort_values(object_columns).reset_index(drop=True)
+
+    matrix = sp.csr_matrix(
+        (counts['count'].to_numpy(dtype=np.float64), (actor_codes, object_codes)),
+        shape=(len(actors), len(objects))
+    )
+    return matrix, actors, objects
+
+
+def co_engagement_matrix(matrix, groups=None, max_object_share=0.5, max_neighbours=25, seed=0):
+    """
+    Compute the actor x actor co-engagement matrix (number of shared objects).
+
+    Objects engaged by more than max_object_share of the actors of their group (e.g. the course home page among the
+    actors of the course) carry no information about who works together, so they are left out.
+
+    The pairs of an object grow with the square of its number of actors, so the actors of every object are ordered by a
+    random rank shared by all objects and each one is only paired with the max_neighbours actors that follow it. Objects
+    with at most max_neighbours + 1 actors are counted exactly; larger objects contribute at most max_neighbours pairs
+    per actor, still linking all of their actors, and pairs close in the shared order keep their exact count.
+
+    Parameters:
+    - matrix (sp.csr_matrix): The actor x object interaction matrix.
+    - groups (array-like, optional): The group of every object, e.g. its course. Default is a single group.
+    - max_object_share (float): The maximum share of the actors of its group an object may have to be taken into
+      account. Default is 0.5.
+    - max_neighbours (int): The number of actors each actor is paired with per object. Default is 25.
+    - seed (int): The seed of the ranks of the actors. Default is 0.
+
+    Returns:
+    - sp.csr_matrix: A symmetric matrix with the number of objects shared by each pair of actors and a zero diagonal.
+    """
+    n_actors, n_objects = matrix.shape
+    engaged = (matrix > 0).astype(np.float64).tocsc()
+
+    groups = np.zeros(n_objects, dtype=np.int64) if groups is None else pd.factorize(np.asarray(groups))[0]
+    membership = sp.csr_matrix((np.ones(n_objects), (np.arange(n_objects), groups)),
+                               shape=(n_objects, groups.max() + 1 if n_objects else 0))
+    group_actors = np.asarray(((engaged @ membership) > 0).sum(axis=0)).ravel()
+    object_degree = np.asarray(engaged.sum(axis=0)).ravel()
+    engaged = engaged[:, np.flatnonzero(object_degree <= max_object_share * group_actors[groups])].tocoo()
+
+    ranks = np.random.default_rng(seed).permutation(n_actors)
+    order = np.lexsort((ranks[engaged.row], engaged.col))
+    objects, actors = engaged.col[order], engaged.row[order]
+
+    rows, cols = [np.zeros(0, dtype=actors.dtype)], [np.zeros(0, dtype=actors.dtype)]
+    for offset in range(1, max_neighbours + 1):
+        same = objects[offset:] == objects[:-offset]
+        # Objects with pairs at this offset also have pairs at every smaller one.
+        if not same.any():
+            break
+        rows.append(actors[:-offset][same])
+        cols.append(actors[offset:][same])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    pairs = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_actors, n_actors))
+    return (pairs + pairs.T).tocsr()
+
+
+def pagerank(adjacency, damping=0.85, tol=1e-8, max_iter=100):
+    """
+    Compute PageRank scores of an undirected weighted graph by power iteration.
+
+    Parameters:
+    - adjacency (sp.spmatrix): The symmetric adjacency matrix of the graph.
+    - damping (float): The damping factor. Default is 0.85.
+    - tol (float): The L1 convergence tolerance. Default is 1e-8.
+    - max_iter (int): The maximum number of iterations. Default is 100.
+
+    Returns:
+    - np.ndarray: The PageRank score of every node, summing to 1.
+    """
+    adjacency = sp.csr_matrix(adjacency)
+    n = adjacency.shape[0]
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_degree = np.divide(1.0, degree, out=np.zeros(n), where=degree > 0)
+    dangling = degree == 0
+
+    ranks = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        previous = ranks
+        ranks = damping * (adjacency.T @ (previous * inverse_degree) + previous[dangling].sum() / n) + (1 - damping) / n
+        if np.abs(ranks - previous).sum() < tol:
+            break
+
+    return ranks / ranks.sum()
+
+
+def interaction_graph(df, min_shared=2, max_object_share=0.5, max_neighbours=25, top_n=5):
+    """
+    Analyze the bipartite actor-object interaction graph and the actor co-engagement graph.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - min_shared (int): The minimum number of shared objects for two actors to be linked in a cluster. Default is 2.
+    - max_object_share (float): The maximum share of the actors of its course an object may have to link actors (see
+      co_engagement_matrix). Default is 0.5.
+    - max_neighbours (int): See co_engagement_matrix. Default is 25.
+    - top_n (int): The number of most connected resources reported per course. Default is 5.
+
+    Returns:
+    - Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: Actor centralities, the most connected resources per course
+      and a summary of the co-engagement clusters.
+    """
+    matrix, actors, objects = build_interaction_matrix(df)
+    engaged = (matrix > 0).astype(np.float64)
+
+    bipartite = sp.bmat([[None, matrix], [matrix.T, None]], format='csr')
+    ranks = pagerank(bipartite)
+
+    co_engagement = co_engagement_matrix(matrix, objects['Course'], max_object_share, max_neighbours)
+    links = (co_engagement >= min_shared).tocsr()
+    n_clusters, labels = connected_components(links, directed=False)
+
+    actors_df = pd.DataFrame({
+        'actor.id': actors,
+        'Interactions': np.asarray(matrix.sum(axis=1)).ravel().astype(int),
+        'Objects': np.asarray(engaged.sum(axis=1)).ravel().astype(int),
+        'Co-engaged actors': np.diff(links.indptr),
+        'PageRank': ranks[:len(actors)],
+        'Cluster': labels
+    }).sort_values('PageRank', ascending=False, ignore_index=True)
+
+    objects_df = objects.rename(columns={'object.definition.type': 'Resource'}).assign(**{
+        'Actors': np.asarray(engaged.sum(axis=0)).ravel().astype(int),
+        'Interactions': np.asarray(matrix.sum(axis=0)).ravel().astype(int),
+        'PageRank': ranks[len(actors):]
+    })
+    objects_df = (objects_df
+                  .sort_values(['Course', 'Actors', 'PageRank'], ascending=[True, False, False])
+                  .groupby('Course', sort=False)
+                  .head(top_n)
+                  .reset_index(drop=True))
+
+    first_courses = query_backend.get_backend(df).distinct(['actor.id', 'Course']).drop_duplicates('actor.id')
+    members = actors_df.merge(first_courses, how='left')
+    cluster_courses = (members
+                       .groupby(['Cluster', 'Course'])
+                       .size()
+                       .reset_index(name='count')
+                       .sort_values('count', ascending=False)
+                       .drop_duplicates('Cluster')
+                       .set_index('Cluster')['Course'])
+    clusters_df = (members
+                   .groupby('Cluster')
+                   .agg(Actors=('actor.id', 'size'), Interactions=('Interactions', 'sum'))
+                   .join(cluster_courses))
+    clusters_df = (clusters_df[clusters_df['Actors'] > 1]
+                   .sort_values('Actors', ascending=False)
+                   .reset_index(drop=True))
+
+    return actors_df, objects_df, clusters_df
@@ -0,0 +1,124 @@
+import os
+import threading
+from unittest.mock import MagicMock
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def shared_runtime():
+    """
+    Install the mock Streamlit runtime shared by all concurrent sessions, creating it on first use.
+
+    Returns:
+    - MagicMock: The mock runtime.
+    """
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = MagicMock(spec=Runtime)
+            _runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+            _runtime.cache_storage_manager = MemoryCacheStorageManager()
+        Runtime._instance = _runtime
+        return _runtime
+
+
+class ConcurrentAppTest(AppTest):
+    """
+    A headless session that can be rerun while other sessions run in other threads.
+
+    AppTest installs a new mock runtime for each rerun and removes it afterwards, which breaks the reruns of other
+    sessions in progress. Like a Streamlit server, these sessions share a single runtime instead.
+    """
+
+    def _run(self, widget_state=None, timeout=None):
+        shared_runtime()
+        script_runner = LocalScriptRunner(self._script_path, self.session_state)
+        self._tree = script_runner.run(widget_state, self.query_params, self.default_timeout if timeout is None
+                                       else timeout)
+        self._tree._runner = self
+        return self
+
+
+def list_pages(app_dir=APP_DIR):
+    """
+    List the scripts of the Streamlit app: the main script followed by every page.
+
+    Parameters:
+    - app_dir (str): The directory of the app. Default is the parent directory of utils.
+
+    Returns:
+    - List[str]: The paths of the scripts.
+    """
+    app_dir = os.path.normpath(app_dir)
+    pages_dir = os.path.join(app_dir, 'pages')
+    pages = sorted(name for name in os.listdir(pages_dir) if name.endswith('.py'))
+    return [os.path.join(app_dir, 'Main.py')] + [os.path.join(pages_dir, name) for name in pages]
+
+
+def page_name(path):
+    """
+    Get the display name of a page script.
+
+    Parameters:
+    - path (str): The path of the script.
+
+    Returns:
+    - str: The name of the page.
+    """
+    return os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+
+
+def new_session(path, timeout=300, concurrent=False):
+    """
+    Start a headless session of a page script.
+
+    Parameters:
+    - path (str): The path of the script.
+    - timeout (float): The maximum duration of a rerun in seconds. Default is 300.
+    - concurrent (bool): Whether the session will run alongside sessions in other threads. Default is False.
+
+    Returns:
+    - AppTest: The session, not yet run.
+    """
+    if concurrent:
+        return ConcurrentAppTest(os.path.abspath(path), default_timeout=timeout)
+    return AppTest.from_file(path, default_timeout=timeout)
+
+
+def randomize_widgets(session, rng):
+    """
+    Give the widgets of a session random but valid values, as a user browsing the page would.
+
+    Parameters:
+    - session (AppTest): A session that has been run at least once.
+    - rng (np.random.Generator): The random generator.
+    """
+    for widget in list(session.selectbox) + list(session.radio):
+        if widget.options:
+            widget.set_value(widget.options[rng.integers(len(widget.options))])
+
+    for widget in session.multiselect:
+        if widget.options:
+            size = rng.integers(1, len(widget.options) + 1)
+            chosen = sorted(rng.choice(len(widget.options), size, replace=False))
+            widget.set_value([widget.options[index] for index in chosen])
+
+    for widget in session.number_input:
+        if isinstance(widget.value, int) and widget.min is not None and widget.max is not None:
+            widget.set_value(int(rng.integers(widget.min, widget.max + 1)))
+
+    for widget in session.slider:
+        if isinstance(widget.value, int):
+            widget.set_value(int(rng.integers(widget.min, widget.max + 1)))
+        elif isinstance(widget.value, float):
+            widget.set_value(float(rng.uniform(widget.min, widget.max)))
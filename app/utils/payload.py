@@ -0,0 +1,353 @@
+import json
+import os
+
+import numpy as np
+import plotly.io as pio
+
+DEFAULT_BUDGET = int(os.environ.get('ILEDA_FIGURE_BUDGET', 1024 ** 2))
+SIGNIFICANT_DIGITS = 4
+MIN_POINTS = 1000
+TOP_K_STEPS = [50, 20, 10, 5]
+POINT_TRACES = {'scatter', 'scattergl', 'scatter3d'}
+HIERARCHY_TRACES = {'treemap', 'sunburst', 'icicle'}
+OTHER = 'Other'
+
+
+def compact(value, digits=SIGNIFICANT_DIGITS):
+    """
+    Round every float of a figure dictionary to a number of significant digits, so that it is encoded in fewer
+    characters. Integers and strings are unchanged.
+
+    Parameters:
+    - value: A figure dictionary or any part of it.
+    - digits (int): The number of significant digits. Default is 4.
+
+    Returns:
+    - The rounded value.
+    """
+    if isinstance(value, float):
+        return float(format(value, '.' + str(digits) + 'g')) if np.isfinite(value) else value
+    if isinstance(value, list):
+        return [compact(element, digits) for element in value]
+    if isinstance(value, dict):
+        return {key: compact(element, digits) for key, element in value.items()}
+    return value
+
+
+def dumps(figure):
+    """
+    Encode a figure dictionary as compact JSON.
+
+    Parameters:
+    - figure (dict): The figure dictionary.
+
+    Returns:
+    - str: The JSON.
+    """
+    return json.dumps(figure, separators=(',', ':'))
+
+
+def density_sample(points, target, bins=16, seed=0):
+    """
+    Choose a subset of points that keeps the shape of their distribution.
+
+    The points are binned on a grid. Dense cells are sampled at a common rate, while every cell keeps at least about
+    one point, so clusters keep their relative density and isolated points are not lost.
+
+    Parameters:
+    - points (np.ndarray): The coordinates, with shape (points, dimensions).
+    - target (int): The expected number of points kept.
+    - bins (int): The number of bins per dimension. Default is 16.
+    - seed (int): The seed of the sampling. Default is 0.
+
+    Returns:
+    - np.ndarray: The positions of the kept points, in their original order.
+    """
+    n = len(points)
+    if n <= target:
+        return np.arange(n)
+
+    points = np.nan_to_num(np.asarray(points, dtype=np.float64))
+    low, high = points.min(axis=0), points.max(axis=0)
+    cells = np.clip(((points - low) / np.where(high > low, high - low, 1) * bins).astype(np.int64), 0, bins - 1)
+    _, inverse, counts = np.unique(cells @ (bins ** np.arange(points.shape[1])), return_inverse=True,
+                                   return_counts=True)
+
+    # Find the common rate by bisection: a cell of c points keeps about max(rate * c, 1) of them.
+    low_rate, high_rate = 0.0, 1.0
+    for _ in range(30):
+        rate = (low_rate + high_rate) / 2
+        if np.minimum(counts, np.maximum(rate * counts, 1)).sum() > target:
+            high_rate = rate
+        else:
+            low_rate = rate
+
+    probabilities = np.minimum(1, np.maximum(low_rate, 1 / counts))[inverse]
+    return np.flatnonzero(np.random.default_rng(seed).random(n) < probabilities)
+
+
+def _coordinates(values):
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        return values.astype(np.float64)
+    _, codes = np.unique(values.astype(str), return_inverse=True)
+    return codes.astype(np.float64)
+
+
+def _take(container, n, keep):
+    for key, value in container.items():
+        if isinstance(value, list) and len(value) == n:
+            container[key] = [value[index] for index in keep]
+
+
+def downsample_points(trace, target):
+    """
+    Downsample the points of a scatter trace in place (see density_sample), with every per-point attribute.
+
+    Parameters:
+    - trace (dict): The trace dictionary.
+    - target (int): The expected number of points kept.
+
+    Returns:
+    - Tuple[int, int]: The number of points kept and the original number.
+    """
+    axes = [axis for axis in ['x', 'y', 'z'] if isinstance(trace.get(axis), list)]
+    if not axes:
+        return 0, 0
+    n = len(trace[axes[0]])
+    keep = density_sample(np.column_stack([_coordinates(trace[axis]) for axis in axes]), target)
+    if len(keep) < n:
+        _take(trace, n, keep)
+        if isinstance(trace.get('marker'), dict):
+            _take(trace['marker'], n, keep)
+    return len(keep), n
+
+
+def top_k_hierarchy(trace, k):
+    """
+    Keep the k - 1 largest children of every node of a treemap, sunburst or icicle trace in place and merge the
+    others, with their descendants, into an 'Other' child.
+
+    Parameters:
+    - trace (dict): The trace dictionary, with ids (or unique labels), parents and values.
+    - k (int): The maximum number of children per node.
+
+    Returns:
+    - bool: Whether any node was merged.
+    """
+    labels, parents = trace.get('labels'), trace.get('parents')
+    values = trace.get('values')
+    if not isinstance(labels, list) or not isinstance(parents, list) or not isinstance(values, list):
+        return False
+    ids = trace.get('ids') if isinstance(trace.get('ids'), list) else labels
+    n = len(ids)
+
+    children = {}
+    for index, parent in enumerate(parents):
+        children.setdefault(parent, []).append(index)
+
+    removed, others = set(), []
+    for parent, members in children.items():
+        if len(members) <= k:
+            continue
+        members = sorted(members, key=lambda index: values[index] or 0, reverse=True)
+        merged = members[k - 1:]
+        others.append((parent, len(merged), sum(values[index] or 0 for index in merged)))
+
+        stack = [ids[index] for index in merged]
+        removed.update(merged)
+        while stack:
+            for index in children.get(stack.pop(), []):
+                removed.add(index)
+                stack.append(ids[index])
+
+    if not others:
+        return False
+
+    keep = [index for index in range(n) if index not in removed]
+    _take(trace, n, keep)
+    if isinstance(trace.get('marker'), dict):
+        _take(trace['marker'], n, keep)
+
+    for parent, count, total in others:
+        if isinstance(trace.get('ids'), list):
+            trace['ids'].append((parent + '/' if parent else '') + OTHER)
+        trace['labels'].append(OTHER + ' (' + str(count) + ')')
+        trace['parents'].append(parent)
+        trace['values'].append(total)
+        for container in [trace, trace.get('marker') or {}]:
+            for key, value in container.items():
+                if key not in ['ids', 'labels', 'parents', 'values'] and isinstance(value, list) and \
+                        len(value) == len(trace['labels']) - 1:
+                    value.append(value[-1] if isinstance(value[-1], str) else None)
+    return True
+
+
+def _sankey_levels(sources, targets, n):
+    levels = np.zeros(n, dtype=int)
+    for _ in range(n):
+        changed = False
+        for source, target in zip(sources, targets):
+            if levels[target] < levels[source] + 1:
+                levels[target] = levels[source] + 1
+                changed = True
+        if not changed:
+            break
+    return levels
+
+
+def top_k_sankey(trace, k):
+    """
+    Keep the k - 1 nodes with the largest flow in every column of a Sankey trace in place and merge the others of
+    each column into an 'Other' node, adding up their links.
+
+    Parameters:
+    - trace (dict): The trace dictionary.
+    - k (int): The maximum number of nodes per column.
+
+    Returns:
+    - bool: Whether any node was merged.
+    """
+    node, link = trace.get('node') or {}, trace.get('link') or {}
+    labels = node.get('label')
+    sources, targets, values = link.get('source'), link.get('target'), link.get('value')
+    if not all(isinstance(value, list) for value in [labels, sources, targets, values]):
+        return False
+
+    n = len(labels)
+    levels = _sankey_levels(sources, targets, n)
+    flow = np.zeros(n)
+    np.add.at(flow, sources, values)
+    np.add.at(flow, targets, values)
+
+    mapping, new_labels, colors = {}, [], []
+    old_colors = node.get('color') if isinstance(node.get('color'), list) else None
+    merged_any = False
+    for level in np.unique(levels):
+        members = sorted(np.flatnonzero(levels == level), key=lambda index: -flow[index])
+        kept, merged = (members, []) if len(members) <= k else (members[:k - 1], members[k - 1:])
+        for index in kept:
+            mapping[index] = len(new_labels)
+            new_labels.append(labels[index])
+            colors.append(old_colors[index] if old_colors else None)
+        if merged:
+            merged_any = True
+            for index in merged:
+                mapping[index] = len(new_labels)
+            new_labels.append(OTHER + ' (' + str(len(merged)) + ')')
+            colors.append('lightgray')
+
+    if not merged_any:
+        return False
+
+    totals = {}
+    for source, target, value in zip(sources, targets, values):
+        key = (mapping[source], mapping[target])
+        totals[key] = totals.get(key, 0) + value
+    node['label'] = new_labels
+    if old_colors:
+        node['color'] = colors
+    link['source'] = [source for source, _ in totals]
+    link['target'] = [target for _, target in totals]
+    link['value'] = list(totals.values())
+    for key in list(link):
+        if key not in ['source', 'target', 'value'] and isinstance(link[key], list) and len(link[key]) == len(values):
+            del link[key]
+    return True
+
+
+def top_k_polar(figure, k):
+    """
+    Reduce a radar chart in place: keep the k - 1 largest categories and the k - 1 largest traces and add up the
+    others into an 'Other' category and an 'Other' trace.
+
+    Parameters:
+    - figure (dict): The figure dictionary, whose traces are scatterpolar traces sharing their categories.
+    - k (int): The maximum number of categories and of traces.
+
+    Returns:
+    - bool: Whether anything was merged.
+    """
+    traces = [trace for trace in figure.get('data', []) if trace.get('type') == 'scatterpolar']
+    if not traces or len(traces) != len(figure['data']) or \
+            any(trace.get('theta') != traces[0].get('theta') for trace in traces):
+        return False
+
+    theta = traces[0].get('theta') or []
+    radii = np.array([trace.get('r') or [0] * len(theta) for trace in traces], dtype=np.float64)
+    merged_any = False
+
+    if len(theta) > k:
+        order = np.argsort(-radii.sum(axis=0), kind='stable')
+        kept, merged = np.sort(order[:k - 1]), order[k - 1:]
+        radii = np.column_stack([radii[:, kept], radii[:, merged].sum(axis=1)])
+        theta = [theta[index] for index in kept] + [OTHER + ' (' + str(len(merged)) + ')']
+        merged_any = True
+
+    if len(traces) > k:
+        order = np.argsort(-radii.sum(axis=1), kind='stable')
+        kept, merged = np.sort(order[:k - 1]), order[k - 1:]
+        other = dict(traces[kept[0]], name=OTHER + ' (' + str(len(merged)) + ')')
+        traces = [traces[index] for index in kept] + [other]
+        radii = np.vstack([radii[kept], radii[merged].sum(axis=0)])
+        merged_any = True
+
+    if merged_any:
+        for trace, r in zip(traces, radii):
+            trace['r'], trace['theta'] = r.tolist(), list(theta)
+        figure['data'] = traces
+    return merged_any
+
+
+def fit(fig, budget=DEFAULT_BUDGET):
+    """
+    Encode a Plotly figure as JSON within a byte budget.
+
+    Floats are rounded to 4 significant digits. While the figure is over the budget, scatter traces are downsampled
+    (see density_sample) and treemaps, Sankey diagrams and radar charts are reduced to fewer and fewer nodes (50, 20,
+    10 and finally 5 per level), merging the smallest into 'Other'. A note on the figure tells how many points are
+    shown.
+
+    Parameters:
+    - fig (go.Figure): The figure.
+    - budget (int): The budget in bytes. Default is ILEDA_FIGURE_BUDGET or 1 MiB.
+
+    Returns:
+    - str: The JSON of the figure, which may still exceed the budget if it cannot be reduced further.
+    """
+    figure = compact(json.loads(pio.to_json(fig, validate=False)))
+    text = dumps(figure)
+    steps = iter(TOP_K_STEPS)
+    shown = {}
+
+    while len(text) > budget:
+        reduced = False
+        for index, trace in enumerate(figure.get('data', [])):
+            if trace.get('type', 'scatter') in POINT_TRACES:
+                n = len(trace.get('x') or trace.get('r') or [])
+                if n > MIN_POINTS:
+                    kept, total = downsample_points(trace, max(MIN_POINTS, int(n * budget / len(text) * 0.9)))
+                    shown[index] = (kept, shown.get(index, (0, total))[1])
+                    reduced |= kept < n
+
+        if not reduced:
+            k = next(steps, None)
+            if k is None:
+                break
+            for trace in figure.get('data', []):
+                if trace.get('type') in HIERARCHY_TRACES:
+                    top_k_hierarchy(trace, k)
+                elif trace.get('type') == 'sankey':
+                    top_k_sankey(trace, k)
+            top_k_polar(figure, k)
+
+        text = dumps(figure)
+
+    if shown:
+        kept, total = sum(kept for kept, _ in shown.values()), sum(total for _, total in shown.values())
+        figure.setdefault('layout', {}).setdefault('annotations', []).append({
+            'text': f'Showing {kept:,} of {total:,} points', 'xref': 'paper', 'yref': 'paper', 'x': 1, 'y': 0,
+            'xanchor': 'right', 'yanchor': 'bottom', 'showarrow': False, 'font': {'size': 10}
+        })
+        text = dumps(figure)
+    return text
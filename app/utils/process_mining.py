@@ -0,0 +1,400 @@
+import threading
+import weakref
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from scipy import sparse
+
+from utils import query_backend, sessions
+
+START = '(start)'
+END = '(end)'
+
+EventLog = namedtuple('EventLog', ['states', 'codes', 'starts', 'dwell', 'actors', 'courses', 'institutions'])
+
+
+def event_log(df, column):
+    """
+    Turn the events into sequences of states, one per study session (see sessions.sessionize).
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - column (str): The column giving the state of an event, e.g. 'verb.id' or 'object.definition.type'.
+
+    Returns:
+    - EventLog: The states, and for every event in actor, course and time order: the code of its state, whether it
+      starts a session, the seconds until the next event of the session (NaN for the last one) and its actor, course
+      and institution, as (codes, values) pairs.
+    """
+    df = df.dropna(subset=['actor.id', 'Course', 'timestamp'])
+    if df.empty:
+        empty = (np.zeros(0, dtype=np.int64), pd.Index([]))
+        return EventLog(pd.Index([], name=column), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool),
+                        np.zeros(0), empty, empty, empty)
+
+    order, groups, times = sessions.sort_events(df)
+    starts = sessions.session_starts(groups, times)
+
+    dwell = np.full(len(order), np.nan)
+    dwell[:-1] = np.diff(times) / 1e9
+    dwell[np.append(starts[1:], True)] = np.nan
+
+    codes, states = pd.factorize(df[column].iloc[order], sort=True)
+    states = pd.Index(np.asarray(states), name=column)
+    if (codes < 0).any():
+        states = states.append(pd.Index(['unknown'], name=column))
+        codes[codes < 0] = len(states) - 1
+
+    return EventLog(
+        states, codes, starts, dwell,
+        *[(codes, pd.Index(np.asarray(names))) for codes, names in
+          [pd.factorize(df[name].iloc[order]) for name in ['actor.id', 'Course', 'Institution']]]
+    )
+
+
+def select(log, id_or_name=None):
+    """
+    Get the events of an actor, course or institution.
+
+    Parameters:
+    - log (EventLog): The event log, as returned by event_log.
+    - id_or_name (int or str, optional): The ID of the actor or the name of the course or institution. Default is
+      all events.
+
+    Returns:
+    - EventLog: The selected events. Sessions never span courses, so they stay whole.
+    """
+    if id_or_name is None:
+        return log
+
+    if type(id_or_name) is int:
+        codes, names = log.actors
+    elif id_or_name in log.institutions[1]:
+        codes, names = log.institutions
+    else:
+        codes, names = log.courses
+    mask = codes == (names.get_loc(id_or_name) if id_or_name in names else -2)
+
+    return EventLog(log.states, log.codes[mask], log.starts[mask], log.dwell[mask],
+                    *[(codes[mask], names) for codes, names in [log.actors, log.courses, log.institutions]])
+
+
+def transition_pairs(log):
+    """
+    List the first-order transitions of every session, including the transitions from its start and to its end.
+
+    Parameters:
+    - log (EventLog): The event log.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray, np.ndarray]: The row of the source (0 for the start, 1 + code otherwise), the
+      column of the target (the code, or the number of states for the end) and the position of the event the
+      transition belongs to (the target, or the last event for the end).
+    """
+    n_states = len(log.states)
+    sources = np.empty(len(log.codes), dtype=np.int64)
+    sources[:1] = 0
+    sources[1:] = log.codes[:-1] + 1
+    sources[log.starts] = 0
+
+    ends = np.flatnonzero(np.append(log.starts[1:], True)) if len(log.codes) else np.zeros(0, dtype=np.int64)
+    rows = np.concatenate([sources, log.codes[ends] + 1])
+    columns = np.concatenate([log.codes, np.full(len(ends), n_states)])
+    positions = np.concatenate([np.arange(len(log.codes)), ends])
+    return rows, columns, positions
+
+
+def transition_counts(log):
+    """
+    Count the first-order transitions between states.
+
+    Parameters:
+    - log (EventLog): The event log.
+
+    Returns:
+    - pd.DataFrame: The counts, from the start and every state (rows) to every state and the end (columns).
+    """
+    rows, columns, _ = transition_pairs(log)
+    n_states = len(log.states)
+    counts = sparse.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)),
+                               shape=(n_states + 1, n_states + 1)).toarray()
+    return pd.DataFrame(counts, index=[START] + log.states.tolist(), columns=log.states.tolist() + [END])
+
+
+def actor_transitions(log):
+    """
+    Count the first-order transitions of every actor, as sparse rows.
+
+    Parameters:
+    - log (EventLog): The event log.
+
+    Returns:
+    - Tuple[pd.Index, sparse.csr_matrix]: The actor IDs and their counts, with a column for every (source, target)
+      pair of transition_counts in row-major order.
+    """
+    rows, columns, positions = transition_pairs(log)
+    actor_codes, actors = log.actors
+    size = len(log.states) + 1
+    counts = sparse.coo_matrix((np.ones(len(rows), dtype=np.int64), (actor_codes[positions], rows * size + columns)),
+                               shape=(len(actors), size * size)).tocsr()
+    return pd.Index(actors, name='actor.id'), counts
+
+
+def transition_probabilities(counts):
+    """
+    Normalize transition counts into the probabilities of a first-order Markov chain.
+
+    Parameters:
+    - counts (pd.DataFrame): The counts, as returned by transition_counts.
+
+    Returns:
+    - pd.DataFrame: The probability of every target given the source. Rows of sources never seen are zero.
+    """
+    totals = counts.sum(axis=1)
+    return counts.div(totals.where(totals > 0, 1), axis=0)
+
+
+def common_paths(log, length=3, top=20, collapse=True):
+    """
+    Find the most common sequences of consecutive states within sessions.
+
+    Parameters:
+    - log (EventLog): The event log.
+    - length (int): The number of states in a path. Default is 3.
+    - top (int): The number of paths returned. Default is 20.
+    - collapse (bool): Whether repetitions of the same state are counted once. Default is True.
+
+    Returns:
+    - pd.DataFrame: The paths, their number of occurrences and their share of all paths of that length.
+    """
+    codes, starts = log.codes, log.starts
+    if collapse and len(codes):
+        keep = starts | np.append(True, codes[1:] != codes[:-1])
+        codes, starts = codes[keep], starts[keep]
+
+    columns = ['Path', 'Count', 'Share']
+    windows = len(codes) - length + 1
+    if windows <= 0:
+        return pd.DataFrame(columns=columns)
+
+    session_ids = np.cumsum(starts)
+    valid = session_ids[:windows] == session_ids[length - 1:]
+    if not valid.any():
+        return pd.DataFrame(columns=columns)
+
+    base = max(len(log.states), 2)
+    keys = np.zeros(windows, dtype=np.int64)
+    for offset in range(length):
+        keys = keys * base + codes[offset:offset + windows]
+    keys, counts = np.unique(keys[valid], return_counts=True)
+
+    best = np.argsort(-counts, kind='stable')[:top]
+    paths = []
+    for key in keys[best]:
+        steps = []
+        for _ in range(length):
+            key, code = divmod(int(key), base)
+            steps.append(log.states[code])
+        paths.append(' → '.join(reversed(steps)))
+    return pd.DataFrame({'Path': paths, 'Count': counts[best], 'Share': counts[best] / counts.sum()})
+
+
+def dwell_times(log):
+    """
+    Summarize the time spent in every state before the next event of the session.
+
+    Parameters:
+    - log (EventLog): The event log.
+
+    Returns:
+    - pd.DataFrame: For every state, the number of events, the median and mean seconds until the next event and the
+      share of its events that end a session.
+    """
+    n_states = len(log.states)
+    known = ~np.isnan(log.dwell)
+    events = np.bincount(log.codes, minlength=n_states)
+    followed = np.bincount(log.codes[known], minlength=n_states)
+
+    order = np.lexsort((log.dwell[known], log.codes[known]))
+    sorted_dwell = log.dwell[known][order]
+    bounds = np.concatenate([[0], np.cumsum(followed)])
+    medians = [np.median(sorted_dwell[start:stop]) if stop > start else np.nan
+               for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table = pd.DataFrame({
+            'Events': events,
+            'Median dwell (s)': medians,
+            'Mean dwell (s)': np.bincount(log.codes[known], weights=log.dwell[known], minlength=n_states) / followed,
+            'Ends session': 1 - followed / events
+        }, index=log.states)
+    return table[table['Events'] > 0].sort_values('Events', ascending=False)
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_event_log(df, column):
+    """
+    Get the event log of a DataFrame for a state column, computing it on first use.
+
+    The log is kept for as long as the DataFrame itself. Only the needed columns are loaded from an out-of-core
+    backend.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - column (str): The column giving the state of an event.
+
+    Returns:
+    - EventLog: The event log (see event_log).
+    """
+    key = (id(df), column)
+    with _logs_lock:
+        log = _logs.get(key)
+    if log is not None:
+        return log
+
+    log = event_log(query_backend.to_frame(df, ['actor.id', 'Course', 'Institution', 'timestamp', column]), column)
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = log
+            weakref.finalize(df, _logs.pop, key, None)
+        return _logs[key]
+
+
+_actor_counts = {}
+_actor_counts_lock = threading.Lock()
+
+
+def get_actor_transitions(df, column):
+    """
+    Get the transition counts of every actor of a DataFrame for a state column, computing them on first use.
+
+    The counts are kept for as long as the DataFrame itself, so comparing another actor only reads its row.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - column (str): The column giving the state of an event.
+
+    Returns:
+    - Tuple[pd.Index, sparse.csr_matrix, np.ndarray]: The actor IDs, their counts (see actor_transitions) and the code
+      of the course with most events of every actor in the courses of the event log.
+    """
+    key = (id(df), column)
+    with _actor_counts_lock:
+        counts = _actor_counts.get(key)
+    if counts is not None:
+        return counts
+
+    log = get_event_log(df, column)
+    actor_codes, actors = log.actors
+    course_codes = log.courses[0]
+    events = sparse.coo_matrix((np.ones(len(actor_codes)), (actor_codes, course_codes)),
+                               shape=(len(actors), len(log.courses[1]))).tocsr()
+    counts = (*actor_transitions(log), np.asarray(events.argmax(axis=1)).ravel())
+    with _actor_counts_lock:
+        if key not in _actor_counts:
+            _actor_counts[key] = counts
+            weakref.finalize(df, _actor_counts.pop, key, None)
+        return _actor_counts[key]
+
+
+def compare_actor(df, column, actor_id, top=20):
+    """
+    Compare the transitions of an actor with those of the actors of its course, i.e. of the actors with most of their
+    events in the same course.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - column (str): 'verb.id' or 'object.definition.type'.
+    - actor_id (int): The ID of the actor.
+    - top (int): The number of transitions returned. Default is 20.
+
+    Returns:
+    - pd.DataFrame: The transitions of the actor that differ most from its course: the source, the target, the number
+      of transitions of the actor, the probability of the target given the source for the actor and for the course,
+      and their difference.
+    """
+    log = get_event_log(df, column)
+    actors, counts, courses = get_actor_transitions(df, column)
+    columns = ['From', 'To', 'Transitions', 'Actor', 'Course', 'Difference']
+    if actor_id not in actors:
+        return pd.DataFrame(columns=columns)
+
+    position = actors.get_loc(actor_id)
+    size = len(log.states) + 1
+    labels = dict(index=[START] + log.states.tolist(), columns=log.states.tolist() + [END])
+    actor_counts = pd.DataFrame(counts[position].toarray().reshape(size, size), **labels)
+    course_counts = pd.DataFrame(np.asarray(counts[courses == courses[position]].sum(axis=0)).reshape(size, size),
+                                 **labels)
+
+    table = pd.concat({
+        'Transitions': actor_counts.stack(),
+        'Actor': transition_probabilities(actor_counts).stack(),
+        'Course': transition_probabilities(course_counts).stack()
+    }, axis=1).rename_axis(['From', 'To']).reset_index()
+    # Only the sources the actor went through can be compared.
+    table = table[table['From'].map(actor_counts.sum(axis=1)) > 0]
+    table['Difference'] = table['Actor'] - table['Course']
+    table = table.iloc[np.argsort(-table['Difference'].abs().to_numpy(), kind='stable')[:top]]
+    return table[columns].round(2).reset_index(drop=True)
+
+
+def get_transition_heatmap(probabilities, counts):
+    """
+    Generate a heatmap of the transition probabilities.
+
+    Parameters:
+    - probabilities (pd.DataFrame): The probabilities, as returned by transition_probabilities.
+    - counts (pd.DataFrame): The counts they were computed from.
+
+    Returns:
+    - go.Figure: The generated heatmap, with the counts on hover.
+    """
+    fig = go.Figure(data=go.Heatmap(
+        z=probabilities.to_numpy(),
+        x=probabilities.columns.tolist(),
+        y=probabilities.index.tolist(),
+        customdata=counts.to_numpy(),
+        zmin=0,
+        zmax=1,
+        colorscale='Blues',
+        colorbar=dict(title='Probability'),
+        hovertemplate='%{y} → %{x}<br>Probability: %{z:.2f}<br>Transitions: %{customdata}<extra></extra>'
+    ))
+
+    fig.update_layout(
+        xaxis=dict(title='Next', tickangle=45),
+        yaxis=dict(title='Current', autorange='reversed'),
+        height=600
+    )
+
+    return fig
+
+
+def display(df, column, id_or_name=None, length=3, top=20):
+    """
+    Analyze the order of the actions of an actor, course or institution.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - column (str): 'verb.id' or 'object.definition.type'.
+    - id_or_name (int or str, optional): The ID of the actor or the name of the course or institution. Default is
+      all events.
+    - length (int): The number of states in the common paths. Default is 3.
+    - top (int): The number of common paths. Default is 20.
+
+    Returns:
+    - Tuple[go.Figure, pd.DataFrame, pd.DataFrame]: The heatmap of the transition probabilities, the common paths and
+      the dwell times. The figure is None if there are no events.
+    """
+    log = select(get_event_log(df, column), id_or_name)
+    if not len(log.codes):
+        return None, common_paths(log, length, top), dwell_times(log)
+
+    counts = transition_counts(log)
+    figure = get_transition_heatmap(transition_probabilities(counts), counts)
+    return figure, common_paths(log, length, top), dwell_times(log).round(2)
@@ -0,0 +1,414 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+PROFILE_DIRECTORY = os.environ.get('ILEDA_PROFILE_DIR', 'data/profiles')
+PROFILE_MODE = os.environ.get('ILEDA_PROFILE', '')
+DEFAULT_INTERVAL = float(os.environ.get('ILEDA_PROFILE_INTERVAL', 0.005))
+MAX_PROFILES = 50
+TOP_N = 25
+MODES = {'1': 'cpu', 'cpu': 'cpu', 'memory': 'memory'}
+
+_active = {}
+_active_lock = threading.Lock()
+_tracing = {'users': 0, 'started': False}
+
+
+def get_mode(query_value=None):
+    """
+    Get the profiling mode of a script run from the 'profile' query parameter or ILEDA_PROFILE.
+
+    Parameters:
+    - query_value (str, optional): The value of the 'profile' query parameter.
+
+    Returns:
+    - str or None: 'cpu' for a sampling profile, 'memory' to add tracemalloc snapshots, or None if disabled.
+    """
+    return MODES.get(query_value or PROFILE_MODE)
+
+
+def describe_frame(code):
+    """
+    Describe the function of a frame.
+
+    Parameters:
+    - code (CodeType): The code object of the frame.
+
+    Returns:
+    - Tuple[str, str, int]: The function name, the file (relative to the working directory when inside it) and the
+      first line of the function.
+    """
+    file = code.co_filename
+    if file.startswith(os.getcwd() + os.sep):
+        file = os.path.relpath(file)
+    return code.co_name, file, code.co_firstlineno
+
+
+class SamplingProfiler:
+    """
+    Sample the call stack of a thread from a background thread until a given frame returns.
+
+    The profiled thread is not instrumented: every interval the sampler reads its current frame and walks up to the
+    root frame, so the overhead on the profiled code is the time the sampler holds the interpreter lock. Worker threads
+    running calls on behalf of the profiled thread (see call) are sampled too, and their stacks are shown under the
+    root frame.
+    """
+
+    def __init__(self, root, name, interval=DEFAULT_INTERVAL, memory=False, directory=PROFILE_DIRECTORY):
+        self.root = root
+        self.name = name
+        self.interval = interval
+        self.memory = memory
+        self.directory = directory
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.started_at = None
+        self.duration = None
+        self.path = None
+        self._frames = {}
+        self._workers = {}
+        self._workers_lock = threading.Lock()
+        self._traced = False
+        self._snapshot = None
+        self._done = threading.Event()
+
+    def start(self):
+        """
+        Start sampling the calling thread.
+
+        Returns:
+        - SamplingProfiler: The profiler itself.
+        """
+        if self.memory:
+            # Concurrent memory profiles share tracemalloc; the last one to finish stops it if it was off before.
+            with _active_lock:
+                if _tracing['users'] == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _tracing['started'] = True
+                _tracing['users'] += 1
+                self._traced = True
+            tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+
+        self.started_at = time.time()
+        threading.Thread(target=self._run, name='profiler', daemon=True).start()
+        return self
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call a function on behalf of the profiled thread, e.g. in a worker thread building one of its figures, sampling
+        the calling thread until the function returns.
+
+        Parameters:
+        - func (callable): The function.
+        - args: Its positional arguments.
+        - kwargs: Its keyword arguments.
+
+        Returns:
+        - The result of the function.
+        """
+        thread_id = threading.get_ident()
+        with self._workers_lock:
+            self._workers[thread_id] = sys._getframe()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._workers_lock:
+                del self._workers[thread_id]
+
+    def _walk(self, frame, root):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            index = self._frames.get(code)
+            if index is None:
+                index = self._frames[code] = len(self._frames)
+            stack.append(index)
+            if frame is root:
+                return tuple(reversed(stack))
+            frame = frame.f_back
+        return None
+
+    def _sample(self):
+        frames = sys._current_frames()
+        stack = self._walk(frames.get(self.thread_id), self.root)
+        if stack is None:
+            return None
+
+        with self._workers_lock:
+            workers = list(self._workers.items())
+        stacks = [stack]
+        for thread_id, root in workers:
+            worker_stack = self._walk(frames.get(thread_id), root)
+            if worker_stack is not None:
+                stacks.append(stack[:1] + worker_stack)
+        return stacks
+
+    def _run(self):
+        try:
+            while True:
+                stacks = self._sample()
+                if stacks is None:
+                    break
+                self.stacks.update(stacks)
+                time.sleep(self.interval)
+            self.duration = time.time() - self.started_at
+            self.root = None
+            self.path = self.save()
+        finally:
+            with _active_lock:
+                if _active.get(self.thread_id) is self:
+                    del _active[self.thread_id]
+                if self._traced:
+                    _tracing['users'] -= 1
+                    if _tracing['users'] == 0 and _tracing['started']:
+                        tracemalloc.stop()
+                        _tracing['started'] = False
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the root frame has returned and the profile is saved.
+
+        Parameters:
+        - timeout (float, optional): The maximum time to wait in seconds.
+
+        Returns:
+        - bool: True if the profile is saved.
+        """
+        return self._done.wait(timeout)
+
+    def frames(self):
+        """
+        Get the sampled functions in order of first appearance.
+
+        Returns:
+        - List[Tuple[str, str, int]]: The function name, file and first line of every function (see describe_frame).
+        """
+        return [describe_frame(code) for code in self._frames]
+
+    def summary(self, top=TOP_N):
+        """
+        Summarize the samples by function.
+
+        Parameters:
+        - top (int): The number of functions listed. Default is 25.
+
+        Returns:
+        - dict: The name, start time, duration, interval and number of samples, and the functions with the most samples
+          in themselves ('self') and in themselves or their callees ('total').
+        """
+        frames = self.frames()
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for index in set(stack):
+                total[index] += count
+
+        def listing(counter):
+            return [{'function': frames[index][0], 'file': frames[index][1], 'line': frames[index][2],
+                     'samples': count} for index, count in counter.most_common(top)]
+
+        return {
+            'name': self.name,
+            'started': self.started_at,
+            'duration': self.duration,
+            'interval': self.interval,
+            'samples': sum(self.stacks.values()),
+            'self': listing(own),
+            'total': listing(total)
+        }
+
+    def speedscope(self):
+        """
+        Convert the samples into the speedscope file format.
+
+        Returns:
+        - dict: A speedscope document with one sampled profile, weighted in seconds.
+        """
+        stacks = list(self.stacks.items())
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'ILEDA profiling',
+            'shared': {'frames': [{'name': name, 'file': file, 'line': line} for name, file, line in self.frames()]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': self.name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(count for _, count in stacks) * self.interval,
+                'samples': [list(stack) for stack, _ in stacks],
+                'weights': [count * self.interval for _, count in stacks]
+            }]
+        }
+
+    def folded(self):
+        """
+        Convert the samples into folded stacks, the input of flamegraph.pl and most flame graph viewers.
+
+        Returns:
+        - str: One line per distinct stack: the functions from the root, separated by ';', and the number of samples.
+        """
+        labels = [name + ' (' + file + ':' + str(line) + ')' for name, file, line in self.frames()]
+        return ''.join(';'.join(labels[index] for index in stack) + ' ' + str(count) + '\n'
+                       for stack, count in self.stacks.most_common())
+
+    def memory_summary(self, top=TOP_N):
+        """
+        Summarize the memory allocated during the run by line, when tracemalloc was enabled.
+
+        Parameters:
+        - top (int): The number of lines listed. Default is 25.
+
+        Returns:
+        - dict or None: The peak traced memory in bytes and the lines with the largest growth, or None.
+        """
+        if self._snapshot is None:
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        statistics = snapshot.compare_to(self._snapshot, 'lineno')[:top]
+        return {
+            'peak': peak,
+            'growth': [{'location': str(statistic.traceback[0]), 'size_diff': statistic.size_diff,
+                        'count_diff': statistic.count_diff} for statistic in statistics]
+        }
+
+    def save(self):
+        """
+        Write the speedscope, folded stacks and summary files of the profile, removing the oldest profiles beyond 50.
+
+        Returns:
+        - str: The common path prefix of the files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at)) +
+                            '-' + format(self.started_at % 1 * 1000, '03.0f') + '-' + self.name)
+
+        summary = self.summary()
+        summary['memory'] = self.memory_summary()
+        with open(path + '.speedscope.json', 'w') as file:
+            json.dump(self.speedscope(), file)
+        with open(path + '.folded', 'w') as file:
+            file.write(self.folded())
+        with open(path + '.summary.json', 'w') as file:
+            json.dump(summary, file, indent=2)
+
+        for stale in list_profiles(self.directory)[MAX_PROFILES:]:
+            for suffix in ['.speedscope.json', '.folded', '.summary.json']:
+                if os.path.exists(stale + suffix):
+                    os.remove(stale + suffix)
+        return path
+
+
+def capture(mode):
+    """
+    Profile the rest of the current script run: the innermost module-level frame calling this function, e.g. a
+    Streamlit page, is sampled until it returns or stops. A run is profiled at most once.
+
+    Parameters:
+    - mode (str or None): The profiling mode (see get_mode). Nothing is done if None.
+
+    Returns:
+    - SamplingProfiler or None: The started profiler, or None if profiling is disabled or the run is already profiled.
+    """
+    if mode is None:
+        return None
+
+    root = sys._getframe(1)
+    while root is not None and root.f_code.co_name != '<module>':
+        root = root.f_back
+    if root is None:
+        return None
+
+    thread_id = threading.get_ident()
+    with _active_lock:
+        profiler = _active.get(thread_id)
+        if profiler is not None and profiler.root is root:
+            return None
+
+        name = os.path.splitext(os.path.basename(root.f_code.co_filename))[0]
+        profiler = _active[thread_id] = SamplingProfiler(root, name, memory=mode == 'memory')
+    return profiler.start()
+
+
+def current():
+    """
+    Get the profiler of the script run of the calling thread.
+
+    Returns:
+    - SamplingProfiler or None: The profiler, or None if the run is not profiled.
+    """
+    with _active_lock:
+        return _active.get(threading.get_ident())
+
+
+def list_profiles(directory=PROFILE_DIRECTORY):
+    """
+    List the saved profiles, most recent first.
+
+    Parameters:
+    - directory (str): The directory of the profiles. Default is ILEDA_PROFILE_DIR or data/profiles.
+
+    Returns:
+    - List[str]: The common path prefix of the files of every profile.
+    """
+    if not os.path.isdir(directory):
+        return []
+    suffix = '.summary.json'
+    return sorted((os.path.join(directory, name[:-len(suffix)]) for name in os.listdir(directory)
+                   if name.endswith(suffix)), reverse=True)
+
+
+def load_summary(path):
+    """
+    Load the summary of a saved profile.
+
+    Parameters:
+    - path (str): The path prefix of the profile, as returned by list_profiles.
+
+    Returns:
+    - dict: The summary (see SamplingProfiler.summary), with the memory summary under 'memory'.
+    """
+    with open(path + '.summary.json') as file:
+        return json.load(file)
+
+
+def flame_graph(path, min_share=0.005):
+    """
+    Build an icicle chart (a flame graph growing downwards) from the folded stacks of a saved profile.
+
+    Parameters:
+    - path (str): The path prefix of the profile, as returned by list_profiles.
+    - min_share (float): Calls with a smaller share of the samples are left out. Default is 0.005.
+
+    Returns:
+    - go.Figure: The chart.
+    """
+    import plotly.graph_objects as go
+
+    totals = Counter()
+    with open(path + '.folded') as file:
+        for line in file:
+            stack, count = line.rstrip('\n').rsplit(' ', 1)
+            functions = stack.split(';')
+            for depth in range(1, len(functions) + 1):
+                totals[tuple(functions[:depth])] += int(count)
+
+    samples = sum(count for stack, count in totals.items() if len(stack) == 1)
+    kept = [stack for stack, count in totals.items() if count >= min_share * samples]
+    fig = go.Figure(go.Icicle(
+        ids=[';'.join(stack) for stack in kept],
+        labels=[stack[-1] for stack in kept],
+        parents=[';'.join(stack[:-1]) for stack in kept],
+        values=[totals[stack] for stack in kept],
+        branchvalues='total',
+        tiling=dict(orientation='v')
+    ))
+    fig.update_layout(margin=dict(t=10, l=10, r=10, b=10), height=700)
+    return fig
@@ -0,0 +1,623 @@
+import glob
+import os
+import threading
+import weakref
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+from utils import anomalies, time_index
+
+DERIVED_COLUMNS = {
+    'date': 'timestamp',
+    'scored': 'result.score.scaled'
+}
+INDEXED_COLUMNS = ['Course', 'Institution', 'actor.id']
+
+
+class QueryBackend(ABC):
+    """
+    The aggregations the analyses need from the event log, so that they can run where the data is stored.
+
+    Columns are the columns of processed.csv plus the derived columns 'date' (the day of the timestamp) and 'scored'
+    (whether the event has a score). Filters are dictionaries mapping a column to a value, a list of values or a
+    slice of values (start inclusive, stop exclusive). Missing values in a grouping column form a group of their own.
+    """
+
+    @abstractmethod
+    def count(self, by, where=None):
+        """
+        Count the events for every combination of the given columns.
+
+        Parameters:
+        - by (List[str]): The columns to group by.
+        - where (dict, optional): The filter.
+
+        Returns:
+        - pd.DataFrame: The combinations in order of first appearance, with a 'count' column.
+        """
+
+    @abstractmethod
+    def aggregate(self, by, column, where=None):
+        """
+        Summarize a numeric column for every combination of the given columns.
+
+        Parameters:
+        - by (List[str]): The columns to group by.
+        - column (str): The column to summarize.
+        - where (dict, optional): The filter.
+
+        Returns:
+        - pd.DataFrame: The combinations in order of first appearance, with the number of events ('count'), the number
+          of non-null values ('n') and their 'sum', 'min' and 'max'.
+        """
+
+    @abstractmethod
+    def distinct(self, columns, where=None):
+        """
+        Get the distinct combinations of the given columns.
+
+        Parameters:
+        - columns (List[str]): The columns.
+        - where (dict, optional): The filter.
+
+        Returns:
+        - pd.DataFrame: The combinations in order of first appearance.
+        """
+
+    @abstractmethod
+    def frame(self, columns=None, where=None):
+        """
+        Materialize the matching events.
+
+        Parameters:
+        - columns (List[str], optional): The columns to load. Default is all columns.
+        - where (dict, optional): The filter.
+
+        Returns:
+        - pd.DataFrame: The events.
+        """
+
+    def fingerprints(self, column, where=None):
+        """
+        Hash the events of every value of a column, so that changed inputs can be detected without keeping a copy.
+
+        The hash of a group is the sum of the hashes of its rows (all columns), so it does not depend on the order of
+        the events but changes when an event is added, removed or modified.
+
+        Parameters:
+        - column (str): The column to group by.
+        - where (dict, optional): The filter.
+
+        Returns:
+        - dict: The hash of every value of the column (None for missing values).
+        """
+        hashes = {}
+        _add_fingerprints(hashes, self.frame(where=where), column)
+        return hashes
+
+
+def _later(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def _earlier(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _match(values, condition):
+    if isinstance(condition, slice):
+        mask = np.ones(len(values), dtype=bool)
+        if condition.start is not None:
+            mask &= (values >= condition.start).to_numpy()
+        if condition.stop is not None:
+            mask &= (values < condition.stop).to_numpy()
+        return mask
+    if isinstance(condition, (list, tuple, set)):
+        return values.isin(list(condition)).to_numpy()
+    return (values == condition).to_numpy()
+
+
+def _add_fingerprints(hashes, frame, column):
+    codes, names = pd.factorize(frame[column], use_na_sentinel=False)
+    sums = np.zeros(len(names), dtype=np.uint64)
+    np.add.at(sums, codes, pd.util.hash_pandas_object(frame, index=False).to_numpy())
+    for name, value in zip(names, sums):
+        name = None if pd.isna(name) else name
+        hashes[name] = (hashes.get(name, 0) + int(value)) % 2 ** 64
+
+
+class PandasBackend(QueryBackend):
+    """
+    Run the queries on an in-memory DataFrame. This is the default backend.
+
+    Filters on a timestamp range and on a single course, institution or actor select the rows by binary search in
+    the time index of the DataFrame; the other filters are evaluated on the selected rows only.
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+    def __repr__(self):
+        return 'PandasBackend(<data>)'
+
+    def _column(self, name, positions):
+        values = self.df[DERIVED_COLUMNS.get(name, name)]
+        if positions is not None:
+            values = values.iloc[positions]
+        if name == 'date':
+            return values.dt.normalize()
+        if name == 'scored':
+            return values.notna()
+        return values
+
+    def _positions(self, where):
+        if not where:
+            return None
+        where = dict(where)
+
+        times = where.pop('timestamp', slice(None))
+        group = next((column for column in INDEXED_COLUMNS if column in where and
+                      not isinstance(where[column], (slice, list, tuple, set))), None)
+        if isinstance(times, slice) and (group is not None or times != slice(None)):
+            positions = time_index.get_index(self.df).positions(
+                self.df, times.start, times.stop, group, where.pop(group) if group is not None else None)
+        else:
+            if not isinstance(times, slice):
+                where['timestamp'] = times
+            positions = np.arange(len(self.df))
+
+        for column, condition in where.items():
+            positions = positions[_match(self._column(column, positions), condition)]
+        return positions
+
+    def count(self, by, where=None):
+        positions = self._positions(where)
+        keys = [self._column(name, positions) for name in by]
+        return pd.concat(keys, axis=1, keys=by).groupby(
+            by, sort=False, dropna=False, observed=True).size().reset_index(name='count')
+
+    def aggregate(self, by, column, where=None):
+        positions = self._positions(where)
+        frame = pd.concat([self._column(name, positions) for name in by] + [self._column(column, positions)], axis=1,
+                          keys=list(by) + ['value'])
+        grouped = frame.groupby(by, sort=False, dropna=False, observed=True)['value']
+        return pd.DataFrame({
+            'count': grouped.size(),
+            'n': grouped.count(),
+            'sum': grouped.sum(),
+            'min': grouped.min(),
+            'max': grouped.max()
+        }).reset_index()
+
+    def distinct(self, columns, where=None):
+        positions = self._positions(where)
+        return pd.concat([self._column(name, positions) for name in columns], axis=1,
+                         keys=columns).drop_duplicates().reset_index(drop=True)
+
+    def frame(self, columns=None, where=None):
+        positions = self._positions(where)
+        df = self.df if columns is None else self.df[list(columns)]
+        return df if positions is None else df.iloc[positions]
+
+
+class ParquetBackend(QueryBackend):
+    """
+    Run the queries as pushed-down columnar scans over Parquet files, for event logs larger than memory.
+
+    Only the columns a query needs are read, filters are evaluated by the scanner, and every batch is aggregated as
+    soon as it is read, so memory use depends on the size of the result rather than the size of the data.
+    Requires pyarrow.
+
+    A backend restricted to a date range or to the events without anomalies (see restrict) adds the range or the
+    exclusion to the filter of every query.
+    """
+
+    def __init__(self, path, batch_size=1_000_000, time_range=None, exclude_anomalies=False):
+        import pyarrow.dataset as ds
+
+        self.path = path
+        self.batch_size = batch_size
+        self.time_range = time_range
+        self.exclude_anomalies = exclude_anomalies
+        self.dataset = ds.dataset(path, format='parquet')
+
+    def __repr__(self):
+        arguments = [repr(self.path)]
+        if self.time_range is not None:
+            arguments.append(repr(self.time_range))
+        if self.exclude_anomalies:
+            arguments.append('exclude_anomalies=True')
+        return 'ParquetBackend(' + ', '.join(arguments) + ')'
+
+    def __reduce__(self):
+        return ParquetBackend, (self.path, self.batch_size, self.time_range, self.exclude_anomalies)
+
+    def _filter(self, where):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        where = dict(where or {})
+        if self.time_range is not None:
+            times = where.pop('timestamp', slice(None))
+            start, stop = self.time_range
+            where['timestamp'] = slice(_later(start, times.start), _earlier(stop, times.stop))
+        if self.exclude_anomalies:
+            where['anomaly'] = 0
+
+        expression = None
+        for column, condition in where.items():
+            field = pc.field(DERIVED_COLUMNS.get(column, column))
+            if column == 'scored':
+                term = field.is_valid() if condition else ~field.is_valid()
+            elif column == 'date':
+                raise ValueError("Filter on 'timestamp' instead of 'date'.")
+            elif isinstance(condition, slice):
+                term = None
+                if condition.start is not None:
+                    term = field >= pa.scalar(pd.Timestamp(condition.start) if column == 'timestamp'
+                                              else condition.start)
+                if condition.stop is not None:
+                    stop = field < pa.scalar(pd.Timestamp(condition.stop) if column == 'timestamp'
+                                             else condition.stop)
+                    term = stop if term is None else term & stop
+                if term is None:
+                    continue
+            elif isinstance(condition, (list, tuple, set)):
+                term = field.isin(list(condition))
+            else:
+                term = field == pa.scalar(condition)
+            expression = term if expression is None else expression & term
+        return expression
+
+    def _tables(self, columns, where):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        physical = list(dict.fromkeys(DERIVED_COLUMNS.get(column, column) for column in columns))
+        scanner = self.dataset.scanner(columns=physical, filter=self._filter(where), batch_size=self.batch_size)
+
+        for batch in scanner.to_batches():
+            if batch.num_rows == 0:
+                continue
+            table = pa.Table.from_batches([batch]).replace_schema_metadata(None)
+            if 'date' in columns:
+                table = table.append_column('date', pc.floor_temporal(table['timestamp'], unit='day'))
+            if 'scored' in columns:
+                table = table.append_column('scored', pc.is_valid(table['result.score.scaled']))
+            yield table.select(list(columns))
+
+    def _group(self, by, columns, aggregations, merge_aggregations, where):
+
+        partials = []
+        for table in self._tables(list(dict.fromkeys(list(by) + columns)), where):
+            partials.append(table.group_by(by, use_threads=False).aggregate(aggregations))
+            if len(partials) >= 16:
+                partials = [self._merge(partials, by, merge_aggregations)]
+
+        if not partials:
+            return None
+        return self._merge(partials, by, merge_aggregations)
+
+    @staticmethod
+    def _merge(partials, by, merge_aggregations):
+        import pyarrow as pa
+
+        table = pa.concat_tables(partials)
+        if len(partials) == 1:
+            return table
+        merged = table.group_by(by, use_threads=False).aggregate(merge_aggregations)
+        names = {column + '_' + function: column for column, function in merge_aggregations}
+        return merged.rename_columns([names.get(name, name) for name in merged.column_names])
+
+    def count(self, by, where=None):
+        table = self._group(by, [], [([], 'count_all')], [('count_all', 'sum')], where)
+        if table is None:
+            return pd.DataFrame(columns=list(by) + ['count'])
+        return table.to_pandas()[list(by) + ['count_all']].rename(columns={'count_all': 'count'})
+
+    def aggregate(self, by, column, where=None):
+        names = ['count_all'] + [column + '_' + name for name in ['count', 'sum', 'min', 'max']]
+        table = self._group(
+            by, [column],
+            [([], 'count_all'), (column, 'count'), (column, 'sum'), (column, 'min'), (column, 'max')],
+            [(names[0], 'sum'), (names[1], 'sum'), (names[2], 'sum'), (names[3], 'min'), (names[4], 'max')],
+            where
+        )
+        if table is None:
+            return pd.DataFrame(columns=list(by) + ['count', 'n', 'sum', 'min', 'max'])
+        return table.to_pandas()[list(by) + names].set_axis(list(by) + ['count', 'n', 'sum', 'min', 'max'], axis=1)
+
+    def distinct(self, columns, where=None):
+        table = self._group(columns, [], [], [], where)
+        if table is None:
+            return pd.DataFrame(columns=list(columns))
+        return table.to_pandas()[list(columns)]
+
+    def time_bounds(self):
+        """
+        Get the timestamps of the first and last events from a scan of the timestamp column.
+
+        Returns:
+        - Tuple[pd.Timestamp, pd.Timestamp]: The first and last timestamps (None if there are no events).
+        """
+        import pyarrow.compute as pc
+
+        first, last = None, None
+        for table in self._tables(['timestamp'], None):
+            bounds = pc.min_max(table['timestamp'])
+            first = _earlier(first, bounds['min'].as_py())
+            last = _later(last, bounds['max'].as_py())
+        return (None if first is None else pd.Timestamp(first)), (None if last is None else pd.Timestamp(last))
+
+    def frame(self, columns=None, where=None):
+        import pyarrow as pa
+
+        columns = self.dataset.schema.names if columns is None else list(columns)
+        tables = list(self._tables(columns, where))
+        if not tables:
+            return self.dataset.schema.remove_metadata().empty_table().select(
+                [column for column in columns if column in self.dataset.schema.names]).to_pandas()
+        return pa.concat_tables(tables).to_pandas()
+
+    def fingerprints(self, column, where=None):
+        hashes = {}
+        for table in self._tables(self.dataset.schema.names, where):
+            _add_fingerprints(hashes, table.to_pandas(), column)
+        return hashes
+
+
+def get_backend(data):
+    """
+    Get the query backend of a dataset.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset, as returned by open_dataset.
+
+    Returns:
+    - QueryBackend: The backend itself, or a PandasBackend over the DataFrame.
+    """
+    return data if isinstance(data, QueryBackend) else PandasBackend(data)
+
+
+def to_frame(data, columns=None):
+    """
+    Get a dataset as a DataFrame, for analyses that need the individual events.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset, as returned by open_dataset.
+    - columns (List[str], optional): The columns needed. Only these are loaded from an out-of-core backend.
+
+    Returns:
+    - pd.DataFrame: The DataFrame itself or the materialized columns.
+    """
+    return data if isinstance(data, pd.DataFrame) else data.frame(columns)
+
+
+def values(data, column):
+    """
+    Get the distinct values of a column.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset, as returned by open_dataset.
+    - column (str): The column.
+
+    Returns:
+    - List: The values in order of first appearance, without missing values.
+    """
+    return get_backend(data).distinct([column])[column].dropna().tolist()
+
+
+def restrict(data, start=None, stop=None, exclude_anomalies=False):
+    """
+    Restrict a dataset to the events in a date range, optionally without the events flagged as anomalies.
+
+    A DataFrame is sliced with its time index and remembers the range and the exclusion in its attrs, and the dataset
+    it was sliced from (see source); a ParquetBackend adds them to the filter of every query. They are part of the
+    cache keys of the figures built from the restricted data.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The full dataset, as returned by open_dataset.
+    - start (pd.Timestamp, optional): The start of the range (inclusive).
+    - stop (pd.Timestamp, optional): The end of the range (exclusive).
+    - exclude_anomalies (bool): Whether to leave out the flagged events (see anomalies.flag). Default is False.
+
+    Returns:
+    - pd.DataFrame or QueryBackend: The restricted dataset, or the dataset itself if nothing is left out.
+    """
+    if start is None and stop is None and not exclude_anomalies:
+        return data
+    if exclude_anomalies and not has_anomaly_flags(data):
+        raise ValueError(repr(data) + ' has no anomaly flags; convert it again with convert_csv.')
+    bounded = start is not None or stop is not None
+    start = None if start is None else pd.Timestamp(start)
+    stop = None if stop is None else pd.Timestamp(stop)
+
+    if isinstance(data, ParquetBackend):
+        return ParquetBackend(data.path, data.batch_size, (start, stop) if bounded else None, exclude_anomalies)
+    if not isinstance(data, pd.DataFrame):
+        raise TypeError('Cannot restrict ' + repr(data) + '.')
+
+    positions = time_index.get_index(data).positions(data, start, stop)
+    if exclude_anomalies:
+        positions = positions[data['anomaly'].to_numpy()[positions] == 0]
+    restricted = data.iloc[positions]
+    if bounded:
+        restricted.attrs['time_range'] = (start, stop)
+    if exclude_anomalies:
+        restricted.attrs['exclude_anomalies'] = True
+
+    key, full = id(restricted), source(data)
+    with _sources_lock:
+        _sources[key] = full
+    weakref.finalize(restricted, _sources.pop, key, None)
+    return restricted
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def source(data):
+    """
+    Get the full dataset a dataset was restricted from (see restrict).
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset.
+
+    Returns:
+    - pd.DataFrame or QueryBackend: The dataset as returned by open_dataset, or data itself if it was not restricted.
+    """
+    if isinstance(data, ParquetBackend):
+        return data if is_full(data) else ParquetBackend(data.path, data.batch_size)
+    with _sources_lock:
+        return _sources.get(id(data), data)
+
+
+def time_range(data):
+    """
+    Get the date range a dataset was restricted to.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset.
+
+    Returns:
+    - Tuple[pd.Timestamp, pd.Timestamp] or None: The start and end of the range, or None for the full dataset.
+    """
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.attrs.get('time_range')
+    return getattr(data, 'time_range', None)
+
+
+def excludes_anomalies(data):
+    """
+    Check whether the events flagged as anomalies were left out of a dataset.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset.
+
+    Returns:
+    - bool: True if the dataset was restricted with exclude_anomalies.
+    """
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.attrs.get('exclude_anomalies', False)
+    return getattr(data, 'exclude_anomalies', False)
+
+
+def is_full(data):
+    """
+    Check whether a dataset is the full event log, neither restricted to a date range nor without anomalies.
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset.
+
+    Returns:
+    - bool: True for the dataset as returned by open_dataset.
+    """
+    return time_range(data) is None and not excludes_anomalies(data)
+
+
+def has_anomaly_flags(data):
+    """
+    Check whether a dataset has the anomaly flags computed at ingest (see open_dataset and convert_csv).
+
+    Parameters:
+    - data (pd.DataFrame or QueryBackend): The dataset.
+
+    Returns:
+    - bool: True if it has an 'anomaly' column.
+    """
+    if isinstance(data, pd.DataFrame):
+        return 'anomaly' in data.columns
+    return isinstance(data, ParquetBackend) and 'anomaly' in data.dataset.schema.names
+
+
+def time_bounds(data):
+    """
+    Get the timestamps of the first and last events of a dataset.
+
+    Parameters:
+    - data (pd.DataFrame or ParquetBackend): The dataset.
+
+    Returns:
+    - Tuple[pd.Timestamp, pd.Timestamp]: The first and last timestamps (None if there are no events).
+    """
+    if isinstance(data, pd.DataFrame):
+        index = time_index.get_index(data)
+        return index.first(), index.last()
+    return data.time_bounds()
+
+
+def is_parquet(path):
+    """
+    Check whether a data path refers to Parquet files.
+
+    Parameters:
+    - path (str): A file or directory path.
+
+    Returns:
+    - bool: True for a .parquet file or a directory of them.
+    """
+    return path.endswith('.parquet') or os.path.isdir(path)
+
+
+def open_dataset(path):
+    """
+    Open the event log at a path: CSV files are loaded into memory, Parquet files are queried in place.
+
+    The anomalies of the events of a CSV file are flagged once loaded, in an 'anomaly' column (see anomalies.flag);
+    Parquet files get the column when they are converted.
+
+    Parameters:
+    - path (str): The path of processed.csv, of a .parquet file or of a directory of .parquet files.
+
+    Returns:
+    - pd.DataFrame or ParquetBackend: The dataset.
+    """
+    if is_parquet(path):
+        return ParquetBackend(path)
+
+    df = pd.read_csv(
+        path
+    )
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['anomaly'] = anomalies.flag_events(df)
+    return df
+
+
+def convert_csv(csv_path, parquet_path, chunksize=1_000_000):
+    """
+    Convert processed.csv into a directory of Parquet files without loading it into memory at once.
+
+    The anomalies of the events are flagged in an 'anomaly' column (see anomalies.flag). Since the file is not sorted
+    by actor or time, it is read twice: once for the keys the anomalies are detected on (24 bytes per event), and once
+    to write the events with their flags.
+
+    Parameters:
+    - csv_path (str): The path of the CSV file.
+    - parquet_path (str): The directory to write the Parquet files to. Existing part files are replaced.
+    - chunksize (int): The number of rows per Parquet file. Default is 1,000,000.
+
+    Returns:
+    - int: The number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    keys = [anomalies.event_keys(chunk) for chunk in pd.read_csv(
+        csv_path, chunksize=chunksize, usecols=['actor.id', 'timestamp'] + anomalies.STATEMENT_COLUMNS)]
+    flags = anomalies.flag(*[np.concatenate(arrays) for arrays in zip(*keys)]) if keys else np.zeros(0, np.int8)
+
+    os.makedirs(parquet_path, exist_ok=True)
+    for old_part in glob.glob(os.path.join(parquet_path, 'part-*.parquet')):
+        os.remove(old_part)
+
+    rows = 0
+    for part, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunksize)):
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+        chunk['anomaly'] = flags[rows:rows + len(chunk)]
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False),
+                       os.path.join(parquet_path, 'part-{:05d}.parquet'.format(part)))
+        rows += len(chunk)
+    return rows
@@ -0,0 +1,323 @@
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly.graph_objects as go
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+from utils import actor_engagement, clustering, course_popularity, forecasting, network_analysis, query_backend, \
+    time_index, time_series, verbs, versioning
+
+MANIFEST_NAME = 'manifest.json'
+OVERVIEW = ('Overview', 'All data')
+DEFAULT_METRICS = ['both']
+
+
+def slugify(name):
+    """
+    Turn the name of a course or institution into a directory name.
+
+    Parameters:
+    - name (str): The name.
+
+    Returns:
+    - str: The name with every run of characters other than letters, digits, '-' and '.' replaced by '_'.
+    """
+    return re.sub(r'[^\w.-]+', '_', str(name)).strip('_') or '_'
+
+
+def report_figures(df, column, name, metrics=DEFAULT_METRICS):
+    """
+    List the figure builder calls making up the report of a course or institution, or of the whole dataset.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - column (str): 'Course', 'Institution' or 'Overview'.
+    - name (str): The name of the course or institution.
+    - metrics (List[str]): The time series metrics to plot. Default is ['both'].
+
+    Returns:
+    - List[Tuple[str, callable, tuple]]: The file name stem, the builder and its arguments for each call.
+    """
+    levels = list(network_analysis.SANKEY_LEVELS)
+    if column == OVERVIEW[0]:
+        return [
+            ('verbs', verbs.get_verb_figures, (df,)),
+            ('course_popularity', course_popularity.course_popularity, (df,)),
+            ('network', network_analysis.get_network, (df, levels, 10)),
+            ('forecast', forecasting.next_week, (df,))
+        ]
+
+    subset = query_backend.get_backend(df).frame(where={column: name})
+    figures = [('engagement', actor_engagement.display, (df, name))]
+    for metric in metrics:
+        figures.append(('activity_' + metric, time_series.display_course_or_institution_actions, (df, name, metric)))
+        figures.append(('autocorrelation_' + metric, time_series.analyze_time_series, (df, name, metric)))
+        figures.append(('forecast_' + metric, forecasting.display, (df, name, metric)))
+    figures.append(('network', network_analysis.get_network, (subset, levels, 10)))
+
+    if column == 'Institution':
+        figures.append(('verbs', verbs.get_verb_figures, (subset,)))
+    elif os.path.exists(clustering.clustering_path(name)):
+        figures.append(('clusters', clustering.cluster, (name, 3)))
+    return figures
+
+
+def code_fingerprint():
+    """
+    Hash the source code of the figure builders, so that reports are rebuilt when the analyses change.
+
+    Returns:
+    - str: The hash.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for module in [actor_engagement, clustering, course_popularity, forecasting, network_analysis, query_backend,
+                   time_series, verbs]:
+        digest.update(inspect.getsource(module).encode())
+    digest.update(inspect.getsource(report_figures).encode())
+    return digest.hexdigest()
+
+
+def input_fingerprints(df, metrics=DEFAULT_METRICS):
+    """
+    Fingerprint the inputs of the report of every course and institution and of the overview.
+
+    A report depends on the events of its course or institution, on the object types and verbs of the whole dataset
+    (the rows of the engagement summary), on the clustering features of the course, on the time series metrics and
+    on the code of the analyses.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - metrics (List[str]): The time series metrics to plot. Default is ['both'].
+
+    Returns:
+    - dict: The fingerprint of every (column, name) pair, ordered by column and then by number of events.
+    """
+    backend = query_backend.get_backend(df)
+    shared = hashlib.blake2b(digest_size=16)
+    shared.update(code_fingerprint().encode())
+    shared.update(json.dumps(list(metrics)).encode())
+    shared.update(pd.util.hash_pandas_object(
+        actor_engagement.count_assessments(df)[['object.definition.type', 'verb.id']], index=False).to_numpy())
+
+    fingerprints = {}
+    for column in ['Course', 'Institution']:
+        hashes = backend.fingerprints(column)
+        events = backend.count([column]).dropna().sort_values('count', ascending=False, kind='stable')
+        for name in events[column]:
+            digest = shared.copy()
+            digest.update(str(hashes[name]).encode())
+            if column == 'Course' and os.path.exists(clustering.clustering_path(name)):
+                digest.update(versioning.version(clustering.clustering_path(name)).encode())
+            fingerprints[(column, name)] = digest.hexdigest()
+
+    digest = shared.copy()
+    digest.update(json.dumps(sorted([str(name), value] for name, value in backend.fingerprints('Institution').items()))
+                  .encode())
+    fingerprints[OVERVIEW] = digest.hexdigest()
+    return fingerprints
+
+
+def write_outputs(stem, result, directory, pdf):
+    """
+    Write the result of a figure builder to files.
+
+    Matplotlib figures are saved as PNG files and added to the PDF of the report, Plotly figures as standalone HTML
+    files and tables as CSV files.
+
+    Parameters:
+    - stem (str): The file name stem.
+    - result: The figure, table or tuple of them returned by the builder.
+    - directory (str): The directory of the report.
+    - pdf (PdfPages): The PDF of the report.
+
+    Returns:
+    - List[str]: The names of the written files.
+    """
+    items = [item for item in (result if isinstance(result, (tuple, list)) else [result]) if item is not None]
+    files = []
+    for index, item in enumerate(items):
+        file_stem = stem if len(items) == 1 else stem + '_' + str(index + 1)
+        if isinstance(item, Figure):
+            item.savefig(os.path.join(directory, file_stem + '.png'), dpi=150, bbox_inches='tight')
+            pdf.savefig(item, bbox_inches='tight')
+            item.clear()
+            files.append(file_stem + '.png')
+        elif isinstance(item, go.Figure):
+            item.write_html(os.path.join(directory, file_stem + '.html'), include_plotlyjs='cdn')
+            files.append(file_stem + '.html')
+        elif isinstance(item, pd.DataFrame):
+            item.to_csv(os.path.join(directory, file_stem + '.csv'), index=False)
+            files.append(file_stem + '.csv')
+    return files
+
+
+_dataset = None
+
+
+def _open_worker(path):
+    global _dataset
+    if _dataset is None:
+        _dataset = query_backend.open_dataset(path)
+
+
+def build_report(column, name, output, metrics=DEFAULT_METRICS):
+    """
+    Build the report bundle of a course or institution, or of the whole dataset, in a worker process.
+
+    The figures that fail are listed in the result instead of aborting the report.
+
+    Parameters:
+    - column (str): 'Course', 'Institution' or 'Overview'.
+    - name (str): The name of the course or institution.
+    - output (str): The directory of all reports.
+    - metrics (List[str]): The time series metrics to plot. Default is ['both'].
+
+    Returns:
+    - dict: The directory of the report relative to output, the written files, the errors and the duration.
+    """
+    start = time.perf_counter()
+    relative = os.path.join(slugify(column.lower()), slugify(name))
+    directory = os.path.join(output, relative)
+    os.makedirs(directory, exist_ok=True)
+
+    files, errors = [], []
+    with PdfPages(os.path.join(directory, 'report.pdf')) as pdf:
+        for stem, func, args in report_figures(_dataset, column, name, metrics):
+            try:
+                files.extend(write_outputs(stem, func(*args), directory, pdf))
+            except Exception as error:
+                errors.append(stem + ': ' + repr(error))
+    files.append('report.pdf')
+
+    return {'directory': relative, 'files': files, 'errors': errors, 'seconds': time.perf_counter() - start}
+
+
+def load_manifest(output):
+    """
+    Load the manifest of a report directory.
+
+    Parameters:
+    - output (str): The directory of all reports.
+
+    Returns:
+    - dict: The entry of every report by key ('Course/<name>', 'Institution/<name>' or 'Overview/All data').
+    """
+    path = os.path.join(output, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(output, manifest):
+    """
+    Write the manifest of a report directory, replacing the previous one at once.
+
+    Parameters:
+    - output (str): The directory of all reports.
+    - manifest (dict): The entry of every report.
+    """
+    path = os.path.join(output, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_current(entry, fingerprint, output):
+    """
+    Check whether a report was built from the same inputs and is complete.
+
+    Parameters:
+    - entry (dict or None): The manifest entry of the report.
+    - fingerprint (str): The fingerprint of its current inputs.
+    - output (str): The directory of all reports.
+
+    Returns:
+    - bool: True if the report can be kept.
+    """
+    return (entry is not None and entry.get('fingerprint') == fingerprint and not entry.get('errors') and
+            all(os.path.exists(os.path.join(output, entry['directory'], name)) for name in entry['files']))
+
+
+def _prepare(df):
+    # Build the time index and its course and institution segments once, so that every forked worker shares them.
+    if isinstance(df, pd.DataFrame):
+        index = time_index.get_index(df)
+        for column in ['Course', 'Institution']:
+            names = query_backend.values(df, column)
+            if names:
+                index.positions(df, column=column, value=names[0])
+
+
+def generate(path, output, workers=None, metrics=DEFAULT_METRICS, force=False, progress=print):
+    """
+    Build the reports of every course and institution and of the whole dataset on a process pool.
+
+    The dataset is loaded and indexed once before the workers start; they inherit it when processes are forked and
+    load it themselves otherwise. Reports whose inputs have not changed since the last run are skipped.
+
+    Parameters:
+    - path (str): The path of the dataset (see query_backend.open_dataset).
+    - output (str): The directory to write the reports and the manifest to.
+    - workers (int, optional): The number of worker processes. Default is the number of CPUs.
+    - metrics (List[str]): The time series metrics to plot. Default is ['both'].
+    - force (bool): Whether to rebuild the unchanged reports too. Default is False.
+    - progress (callable): Called with a line of text after every report. Default is print.
+
+    Returns:
+    - dict: The number of reports built, skipped and failed and the duration in seconds.
+    """
+    global _dataset
+
+    start = time.perf_counter()
+    os.makedirs(output, exist_ok=True)
+    _dataset = query_backend.open_dataset(path)
+    _prepare(_dataset)
+
+    fingerprints = input_fingerprints(_dataset, metrics)
+    manifest = {key: entry for key, entry in load_manifest(output).items()
+                if tuple(key.split('/', 1)) in fingerprints}
+    pending = []
+    for (column, name), fingerprint in fingerprints.items():
+        if not force and is_current(manifest.get(column + '/' + name), fingerprint, output):
+            progress(column + ' ' + name + ': unchanged')
+        else:
+            pending.append((column, name))
+
+    failed = 0
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(min(workers, max(len(pending), 1)), mp_context=context,
+                             initializer=_open_worker, initargs=(path,)) as executor:
+        futures = {executor.submit(build_report, column, name, output, metrics): (column, name)
+                   for column, name in pending}
+        for future in as_completed(futures):
+            column, name = futures[future]
+            try:
+                entry = future.result()
+            except Exception as error:
+                entry = {'directory': '', 'files': [], 'errors': [repr(error)], 'seconds': 0.0}
+
+            entry['fingerprint'] = fingerprints[(column, name)]
+            manifest[column + '/' + name] = entry
+            save_manifest(output, manifest)
+
+            failed += bool(entry['errors'])
+            progress(column + ' ' + name + ': ' + str(len(entry['files'])) + ' files in ' +
+                     format(entry['seconds'], '.1f') + 's' +
+                     ''.join('\n  error: ' + error for error in entry['errors']))
+
+    return {
+        'built': len(pending),
+        'skipped': len(fingerprints) - len(pending),
+        'failed': failed,
+        'seconds': time.perf_counter() - start
+    }
@@ -0,0 +1,228 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from utils import query_backend
+
+DEFAULT_GAP = pd.Timedelta(minutes=30)
+
+
+def sort_events(df):
+    """
+    Sort the events by actor, course and time, as sessions are built.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data, with at least one event.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray, np.ndarray]: The positions of the events in sorted order, and the (actor, course)
+      group and the time in nanoseconds of every sorted event.
+    """
+    actor_codes, _ = pd.factorize(df['actor.id'])
+    course_codes, course_names = pd.factorize(df['Course'])
+    times = df['timestamp'].to_numpy().astype('datetime64[ns]').view('i8')
+
+    # Sort once on a single int64 key: the (actor, course) pair in the high bits and the time since the first event
+    # in the low bits, coarsened just enough to fit (sub-millisecond for any realistic span).
+    groups = actor_codes.astype(np.int64) * len(course_names) + course_codes
+    offsets = times - times.min()
+    time_bits = 63 - max(int(groups.max()).bit_length(), 1)
+    shift = max(int(offsets.max()).bit_length() - time_bits, 0)
+    order = np.argsort((groups << time_bits) | (offsets >> shift), kind='stable')
+    return order, groups[order], times[order]
+
+
+def session_starts(groups, times, gap=DEFAULT_GAP):
+    """
+    Tell which sorted events start a new study session.
+
+    Parameters:
+    - groups (np.ndarray): The (actor, course) group of every event, as returned by sort_events.
+    - times (np.ndarray): The time of every event, as returned by sort_events.
+    - gap (pd.Timedelta): The inactivity that ends a session. Default is 30 minutes.
+
+    Returns:
+    - np.ndarray: Whether every event starts a session.
+    """
+    new_session = np.empty(len(groups), dtype=bool)
+    new_session[:1] = True
+    new_session[1:] = (groups[1:] != groups[:-1]) | (np.diff(times) > gap.value)
+    return new_session
+
+
+def sessionize(df, gap=DEFAULT_GAP):
+    """
+    Split the events of every actor into study sessions separated by periods of inactivity.
+
+    The events are sorted by actor, course and time; a new session starts whenever the actor or the course changes
+    or the time since the previous event exceeds the gap. Every step is vectorized over all actors.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - gap (pd.Timedelta): The inactivity that ends a session. Default is 30 minutes.
+
+    Returns:
+    - pd.DataFrame: One row per session with the actor, course, institution, start, end, duration and event count.
+    """
+    columns = ['actor.id', 'Course', 'Institution', 'start', 'end', 'duration', 'events']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    actor_codes, actor_ids = pd.factorize(df['actor.id'])
+    order, groups, times = sort_events(df)
+    new_session = session_starts(groups, times, gap)
+
+    starts = np.flatnonzero(new_session)
+    first_rows = order[starts]
+
+    sessions = pd.DataFrame({
+        'actor.id': actor_ids.to_numpy()[actor_codes[first_rows]],
+        'Course': df['Course'].iloc[first_rows].reset_index(drop=True),
+        'Institution': df['Institution'].iloc[first_rows].reset_index(drop=True),
+        'start': np.minimum.reduceat(times, starts).view('datetime64[ns]'),
+        'end': np.maximum.reduceat(times, starts).view('datetime64[ns]'),
+        'events': np.diff(np.append(starts, len(order)))
+    })
+    sessions.insert(5, 'duration', sessions['end'] - sessions['start'])
+    return sessions
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_sessions(df):
+    """
+    Get the sessions of a DataFrame with the default gap, computing them on first use.
+
+    The sessions are kept for as long as the DataFrame itself. Only the needed columns are loaded from an out-of-core
+    backend.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - pd.DataFrame: The sessions (see sessionize).
+    """
+    key = id(df)
+    with _sessions_lock:
+        sessions = _sessions.get(key)
+    if sessions is not None:
+        return sessions
+
+    sessions = sessionize(query_backend.to_frame(df, ['actor.id', 'Course', 'Institution', 'timestamp']))
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = sessions
+            weakref.finalize(df, _sessions.pop, key, None)
+        return _sessions[key]
+
+
+def session_metrics(sessions, by):
+    """
+    Summarize the sessions of every actor, course or institution.
+
+    Parameters:
+    - sessions (pd.DataFrame): The sessions, as returned by sessionize.
+    - by (str): 'actor.id', 'Course' or 'Institution'.
+
+    Returns:
+    - pd.DataFrame: The number of sessions and actors, the median and mean duration in minutes, the mean number of
+      events per session and the mean number of sessions per actor, indexed by the grouping column.
+    """
+    minutes = sessions['duration'].dt.total_seconds() / 60
+    grouped = sessions.assign(minutes=minutes).groupby(by, observed=True)
+    metrics = pd.DataFrame({
+        'Sessions': grouped.size(),
+        'Actors': grouped['actor.id'].nunique(),
+        'Median duration (min)': grouped['minutes'].median(),
+        'Mean duration (min)': grouped['minutes'].mean(),
+        'Events per session': grouped['events'].mean()
+    })
+    metrics['Sessions per actor'] = metrics['Sessions'] / metrics['Actors']
+    return metrics
+
+
+def hour_profile(sessions, by):
+    """
+    Get the time-of-day profile of every actor, course or institution.
+
+    Parameters:
+    - sessions (pd.DataFrame): The sessions, as returned by sessionize.
+    - by (str): 'actor.id', 'Course' or 'Institution'.
+
+    Returns:
+    - pd.DataFrame: The share of sessions starting in each hour of the day (columns 0 to 23), indexed by the grouping
+      column.
+    """
+    codes, groups = pd.factorize(sessions[by], sort=True)
+    hours = sessions['start'].dt.hour.to_numpy()
+    counts = np.bincount(codes * 24 + hours, minlength=len(groups) * 24).reshape(len(groups), 24)
+    totals = counts.sum(axis=1, keepdims=True)
+    return pd.DataFrame(counts / np.maximum(totals, 1), index=pd.Index(groups, name=by), columns=range(24))
+
+
+def select(sessions, id_or_name):
+    """
+    Get the sessions of an actor, course or institution.
+
+    Parameters:
+    - sessions (pd.DataFrame): The sessions, as returned by sessionize.
+    - id_or_name (int or str): The ID of the actor or the name of the course or institution.
+
+    Returns:
+    - Tuple[pd.DataFrame, str]: The selected sessions and the column they were selected by.
+    """
+    if type(id_or_name) is int:
+        by = 'actor.id'
+    elif id_or_name in set(sessions['Institution']):
+        by = 'Institution'
+    else:
+        by = 'Course'
+    return sessions[sessions[by] == id_or_name], by
+
+
+def display(df, id_or_name):
+    """
+    Summarize the study sessions of an actor, course or institution.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - id_or_name (int or str): The ID of the actor or the name of the course or institution.
+
+    Returns:
+    - Tuple[dict, Figure, Figure]: The session metrics, the time-of-day profile and the number of sessions per day.
+      The figures are None if there are no sessions.
+    """
+    selected, by = select(get_sessions(df), id_or_name)
+    if selected.empty:
+        return {}, None, None
+
+    summary = session_metrics(selected, by).iloc[0].to_dict()
+    profile = hour_profile(selected, by).iloc[0]
+
+    fig1 = Figure(figsize=(10, 4))
+    ax = fig1.subplots()
+    ax.bar(profile.index, profile.to_numpy() * 100, color='steelblue')
+    ax.set_xticks(range(0, 24, 2))
+    ax.set_xlabel('Hour of day')
+    ax.set_ylabel('Sessions started (%)')
+    ax.set_title('Time of Day')
+    fig1.tight_layout()
+
+    daily = selected.groupby(selected['start'].dt.normalize()).size()
+    daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max()), fill_value=0)
+
+    fig2 = Figure(figsize=(10, 4))
+    ax = fig2.subplots()
+    ax.plot(daily.index, daily.to_numpy(), c='steelblue')
+    fig2.autofmt_xdate(rotation=45, ha='right')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Sessions')
+    ax.set_title('Sessions per Day')
+    fig2.tight_layout()
+
+    return summary, fig1, fig2
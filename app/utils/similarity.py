@@ -0,0 +1,213 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import PCA
+from sklearn.neighbors import KDTree
+
+from utils import linear_regression, query_backend, versioning
+
+SIMILARITY_DIRECTORY = os.environ.get('ILEDA_SIMILARITY_DIR', 'data/similarity')
+MAX_INDEXES = 5
+N_COMPONENTS = 16
+LEAF_SIZE = 40
+
+
+def actor_features(counts):
+    """
+    Build the feature vectors of a batch of actors.
+
+    The features are those of the resumes clustered per course (the number of events per object type and verb and the
+    mean score per object type) and those of the score regression (the course and teaching type of the actor, its
+    number of events per object type and its mean score). Counts are log-scaled; scores are NaN when the actor has no
+    scored events of that type.
+
+    Parameters:
+    - counts (pd.DataFrame): A batch, as returned by linear_regression.actor_batches.
+
+    Returns:
+    - Tuple[pd.DataFrame, pd.DataFrame]: The features of every actor, and its course, number of events and mean
+      score.
+    """
+    counts = counts.dropna(subset=['actor.id'])
+    actors = counts['actor.id']
+    types = counts['object.definition.type'].astype(str)
+
+    def pivot(labels, column, aggregate):
+        return counts.groupby([actors, labels])[column].agg(aggregate).unstack()
+
+    totals = counts.groupby(actors)[['count', 'sum', 'n']].sum()
+    sums, scored = pivot('Score ' + types, 'sum', 'sum'), pivot('Score ' + types, 'n', 'sum')
+    scored = scored.loc[:, scored.sum() > 0]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        features = pd.concat([
+            pivot('Course=' + counts['Course'].astype(str), 'count', 'max').notna().astype(float),
+            pivot('Teaching=' + counts['Teaching'].astype(str), 'count', 'max').notna().astype(float),
+            np.log1p(pivot('Events ' + types, 'count', 'sum').fillna(0)),
+            np.log1p(pivot(types + ' ' + counts['verb.id'].astype(str), 'count', 'sum').fillna(0)),
+            sums[scored.columns] / scored.where(scored > 0),
+            (totals['sum'] / totals['n'].where(totals['n'] > 0)).rename('Score')
+        ], axis=1)
+
+    courses = counts.groupby([actors, 'Course'], observed=True)['count'].sum().reset_index()
+    courses = courses.sort_values('count', ascending=False, kind='stable').drop_duplicates('actor.id')
+    info = pd.DataFrame({
+        'Course': courses.set_index('actor.id')['Course'],
+        'Events': totals['count'],
+        'Mean score': features['Score']
+    })
+    return features, info.rename_axis('actor.id')
+
+
+class SimilarityIndex:
+    """
+    A nearest-neighbour index of the actors over their standardized feature vectors (see actor_features).
+
+    The vectors are projected on their first principal components before they are indexed, as k-d trees answer
+    queries in logarithmic time only in a few dimensions; the projection keeps most of the variance of the features.
+    """
+
+    def __init__(self, features, info, n_components=N_COMPONENTS, leaf_size=LEAF_SIZE):
+        """
+        Build the index.
+
+        Parameters:
+        - features (pd.DataFrame): The features of every actor. Missing counts are 0, missing scores NaN.
+        - info (pd.DataFrame): The course, institution, number of events and mean score of every actor.
+        - n_components (int): The number of principal components indexed. Default is 16.
+        - leaf_size (int): The number of actors per leaf of the tree. Default is 40.
+        """
+        values = features.to_numpy(dtype=float)
+        means = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+        deviations = np.nanstd(values, axis=0) if len(values) else np.ones(values.shape[1])
+        # Missing scores are replaced by the mean, so they do not move the actor on that feature.
+        standardized = np.nan_to_num((values - means) / np.where(deviations > 0, deviations, 1))
+
+        n_components = min(n_components, *standardized.shape)
+        self.pca = PCA(n_components=n_components, random_state=0) if n_components > 0 else None
+        projected = self.pca.fit_transform(standardized) if self.pca is not None else np.zeros((len(values), 1))
+
+        self.actors = pd.Index(features.index, name='actor.id')
+        self.columns = features.columns
+        self.info = info.reindex(self.actors)
+        self.explained = float(self.pca.explained_variance_ratio_.sum()) if self.pca is not None else 1.0
+        self.tree = KDTree(projected, leaf_size=leaf_size) if len(projected) else None
+
+    def __len__(self):
+        return len(self.actors)
+
+    def query(self, actor_id, k=10):
+        """
+        Find the actors most similar to an actor.
+
+        Parameters:
+        - actor_id (int): The ID of the actor.
+        - k (int): The number of similar actors. Default is 10.
+
+        Returns:
+        - pd.DataFrame: The k nearest actors, closest first, with their distance, course, institution, number of
+          events and mean score. Empty if the actor is not indexed.
+        """
+        if actor_id not in self.actors or len(self) < 2:
+            return self.info.iloc[:0].reset_index().assign(Distance=np.zeros(0))
+
+        position = self.actors.get_loc(actor_id)
+        point = np.asarray(self.tree.data)[position:position + 1]
+        distances, positions = self.tree.query(point, k=min(k + 1, len(self)))
+        distances, positions = distances[0], positions[0]
+        keep = positions != position
+        distances, positions = distances[keep][:k], positions[keep][:k]
+
+        result = self.info.iloc[positions].reset_index()
+        result.insert(1, 'Distance', distances.round(3))
+        return result
+
+
+def build_index(df):
+    """
+    Build the similarity index of every actor of a dataset, aggregating the events of the actors in batches (see
+    linear_regression.actor_batches).
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - SimilarityIndex: The index.
+    """
+    features, info = [], []
+    for counts in linear_regression.actor_batches(df):
+        batch_features, batch_info = actor_features(counts)
+        features.append(batch_features)
+        info.append(batch_info)
+
+    if not features:
+        return SimilarityIndex(pd.DataFrame(index=pd.Index([], name='actor.id')),
+                               pd.DataFrame(columns=['Course', 'Institution', 'Events', 'Mean score']))
+
+    features = pd.concat(features).sort_index()
+    counted = [column for column in features if not column.startswith('Score')]
+    features[counted] = features[counted].fillna(0)
+
+    info = pd.concat(info).sort_index()
+    institutions = query_backend.get_backend(df).distinct(['Course', 'Institution']).dropna()
+    info.insert(1, 'Institution', info['Course'].map(institutions.drop_duplicates('Course')
+                                                     .set_index('Course')['Institution']))
+    return SimilarityIndex(features, info)
+
+
+def index_path(version, directory=SIMILARITY_DIRECTORY):
+    """
+    Get the path of the persisted index of a data version.
+
+    Parameters:
+    - version (str): The version of the data (see util_funcs.filtered_version).
+    - directory (str): The directory of the indexes. Default is SIMILARITY_DIRECTORY.
+
+    Returns:
+    - str: The path of the index file.
+    """
+    return os.path.join(directory, 'index-' + hashlib.blake2b(version.encode(), digest_size=8).hexdigest() + '.pkl')
+
+
+def load_or_build(df, version, parents=(), directory=SIMILARITY_DIRECTORY):
+    """
+    Load the persisted index of a data version, building and persisting it if there is none.
+
+    Only the most recently built indexes are kept. The index is recorded in the version registry as derived from its
+    parents, so indexes of older data show as stale.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - version (str): The version of the data.
+    - parents (List[str]): The data files the index is computed from. Default is none.
+    - directory (str): The directory of the indexes. Default is SIMILARITY_DIRECTORY.
+
+    Returns:
+    - SimilarityIndex: The index.
+    """
+    path = index_path(version, directory)
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            pass
+
+    index = build_index(df)
+    os.makedirs(directory, exist_ok=True)
+    temporary = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary, 'wb') as file:
+        pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+    indexes = sorted((entry.path for entry in os.scandir(directory) if entry.name.endswith('.pkl')),
+                     key=os.path.getmtime, reverse=True)
+    for stale in indexes[MAX_INDEXES:]:
+        os.remove(stale)
+
+    if parents:
+        versioning.get_registry().record(path, parents)
+    return index
@@ -0,0 +1,440 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from utils import query_backend, versioning
+
+DEFAULT_PRECISION = 11
+DEFAULT_K = 200
+GROUP_COLUMNS = ['Institution', 'Course', 'date']
+
+
+def hash_values(values):
+    """
+    Hash values into 64-bit integers for the distinct-count sketches.
+
+    Parameters:
+    - values (array-like): The values, e.g. actor IDs.
+
+    Returns:
+    - np.ndarray: The hashes, as uint64.
+    """
+    return pd.util.hash_array(np.asarray(values))
+
+
+def _registers(codes, hashes, groups, precision):
+    # The first bits of a hash select a register, the position of the first set bit in the rest is its rank.
+    width = 64 - precision
+    buckets = (hashes >> np.uint64(width)).astype(np.int64)
+    rest = (hashes & np.uint64((1 << width) - 1)).astype(np.float64)
+    ranks = (width + 1 - np.frexp(rest)[1]).astype(np.uint8)
+
+    registers = np.zeros(groups * (1 << precision), dtype=np.uint8)
+    np.maximum.at(registers, np.asarray(codes, dtype=np.int64) * (1 << precision) + buckets, ranks)
+    return registers.reshape(groups, 1 << precision)
+
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch counting distinct values in 2^precision bytes, with a relative standard error of about
+    1.04 / sqrt(2^precision) (2.3% for the default precision of 11).
+
+    Sketches of the same precision merge by taking the maximum of every register, so the sketch of a union of
+    selections (days, courses, partitions processed by different workers) is the merge of their sketches.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('The precision must be between 4 and 16.')
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add(self, values):
+        """
+        Add values to the sketch.
+
+        Parameters:
+        - values (array-like): The values.
+
+        Returns:
+        - HyperLogLog: The sketch itself.
+        """
+        hashes = hash_values(values)
+        np.maximum(self.registers, _registers(np.zeros(len(hashes)), hashes, 1, self.precision)[0],
+                   out=self.registers)
+        return self
+
+    def merge(self, other):
+        """
+        Merge two sketches.
+
+        Parameters:
+        - other (HyperLogLog): A sketch of the same precision.
+
+        Returns:
+        - HyperLogLog: A new sketch of the union of both.
+        """
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precision.')
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def count(self):
+        """
+        Estimate the number of distinct values.
+
+        Returns:
+        - float: The estimate, using linear counting for small cardinalities.
+        """
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            return m * np.log(m / zeros)
+        return estimate
+
+
+class KLL:
+    """
+    A KLL sketch of a distribution, answering quantile queries with a rank error of about 1.7 / k (under 1% for the
+    default k of 200) in O(k) memory.
+
+    The values are kept in levels of compactors: when the sketch holds more values than its levels may, the lowest
+    full level is sorted and every other value, chosen at random, is promoted to the next level with twice the weight.
+    Sketches merge by concatenating their levels and compacting the same way, so merged sketches keep the error bound.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        return max(int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))), 2)
+
+    def _compact(self):
+        # Levels are only compacted while the sketch holds more items than all levels together may, lowest full level
+        # first, so the sketch keeps as many items as it can: every compaction of a level adds to the rank error.
+        while sum(len(values) for values in self.levels) > sum(map(self._capacity, range(len(self.levels)))):
+            level = next(level for level, values in enumerate(self.levels) if len(values) >= self._capacity(level))
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            kept = items[len(items) - len(items) % 2:]
+            promoted = items[self._rng.integers(2):len(items) - len(items) % 2:2]
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            self.levels[level] = kept
+
+    def add(self, values):
+        """
+        Add values to the sketch. Missing values are ignored.
+
+        Parameters:
+        - values (array-like): The values.
+
+        Returns:
+        - KLL: The sketch itself.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+
+        self.n += len(values)
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+        return self
+
+    def merge(self, other):
+        """
+        Merge two sketches.
+
+        Parameters:
+        - other (KLL): Another sketch.
+
+        Returns:
+        - KLL: A new sketch of both distributions combined.
+        """
+        merged = KLL(max(self.k, other.k), int(self._rng.integers(2 ** 32)))
+        merged.n = self.n + other.n
+        merged.min = np.fmin(self.min, other.min)
+        merged.max = np.fmax(self.max, other.max)
+        merged.levels = [np.concatenate([self.levels[level] if level < len(self.levels) else np.empty(0),
+                                         other.levels[level] if level < len(other.levels) else np.empty(0)])
+                         for level in range(max(len(self.levels), len(other.levels)))]
+        merged._compact()
+        return merged
+
+    def quantile(self, q):
+        """
+        Estimate quantiles of the distribution.
+
+        Parameters:
+        - q (float or array-like): The quantiles, between 0 and 1.
+
+        Returns:
+        - float or np.ndarray: The estimated values (NaN if the sketch is empty). The minimum and maximum are exact.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)[()]
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 2.0 ** level) for level, values in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+
+        positions = np.searchsorted(cumulative, q * cumulative[-1], 'left')
+        result = items[np.minimum(positions, len(items) - 1)]
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, result))
+        return result[()]
+
+
+class SketchStore:
+    """
+    Mergeable sketches of a dataset kept per course and day: the exact number of events, HyperLogLog sketches of the
+    actors (of all events and of the events counted as engagement by actor_engagement.count_assessments) and KLL
+    sketches of the scores, plus a KLL sketch per course of the number of interactions of its actors.
+
+    Any selection of courses, institutions and days is answered by merging the sketches of its groups, without going
+    back to the events. The interaction counts per actor are not additive over days, so their sketches cover the
+    whole dataset the store was built from.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, k=DEFAULT_K):
+        self.precision = precision
+        self.k = k
+        self.groups = pd.DataFrame(columns=GROUP_COLUMNS)
+        self.events = np.zeros(0, dtype=np.int64)
+        self.actors = np.zeros((0, 1 << precision), dtype=np.uint8)
+        self.engaged = np.zeros((0, 1 << precision), dtype=np.uint8)
+        self.scores = []
+        self.interactions = {}
+        self.courses = pd.DataFrame(columns=['Course', 'Institution', 'Teaching'])
+
+    @classmethod
+    def build(cls, df, precision=DEFAULT_PRECISION, k=DEFAULT_K):
+        """
+        Build the sketches of a dataset from aggregations by the query backend.
+
+        Parameters:
+        - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+        - precision (int): The precision of the HyperLogLog sketches. Default is 11.
+        - k (int): The size of the KLL sketches. Default is 200.
+
+        Returns:
+        - SketchStore: The store.
+        """
+        from utils.actor_engagement import EXCLUDED_TYPES
+
+        store = cls(precision, k)
+        backend = query_backend.get_backend(df)
+        store.courses = backend.distinct(['Course', 'Institution', 'Teaching']).dropna(subset=['Course'])
+        store.courses = store.courses.drop_duplicates('Course').reset_index(drop=True)
+
+        counts = backend.count(GROUP_COLUMNS + ['actor.id', 'object.definition.type'])
+        counts = counts.dropna(subset=GROUP_COLUMNS + ['actor.id'])
+        if counts.empty:
+            return store
+
+        codes, groups = pd.MultiIndex.from_frame(counts[GROUP_COLUMNS]).factorize()
+        store.groups = groups.to_frame(index=False, name=GROUP_COLUMNS)
+        store.events = np.bincount(codes, weights=counts['count'], minlength=len(groups)).astype(np.int64)
+
+        hashes = hash_values(counts['actor.id'])
+        engaged = ~counts['object.definition.type'].isin(EXCLUDED_TYPES).to_numpy()
+        store.actors = _registers(codes, hashes, len(groups), precision)
+        store.engaged = _registers(codes[engaged], hashes[engaged], len(groups), precision)
+
+        per_actor = counts.groupby(['Course', 'actor.id'], sort=False)['count'].sum()
+        for course, values in per_actor.groupby(level=0, sort=False):
+            store.interactions[course] = KLL(k).add(values.to_numpy())
+
+        scores = backend.frame(['Course', 'timestamp', 'result.score.scaled'], {'scored': True})
+        score_codes = pd.MultiIndex.from_frame(store.groups[['Course', 'date']]).get_indexer(
+            pd.MultiIndex.from_arrays([scores['Course'], scores['timestamp'].dt.normalize()]))
+        store.scores = [KLL(k) for _ in range(len(groups))]
+        order = np.argsort(score_codes, kind='stable')
+        starts = np.searchsorted(score_codes[order], np.arange(len(groups) + 1))
+        values = scores['result.score.scaled'].to_numpy(dtype=np.float64)[order]
+        for group in range(len(groups)):
+            store.scores[group].add(values[starts[group]:starts[group + 1]])
+        return store
+
+    def select(self, column=None, name=None, start=None, stop=None):
+        """
+        Select the groups of a course or institution in a date range.
+
+        Parameters:
+        - column (str, optional): 'Course' or 'Institution'. Default is every group.
+        - name (str, optional): The name of the course or institution.
+        - start (pd.Timestamp, optional): The start of the range (inclusive).
+        - stop (pd.Timestamp, optional): The end of the range (exclusive).
+
+        Returns:
+        - np.ndarray: The positions of the selected groups.
+        """
+        mask = np.ones(len(self.groups), dtype=bool)
+        if column is not None:
+            mask &= (self.groups[column] == name).to_numpy()
+        if start is not None:
+            mask &= (self.groups['date'] >= pd.Timestamp(start).normalize()).to_numpy()
+        if stop is not None:
+            mask &= (self.groups['date'] < pd.Timestamp(stop)).to_numpy()
+        return np.flatnonzero(mask)
+
+    def count_events(self, *selection):
+        """
+        Count the events of a selection (see select). The count is exact.
+
+        Returns:
+        - int: The number of events.
+        """
+        return int(self.events[self.select(*selection)].sum())
+
+    def distinct_actors(self, *selection, engaged=False):
+        """
+        Estimate the number of distinct actors of a selection (see select).
+
+        Parameters:
+        - engaged (bool): Whether to count only the actors with events counted as engagement. Default is False.
+
+        Returns:
+        - float: The estimate.
+        """
+        registers = (self.engaged if engaged else self.actors)[self.select(*selection)]
+        if len(registers) == 0:
+            return 0.0
+        return HyperLogLog(self.precision, registers.max(axis=0)).count()
+
+    def score_sketch(self, *selection):
+        """
+        Get the sketch of the scores of a selection (see select).
+
+        Returns:
+        - KLL: The merged sketch.
+        """
+        merged = KLL(self.k)
+        for group in self.select(*selection):
+            merged = merged.merge(self.scores[group])
+        return merged
+
+    def interaction_sketch(self, column, name):
+        """
+        Get the sketch of the number of interactions per actor in a course, or per actor and course in an
+        institution.
+
+        Parameters:
+        - column (str): 'Course' or 'Institution'.
+        - name (str): The name of the course or institution.
+
+        Returns:
+        - KLL: The sketch.
+        """
+        courses = [name] if column == 'Course' else \
+            self.courses.loc[self.courses['Institution'] == name, 'Course'].tolist()
+        merged = KLL(self.k)
+        for course in courses:
+            if course in self.interactions:
+                merged = merged.merge(self.interactions[course])
+        return merged
+
+    def merge(self, other):
+        """
+        Merge the store of another partition of the data, e.g. built by another worker process.
+
+        Event counts, distinct actors and scores are exact to merge for any partitioning. The interaction counts per
+        actor are merged as distributions, which is exact only when no actor of a course spans both partitions.
+
+        Parameters:
+        - other (SketchStore): A store with the same precision.
+
+        Returns:
+        - SketchStore: A new store of both partitions.
+        """
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precision.')
+
+        merged = SketchStore(self.precision, max(self.k, other.k))
+        keys = pd.MultiIndex.from_frame(pd.concat([self.groups, other.groups], ignore_index=True))
+        codes, groups = keys.factorize()
+        merged.groups = groups.to_frame(index=False, name=GROUP_COLUMNS)
+        merged.events = np.bincount(codes, weights=np.concatenate([self.events, other.events]),
+                                    minlength=len(groups)).astype(np.int64)
+
+        for name in ['actors', 'engaged']:
+            registers = np.zeros((len(groups), 1 << self.precision), dtype=np.uint8)
+            np.maximum.at(registers, codes, np.concatenate([getattr(self, name), getattr(other, name)]))
+            setattr(merged, name, registers)
+
+        merged.scores = [KLL(merged.k) for _ in range(len(groups))]
+        for code, sketch in zip(codes, self.scores + other.scores):
+            merged.scores[code] = merged.scores[code].merge(sketch)
+
+        merged.interactions = dict(self.interactions)
+        for course, sketch in other.interactions.items():
+            merged.interactions[course] = merged.interactions[course].merge(sketch) \
+                if course in merged.interactions else sketch
+        merged.courses = pd.concat([self.courses, other.courses]).drop_duplicates('Course').reset_index(drop=True)
+        return merged
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(df):
+    """
+    Get the sketches of the dataset a DataFrame was restricted from, building them on first use.
+
+    The sketches are built once per version of the data (without the anomalies if df leaves them out), so a date
+    range is answered by selecting its days in the store (see SketchStore.select and date_range) rather than by
+    building new sketches. They are kept for as long as the full dataset.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - SketchStore: The sketches.
+    """
+    source = query_backend.source(df)
+    exclude = query_backend.excludes_anomalies(df)
+    if isinstance(source, pd.DataFrame):
+        key = (id(source), exclude)
+    else:
+        key = (source.path, versioning.version(source.path), exclude)
+
+    with _stores_lock:
+        store = _stores.get(key)
+    if store is not None:
+        return store
+
+    store = SketchStore.build(query_backend.restrict(source, exclude_anomalies=exclude))
+    with _stores_lock:
+        if key not in _stores:
+            if isinstance(source, pd.DataFrame):
+                weakref.finalize(source, _stores.pop, key, None)
+            else:
+                for stale in [other for other in _stores if other[0] == source.path and other[1] != key[1]]:
+                    del _stores[stale]
+            _stores[key] = store
+        return _stores[key]
+
+
+def date_range(df):
+    """
+    Get the date range of a dataset as a selection of the store (see SketchStore.select).
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The dataset.
+
+    Returns:
+    - Tuple[pd.Timestamp, pd.Timestamp]: The start and end of the range, or (None, None) for the full history.
+    """
+    return query_backend.time_range(df) or (None, None)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+COURSES = {
+    'Human Factors of Interactive Technology': ('UEF', 'Project-based'),
+    'Advanced Data Management Systems': ('UEF', 'Flipped classroom'),
+    'Human-computer interaction': ('SU', 'Project-based'),
+    'e-Learning': ('SU', 'Flipped classroom'),
+    'Computer Architecture': ('UL', 'Flipped classroom'),
+    'Web Applications': ('UL', 'Project-based'),
+    'Computer Organization': ('BMU', 'Project-based'),
+    'Computer Networks': ('BMU', 'Flipped classroom')
+}
+
+OBJECT_TYPES = {
+    'course': 0.30, 'module': 0.14, 'resource': 0.14, 'quiz': 0.09, 'assessment': 0.06, 'cmi.interaction': 0.10,
+    'discussion': 0.04, 'forum-topic': 0.03, 'link': 0.03, 'page': 0.02, 'attempt': 0.02, 'lesson': 0.01,
+    'review': 0.01, 'meeting': 0.005, 'survey': 0.005
+}
+
+VERBS_BY_TYPE = {
+    'assessment': ['scored', 'submit', 'completed', 'start'],
+    'quiz': ['completed', 'viewed', 'start', 'receive'],
+    'cmi.interaction': ['answered'],
+    'discussion': ['viewed', 'create'],
+    'meeting': ['join', 'leave']
+}
+
+
+def generate_events(n_events=100000, n_actors=800, start='2023-02-01', days=150, seed=0):
+    """
+    Generate a synthetic event log with the schema of data/processed.csv.
+
+    Actor activity is heavy-tailed and concentrated on weekdays, so the data exercises the same code paths as the
+    real dataset. Used for offline load and memory testing.
+
+    Parameters:
+    - n_events (int): The number of events. Default is 100000.
+    - n_actors (int): The number of actors. Default is 800.
+    - start (str): The date of the first day. Default is '2023-02-01'.
+    - days (int): The number of days covered. Default is 150.
+    - seed (int): The random seed. Default is 0.
+
+    Returns:
+    - pd.DataFrame: The synthetic events, sorted by actor and descending timestamp.
+    """
+    rng = np.random.default_rng(seed)
+    courses = list(COURSES)
+
+    actor_course = rng.integers(0, len(courses), n_actors)
+    actors = (rng.zipf(1.3, n_events) - 1) % n_actors
+    course = np.array(courses)[actor_course[actors]]
+    actors = np.unique(actors, return_inverse=True)[1]
+
+    object_types = rng.choice(list(OBJECT_TYPES), n_events, p=np.array(list(OBJECT_TYPES.values())) / sum(
+        OBJECT_TYPES.values()))
+    verbs = np.full(n_events, 'viewed', dtype=object)
+    for object_type, type_verbs in VERBS_BY_TYPE.items():
+        mask = object_types == object_type
+        verbs[mask] = rng.choice(type_verbs, mask.sum())
+
+    day = rng.integers(0, days, n_events)
+    day_of_week = (pd.Timestamp(start).dayofweek + day) % 7
+    to_friday = (day_of_week >= 5) & (rng.random(n_events) < 0.7)
+    day = np.where(to_friday, day - (day_of_week - 4), day).clip(0)
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(day * 86400 + rng.integers(8 * 3600, 86400, n_events), unit='s')
+
+    scored = np.isin(verbs, ['scored', 'completed', 'answered'])
+    scores = np.where(scored, rng.beta(5, 2, n_events).round(2), np.nan)
+
+    df = pd.DataFrame({
+        'Institution': [COURSES[name][0] for name in course],
+        'Course': course,
+        'actor.id': actors,
+        'timestamp': timestamps,
+        'verb.id': verbs,
+        'object.definition.type': object_types,
+        'result.score.scaled': scores,
+        'result.success': scored & (rng.random(n_events) < 0.7),
+        'result.completion': scored | (rng.random(n_events) < 0.05),
+        'Teaching': [COURSES[name][1] for name in course]
+    })
+
+    return df.sort_values(['actor.id', 'timestamp'], ascending=[True, False], ignore_index=True)
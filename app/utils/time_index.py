@@ -0,0 +1,153 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+TERM_START_MONTHS = {'Spring': 2, 'Autumn': 9}
+
+
+class TimeIndex:
+    """
+    An index of the rows of a dataset sorted by timestamp, optionally within each course, institution or actor.
+
+    Selecting the rows of a date range, overall or of a single group, takes two binary searches on the sorted layout
+    instead of a boolean mask over every row, so the cost depends on the number of selected rows rather than on the
+    size of the dataset.
+    """
+
+    def __init__(self, df):
+        self._times = df['timestamp'].to_numpy().astype('datetime64[ns]').view('i8')
+        self.order = np.argsort(self._times, kind='stable')
+        self.sorted_times = self._times[self.order]
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.order)
+
+    def first(self):
+        """
+        Get the timestamp of the first event.
+
+        Returns:
+        - pd.Timestamp or None: The timestamp, or None if there are no events.
+        """
+        return pd.Timestamp(self.sorted_times[0]) if len(self) else None
+
+    def last(self):
+        """
+        Get the timestamp of the last event.
+
+        Returns:
+        - pd.Timestamp or None: The timestamp, or None if there are no events.
+        """
+        return pd.Timestamp(self.sorted_times[-1]) if len(self) else None
+
+    def _segment(self, df, column):
+        with self._lock:
+            segment = self._segments.get(column)
+        if segment is not None:
+            return segment
+
+        # A stable sort of the time-sorted rows by group keeps every group sorted by time.
+        codes, names = pd.factorize(df[column], sort=True)
+        by_group = np.argsort(codes[self.order], kind='stable')
+        order = self.order[by_group]
+        starts = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        segment = (np.asarray(names), starts, order, self._times[order])
+
+        with self._lock:
+            return self._segments.setdefault(column, segment)
+
+    def positions(self, df, start=None, stop=None, column=None, value=None):
+        """
+        Get the positions of the rows in a date range, optionally of a single course, institution or actor.
+
+        Parameters:
+        - df (pd.DataFrame): The DataFrame the index was built from.
+        - start (pd.Timestamp, optional): The start of the range (inclusive). Default is the first event.
+        - stop (pd.Timestamp, optional): The end of the range (exclusive). Default is after the last event.
+        - column (str, optional): The column of the group, e.g. 'Course' or 'actor.id'.
+        - value (optional): The value of the group.
+
+        Returns:
+        - np.ndarray: The row positions in their original order.
+        """
+        if column is None:
+            order, times = self.order, self.sorted_times
+        else:
+            names, starts, order, times = self._segment(df, column)
+            index = np.searchsorted(names, value)
+            if index == len(names) or names[index] != value:
+                return self.order[:0]
+            order, times = order[starts[index]:starts[index + 1]], times[starts[index]:starts[index + 1]]
+
+        low = 0 if start is None else np.searchsorted(times, pd.Timestamp(start).value, 'left')
+        high = len(times) if stop is None else np.searchsorted(times, pd.Timestamp(stop).value, 'left')
+        return np.sort(order[low:high])
+
+    def count(self, start=None, stop=None):
+        """
+        Get the number of events in a date range.
+
+        Parameters:
+        - start (pd.Timestamp, optional): The start of the range (inclusive).
+        - stop (pd.Timestamp, optional): The end of the range (exclusive).
+
+        Returns:
+        - int: The number of events.
+        """
+        low = 0 if start is None else np.searchsorted(self.sorted_times, pd.Timestamp(start).value, 'left')
+        high = len(self) if stop is None else np.searchsorted(self.sorted_times, pd.Timestamp(stop).value, 'left')
+        return int(max(high - low, 0))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(df):
+    """
+    Get the time index of a DataFrame, building it on first use.
+
+    The index is kept for as long as the DataFrame itself.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+
+    Returns:
+    - TimeIndex: The index.
+    """
+    key = id(df)
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    index = TimeIndex(df)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = index
+            weakref.finalize(df, _indexes.pop, key, None)
+        return _indexes[key]
+
+
+def terms(first, last):
+    """
+    List the academic terms overlapping a period. Spring terms start in February and autumn terms in September.
+
+    Parameters:
+    - first (pd.Timestamp): The start of the period.
+    - last (pd.Timestamp): The end of the period.
+
+    Returns:
+    - List[Tuple[str, pd.Timestamp, pd.Timestamp]]: The name, start (inclusive) and end (exclusive) of every term, most
+      recent first.
+    """
+    starts = sorted(pd.Timestamp(year, month, 1) for year in range(first.year - 1, last.year + 2)
+                    for month in TERM_START_MONTHS.values())
+    names = {month: name for name, month in TERM_START_MONTHS.items()}
+
+    return [(names[start.month] + ' ' + str(start.year), start, stop)
+            for start, stop in zip(starts[:-1], starts[1:]) if start <= last and stop > first][::-1]
@@ -1,7 +1,12 @@
-import matplotlib.pyplot as plt
 import pandas as pd
+from matplotlib.figure import Figure
 from statsmodels.graphics.tsaplots import plot_acf
 
+from utils import query_backend
+
+NON_ASSESSMENT_ACTIVITIES = ['resource', 'discussion', 'link', 'page', 'module', 'quiz', 'homework', 'test',
+                             'forum-topic', 'review', 'course']
+
 
 def get_actions(df, min_time=None, max_time=None):
     """
@@ -25,8 +30,6 @@ def get_actions(df, min_time=None, max_time=None):
     activities_by_days['non_assessments'] = []
     activities_by_days['total'] = []
 
-    non_assessment_activities = ['resource', 'discussion', 'link', 'page', 'module', 'quiz', 'homework', 'test',
-                                 'forum-topic', 'review', 'course']
     time = min_time
     while time <= max_time:
         next_time = time + pd.Timedelta(days=1)
@@ -36,7 +39,7 @@ def get_actions(df, min_time=None, max_time=None):
         activities_by_days['assessments'].append(daily_df[(~daily_df['result.score.scaled'].isna()) & (
                 daily_df['object.definition.type'] != 'cmi.interaction')].shape[0])
         activities_by_days['non_assessments'].append(daily_df[(daily_df['object.definition.type'].isin(
-            non_assessment_activities)) & (daily_df['result.score.scaled'].isna())].shape[0])
+            NON_ASSESSMENT_ACTIVITIES)) & (daily_df['result.score.scaled'].isna())].shape[0])
         activities_by_days['total'].append(daily_df.shape[0])
 
         time = next_time
@@ -79,47 +82,90 @@ def display_actions(df, actor_id, metric):
     - metric (str): The type of activity count to display ('assessments', 'non_assessments', 'total').
 
     Returns:
-    - plt.Figure: The generated plot.
+    - Figure: The generated plot.
     """
     actor_actions, institution_colour = actor_timeline(df, actor_id)
-    fig, ax = plt.subplots()
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
 
-    ax.figure(figsize=(10, 5))
     ax.plot(actor_actions.index, actor_actions[metric], c=institution_colour)
-    ax.xticks(rotation=45, ha='right')
+    fig.autofmt_xdate(rotation=45, ha='right')
 
-    ax.xlabel('Date')
-    ax.ylabel('Count')
-    ax.title('Activity')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Count')
+    ax.set_title('Activity')
 
-    ax.tight_layout()
+    fig.tight_layout()
     return fig
 
 
+def classify_actions(counts):
+    """
+    Tell the graded assessments and the non-graded activities apart in aggregated counts, as get_actions does.
+
+    Parameters:
+    - counts (pd.DataFrame): Aggregated counts with the 'object.definition.type' and 'scored' columns.
+
+    Returns:
+    - Tuple[pd.Series, pd.Series]: Whether each row counts assessments and whether it counts non-assessments.
+    """
+    scored = counts['scored'].astype(bool)
+    assessments = scored & (counts['object.definition.type'] != 'cmi.interaction')
+    non_assessments = ~scored & counts['object.definition.type'].isin(NON_ASSESSMENT_ACTIVITIES)
+    return assessments, non_assessments
+
+
+def count_daily_actions(df, where=None):
+    """
+    Calculate the activity counts of every calendar day from an aggregation by the query backend.
+
+    This gives the same counts as get_actions, with days starting at midnight, without loading the events.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - where (dict, optional): The filter of the events (see QueryBackend).
+
+    Returns:
+    - pd.DataFrame: Daily activity counts including assessments, non-assessments, and total activities, from the first
+      to the last day with activity.
+    """
+    counts = query_backend.get_backend(df).count(['date', 'object.definition.type', 'scored'], where)
+    assessments, non_assessments = classify_actions(counts)
+    daily = pd.DataFrame({
+        'assessments': counts['count'].where(assessments, 0),
+        'non_assessments': counts['count'].where(non_assessments, 0),
+        'total': counts['count']
+    }).groupby(counts['date']).sum()
+
+    if daily.empty:
+        return daily.rename_axis('timestamp')
+    days = pd.date_range(daily.index.min(), daily.index.max(), name='timestamp')
+    return daily.reindex(days, fill_value=0)
+
+
 def course_or_institution_timeline(df, name):
     """
     Generate a timeline of daily activity counts for a specific course or institution.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
     - name (str): The name of the course or institution for which the timeline is generated.
 
     Returns:
     - Tuple[pd.DataFrame, str]: Daily activity counts DataFrame and the color associated with the institution.
     """
     object_type = 'Course'
-    if name in set(df['Institution']):
+    if name in query_backend.values(df, 'Institution'):
         object_type = 'Institution'
 
-    object_df = df[df[object_type] == name]
-    object_df = object_df.set_index('timestamp').sort_index()
-
     colours = {'UEF': 'red', 'SU': 'blue', 'UL': 'green', 'BMU': 'yellow'}
-    min_time = pd.Timestamp(min(df['timestamp']).year, min(df['timestamp']).month, min(df['timestamp']).day)
-    max_time = pd.Timestamp(max(df['timestamp']).year, max(df['timestamp']).month, max(df['timestamp']).day)
 
-    object_actions = get_actions(object_df)
-    institution_colour = colours[object_df['Institution'].iloc[0]]
+    object_actions = count_daily_actions(df, {object_type: name})
+    if object_type == 'Institution':
+        institution_colour = colours[name]
+    else:
+        institution_colour = colours[query_backend.get_backend(df).distinct(['Institution'], {'Course': name})
+                                     ['Institution'].iloc[0]]
     return object_actions, institution_colour
 
 
@@ -128,28 +174,29 @@ def display_course_or_institution_actions(df, name, metric):
     Display a plot of daily activity counts for a specific course or institution.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
     - name (str): The name of the course or institution for which the plot is generated.
     - metric (str): The type of activity count to display ('assessments', 'non_assessments', 'total', 'both').
 
     Returns:
-    - plt.Figure: The generated plot.
+    - Figure: The generated plot.
     """
     object_actions, institution_colour = course_or_institution_timeline(df, name)
 
-    fig, ax = plt.subplots()
+    fig = Figure()
+    ax = fig.subplots()
     if metric == 'both':
         ax.plot(object_actions.index, object_actions['non_assessments'], c=institution_colour)
         ax.plot(object_actions.index, object_actions['assessments'], c='purple')
     else:
         ax.plot(object_actions.index, object_actions[metric], c=institution_colour)
 
-    plt.xticks(rotation=45, ha='right')
-    plt.xlabel('Date')
-    plt.ylabel('Count')
-    plt.title('Activity')
+    fig.autofmt_xdate(rotation=45, ha='right')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Count')
+    ax.set_title('Activity')
 
-    plt.tight_layout()
+    fig.tight_layout()
     return fig
 
 
@@ -158,26 +205,28 @@ def analyze_time_series(df, name, metric):
     Analyze time series data for a specific course or institution.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
     - name (str): The name of the course or institution for which the analysis is performed.
     - metric (str): The type of activity count to analyze.
 
     Returns:
-    - plt.Figure: The generated autocorrelation and partial autocorrelation plots.
+    - Figure: The generated autocorrelation and partial autocorrelation plots.
     """
     object_actions, institution_colour = course_or_institution_timeline(df, name)
 
-    lag_acf = 30
+    lag_acf = min(30, len(object_actions) - 1)
     if metric == 'both':
-        f, ax = plt.subplots(nrows=2, ncols=1)
+        f = Figure()
+        ax = f.subplots(nrows=2, ncols=1)
         plot_acf(object_actions['assessments'], lags=lag_acf, ax=ax[0])
         ax[0].set_title('Graded Assingments Autocorrelation')
 
         plot_acf(object_actions['non_assessments'], lags=lag_acf, ax=ax[1])
         ax[1].set_title('Non-graded Activities Autocorrelation')
     else:
-        f, ax = plt.subplots()
+        f = Figure()
+        ax = f.subplots()
         plot_acf(object_actions[metric], lags=lag_acf, ax=ax)
 
-    plt.tight_layout()
+    f.tight_layout()
     return f
@@ -1,18 +1,161 @@
-import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
+from matplotlib.figure import Figure
+from scipy.stats import chi2
 
+from utils import query_backend
 
-def get_verb_lollipop(df):
+
+def verb_course_contingency(df):
+    """
+    Build the verb x course contingency table of interaction counts in a single aggregation.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+
+    Returns:
+    - pd.DataFrame: Interaction counts with verbs as rows and courses as columns, both sorted by name.
+    """
+    counts = query_backend.get_backend(df).count(['verb.id', 'Course']).dropna()
+    return (counts
+            .pivot_table(index='verb.id', columns='Course', values='count', aggfunc='sum', fill_value=0)
+            .astype(np.int64)
+            .sort_index()
+            .sort_index(axis=1))
+
+
+def expected_frequencies(table, hypothesis='independence'):
+    """
+    Calculate the expected frequencies of a contingency table under the null hypothesis.
+
+    Parameters:
+    - table (pd.DataFrame): The verb x course contingency table.
+    - hypothesis (str): 'independence' (verbs and courses are independent) or 'uniform' (each verb is uniformly
+      distributed across courses). Default is 'independence'.
+
+    Returns:
+    - np.ndarray: The expected frequencies, with the same shape as the table.
+    """
+    observed = table.to_numpy(dtype=float)
+    row_totals = observed.sum(axis=1, keepdims=True)
+
+    if hypothesis == 'uniform':
+        return np.repeat(row_totals / observed.shape[1], observed.shape[1], axis=1)
+    return row_totals * observed.sum(axis=0, keepdims=True) / observed.sum()
+
+
+def chi_square_test(table, hypothesis='independence'):
+    """
+    Perform a chi-square test on a contingency table, overall and per course.
+
+    The degrees of freedom are derived from the shape of the table, ignoring verbs and courses without interactions.
+
+    Parameters:
+    - table (pd.DataFrame): The verb x course contingency table.
+    - hypothesis (str): See expected_frequencies. Default is 'independence'.
+
+    Returns:
+    - Tuple[Tuple[float, int, float], pd.DataFrame, pd.DataFrame]: The overall chi-square statistic, degrees of freedom
+      and p-value, the per-course tests and the standardized (adjusted) residuals.
+    """
+    table = table.loc[table.sum(axis=1) > 0, table.sum(axis=0) > 0]
+    observed = table.to_numpy(dtype=float)
+    expected = expected_frequencies(table, hypothesis)
+    n_rows, n_cols = observed.shape
+
+    contributions = (observed - expected) ** 2 / expected
+    statistic = contributions.sum()
+    dof = (n_rows - 1) * (n_cols - 1) if hypothesis == 'independence' else n_rows * (n_cols - 1)
+
+    course_statistics = contributions.sum(axis=0)
+    course_dof = n_rows - 1
+    per_course = pd.DataFrame({
+        'Course': table.columns,
+        'Chi-squared': course_statistics,
+        'Degrees of freedom': course_dof,
+        'p-value': chi2.sf(course_statistics, course_dof)
+    })
+
+    # Under independence the variance of a cell depends on its row and column shares; under uniformity each row is
+    # multinomial with probability 1 / n_cols per course.
+    if hypothesis == 'uniform':
+        variance = expected * (1 - 1 / n_cols)
+    else:
+        total = observed.sum()
+        row_shares = observed.sum(axis=1, keepdims=True) / total
+        col_shares = observed.sum(axis=0, keepdims=True) / total
+        variance = expected * (1 - row_shares) * (1 - col_shares)
+    residuals = pd.DataFrame(
+        (observed - expected) / np.sqrt(variance),
+        index=table.index,
+        columns=table.columns
+    )
+
+    return (statistic, dof, chi2.sf(statistic, dof)), per_course, residuals
+
+
+def get_verb_figures(df):
+    """
+    Generate the lollipop and both radar plots from a single contingency table.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+
+    Returns:
+    - Tuple[Figure, go.Figure, go.Figure]: The lollipop plot, the verb radar per course and the course radar per verb.
+    """
+    table = verb_course_contingency(df)
+    return get_verb_lollipop(df, table), get_verb_radar_course(df, table), get_verb_radar_verb(df, table)
+
+
+def get_residual_heatmap(residuals):
+    """
+    Generate a heatmap of the standardized residuals of a chi-square test.
+
+    Parameters:
+    - residuals (pd.DataFrame): The standardized residuals as returned by chi_square_test.
+
+    Returns:
+    - go.Figure: The generated heatmap. Cells beyond ±2 deviate significantly from the null hypothesis.
+    """
+    limit = max(2.0, float(np.nanmax(np.abs(residuals.to_numpy()))))
+
+    fig = go.Figure(data=go.Heatmap(
+        z=residuals.to_numpy(),
+        x=residuals.columns.tolist(),
+        y=residuals.index.tolist(),
+        zmin=-limit,
+        zmax=limit,
+        colorscale='RdBu_r',
+        colorbar=dict(title='Residual')
+    ))
+
+    fig.update_layout(
+        title='Standardized residuals (verb x course)',
+        xaxis=dict(tickangle=45),
+        height=600
+    )
+
+    return fig
+
+
+def get_verb_lollipop(df, table=None):
     """
     Generate a lollipop plot to visualize interaction counts for each verb.
 
     Parameters:
     - df (pd.DataFrame): The DataFrame containing interaction data.
+    - table (pd.DataFrame, optional): A precomputed verb x course contingency table.
 
     Returns:
-    - plt.Figure: The generated lollipop plot.
+    - Figure: The generated lollipop plot.
     """
-    fig, ax = plt.subplots(figsize=(16, 10), dpi=80)
+    table = verb_course_contingency(df) if table is None else table
+    verb_counts = table.sum(axis=1).sort_values(ascending=False)
+
+    fig = Figure(figsize=(16, 10), dpi=80)
+    ax = fig.subplots()
     ax.set_title(
         'Interactions',
         fontdict={'size': 22}
@@ -23,26 +166,26 @@ def get_verb_lollipop(df):
             'size': 15
         }
     )
-    ax.set_yticks(range(len(df[['verb.id']].value_counts())))
+    ax.set_yticks(range(len(verb_counts)))
     ax.set_yticklabels(
-        df['verb.id'].drop_duplicates().tolist(),
+        verb_counts.index.tolist(),
         fontdict={
             'horizontalalignment': 'right',
             'size': 15
         }
     )
     ax.hlines(
-        y=range(len(df[['verb.id']].value_counts())),
+        y=range(len(verb_counts)),
         xmin=0,
-        xmax=df[['verb.id']].value_counts().to_frame()[['count']].max(),
+        xmax=verb_counts.max(),
         color='darkgray',
         alpha=0.7,
         linewidth=1,
         linestyles='dashdot'
     )
     ax.scatter(
-        y=range(len(df[['verb.id']].value_counts())),
-        x=df[['verb.id']].value_counts().to_frame()[['count']],
+        y=range(len(verb_counts)),
+        x=verb_counts.values,
         s=75,
         color='firebrick',
         alpha=0.7
@@ -50,21 +193,25 @@ def get_verb_lollipop(df):
     return fig
 
 
-def get_verb_radar_verb(df):
-    df_radar = (df
-                .groupby(['Course', 'verb.id'])['verb.id']
-                .count()
-                .unstack(fill_value=0)
-                .stack()
-                .reset_index()
-                .rename(columns={0: 'count'}))
+def get_verb_radar_verb(df, table=None):
+    """
+    Generate a radar plot to visualize the distribution of course interactions across different verbs.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing interaction data.
+    - table (pd.DataFrame, optional): A precomputed verb x course contingency table.
+
+    Returns:
+    - go.Figure: The generated radar plot.
+    """
+    table = verb_course_contingency(df) if table is None else table
 
     fig = go.Figure()
 
-    for course in df_radar['Course'].drop_duplicates().tolist():
+    for course in table.columns:
         fig.add_trace(go.Scatterpolar(
-            r=df_radar[df_radar['Course'] == course]['count'].tolist(),
-            theta=df_radar['verb.id'].drop_duplicates().tolist(),
+            r=table[course].tolist(),
+            theta=table.index.tolist(),
             fill='toself',
             name=course
         ))
@@ -80,30 +227,25 @@ def get_verb_radar_verb(df):
     return fig
 
 
-def get_verb_radar_course(df):
+def get_verb_radar_course(df, table=None):
     """
     Generate a radar plot to visualize the distribution of verb interactions across different courses.
 
     Parameters:
     - df (pd.DataFrame): The DataFrame containing interaction data.
+    - table (pd.DataFrame, optional): A precomputed verb x course contingency table.
 
     Returns:
     - go.Figure: The generated radar plot.
     """
-    df_radar = (df
-                .groupby(['verb.id', 'Course'])['Course']
-                .count()
-                .unstack(fill_value=0)
-                .stack()
-                .reset_index()
-                .rename(columns={0: 'count'}))
+    table = verb_course_contingency(df) if table is None else table
 
     fig = go.Figure()
 
-    for verb in df_radar['verb.id'].drop_duplicates().tolist():
+    for verb in table.index:
         fig.add_trace(go.Scatterpolar(
-            r=df_radar[df_radar['verb.id'] == verb]['count'].tolist(),
-            theta=df_radar['Course'].drop_duplicates().tolist(),
+            r=table.loc[verb].tolist(),
+            theta=table.columns.tolist(),
             fill='toself',
             name=verb
         ))
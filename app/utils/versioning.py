@@ -0,0 +1,351 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from utils import clustering
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of a process are synchronized
+    fcntl = None
+
+REGISTRY_PATH = os.environ.get('ILEDA_REGISTRY_PATH', 'data/registry.json')
+HISTORY = 10
+CHUNK_SIZE = 1 << 20
+SCHEMA_ROWS = 1000
+
+# The files read by figure builders besides the loaded data, as a function of the arguments of the call
+FILE_INPUTS = {
+    'utils.clustering.cluster': lambda course_name, *args, **kwargs: [clustering.clustering_path(course_name)]
+}
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on a lock file, shared with the other processes using the same file.
+
+    Parameters:
+    - path (str): The path of the lock file, created if needed.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def content_hash(path):
+    """
+    Hash the content of a file, or of every file of a directory.
+
+    Parameters:
+    - path (str): The path of the file or directory.
+
+    Returns:
+    - str: The hash, which only changes when the bytes do.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if os.path.isdir(path):
+        for name in sorted(entry.name for entry in os.scandir(path) if entry.is_file()):
+            digest.update(name.encode() + b'\0' + content_hash(os.path.join(path, name)).encode())
+        return digest.hexdigest()
+
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schema(path):
+    """
+    Describe the columns of a CSV file or of a Parquet file or directory.
+
+    The types of CSV columns are inferred from the first rows. A directory has the schema of its first Parquet file.
+    Other files, e.g. pickled indexes, and other directories have no schema.
+
+    Parameters:
+    - path (str): The path of the file or directory.
+
+    Returns:
+    - List[List[str]]: The name and type of every column.
+    """
+    if os.path.isdir(path):
+        files = sorted(entry.path for entry in os.scandir(path) if entry.name.endswith('.parquet'))
+        return schema(files[0]) if files else []
+    if path.endswith('.parquet'):
+        return [[field.name, str(field.type)] for field in pq.read_schema(path)]
+    if not path.endswith('.csv'):
+        return []
+    return [[name, str(dtype)] for name, dtype in pd.read_csv(path, nrows=SCHEMA_ROWS).dtypes.items()]
+
+
+def stat(path):
+    """
+    Get the size and modification time of a file, or of every file of a directory.
+
+    Parameters:
+    - path (str): The path of the file or directory.
+
+    Returns:
+    - List[int]: The number of files, their total size and their latest modification time.
+    """
+    if not os.path.isdir(path):
+        result = os.stat(path)
+        return [1, result.st_size, result.st_mtime_ns]
+
+    stats = [entry.stat() for entry in os.scandir(path) if entry.is_file()]
+    return [len(stats), sum(result.st_size for result in stats), max([result.st_mtime_ns for result in stats],
+                                                                       default=0)]
+
+
+class Registry:
+    """
+    A thread-safe registry of the versions of the datasets and derived tables, and of the versions of the inputs
+    each derived table was computed from.
+
+    A version is a hash of the content and the schema of a file, so touching or rewriting a file without changing it
+    keeps its version. Files are only hashed again when their size or modification time changes.
+
+    The registry file is shared by the dashboard, the compute backend and the command-line tools: the entries are read
+    again whenever the file changes, and every change is applied to the entries on disk under a file lock.
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.loaded = None
+        with self.lock:
+            self.reload()
+
+    def file_stat(self):
+        """
+        Identify the current content of the registry file.
+
+        Returns:
+        - Tuple[int, int, int] or None: Its inode, size and modification time, or None if there is no file.
+        """
+        try:
+            result = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return result.st_ino, result.st_size, result.st_mtime_ns
+
+    def reload(self):
+        """
+        Read the entries again if the file changed since they were read. The lock must be held.
+        """
+        current = self.file_stat()
+        if current is None or current == self.loaded:
+            return
+        try:
+            with open(self.path) as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        self.loaded = current
+
+    def save(self):
+        """
+        Write the registry, replacing the previous file at once. The lock and the file lock must be held (see
+        transaction).
+        """
+        temporary = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+        self.loaded = self.file_stat()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Change the registry: the entries are read again under the file lock, so the changes of other processes are
+        kept, and written when the block exits without an error.
+
+        Yields:
+        - dict: The entries, to be modified in place.
+        """
+        with self.lock, file_lock(self.path + '.lock'):
+            self.reload()
+            yield self.entries
+            self.save()
+
+    def fingerprint(self, path):
+        """
+        Get the entry of a file or directory, hashing it again if it was modified since it was last seen.
+
+        Parameters:
+        - path (str): The path of the file or directory.
+
+        Returns:
+        - dict: The entry, with its version, content hash, schema, the versions it had before and its parents.
+        """
+        key = os.path.normpath(path)
+        current = stat(path)
+        with self.lock:
+            self.reload()
+            entry = self.entries.get(key)
+            if entry is not None and entry['stat'] == current:
+                return entry
+
+        content, columns = content_hash(path), schema(path)
+        version = hashlib.blake2b((content + json.dumps(columns)).encode(), digest_size=6).hexdigest()
+
+        with self.transaction() as entries:
+            entry = dict(entries.get(key, {'history': [], 'parents': {}}))
+            if entry.get('version') != version:
+                entry['history'] = ([entry['version']] + entry['history'])[:HISTORY] if 'version' in entry else []
+                entry['modified'] = time.time()
+            entry.update(stat=current, content=content, schema=columns, version=version)
+            entries[key] = entry
+        return entry
+
+    def version(self, path):
+        """
+        Get the current version of a file or directory.
+
+        Parameters:
+        - path (str): The path of the file or directory.
+
+        Returns:
+        - str: The version.
+        """
+        return self.fingerprint(path)['version']
+
+    def record(self, path, parents):
+        """
+        Record that a derived table was computed from the current versions of its inputs.
+
+        Parameters:
+        - path (str): The path of the derived table.
+        - parents (List[str]): The paths of the datasets or tables it was computed from.
+
+        Returns:
+        - dict: The entry of the derived table.
+        """
+        versions = {os.path.normpath(parent): self.version(parent) for parent in parents}
+        fingerprint = self.fingerprint(path)
+        with self.transaction() as entries:
+            entry = dict(entries.get(os.path.normpath(path), fingerprint), parents=versions)
+            entries[os.path.normpath(path)] = entry
+        return entry
+
+    def stale_parents(self, path):
+        """
+        List the inputs of a derived table that changed since it was computed.
+
+        Parameters:
+        - path (str): The path of the derived table.
+
+        Returns:
+        - List[str]: The paths of the changed inputs, or of the inputs that no longer exist.
+        """
+        with self.lock:
+            self.reload()
+            parents = dict(self.entries.get(os.path.normpath(path), {}).get('parents', {}))
+        return [parent for parent, version in sorted(parents.items())
+                if not os.path.exists(parent) or self.version(parent) != version]
+
+    def is_stale(self, path):
+        """
+        Check whether a derived table was computed from older versions of its inputs.
+
+        Parameters:
+        - path (str): The path of the derived table.
+
+        Returns:
+        - bool: True if it must be computed again.
+        """
+        return bool(self.stale_parents(path))
+
+    def status(self):
+        """
+        Describe every registered file.
+
+        Returns:
+        - pd.DataFrame: The path, version, number of columns, modification time, parents with the versions they were
+          computed from and whether it is stale, for every file that still exists.
+        """
+        with self.lock:
+            self.reload()
+            paths = sorted(self.entries)
+        rows = []
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            entry = self.fingerprint(path)
+            rows.append({
+                'Path': path,
+                'Version': entry['version'],
+                'Columns': len(entry['schema']),
+                'Modified': pd.Timestamp(entry.get('modified', 0), unit='s').floor('s'),
+                'Derived from': ', '.join(parent + ' ' + version for parent, version in sorted(entry['parents'].items())),
+                'Stale': self.is_stale(path)
+            })
+        return pd.DataFrame(rows, columns=['Path', 'Version', 'Columns', 'Modified', 'Derived from', 'Stale'])
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Get the registry of this process, loading it on first use.
+
+    Returns:
+    - Registry: The registry stored at REGISTRY_PATH.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = Registry()
+        return _registry
+
+
+def version(path):
+    """
+    Get the current version of a file or directory (see Registry.fingerprint).
+
+    Parameters:
+    - path (str): The path of the file or directory.
+
+    Returns:
+    - str: The version.
+    """
+    return get_registry().version(path)
+
+
+def builder_version(func, args, kwargs, version):
+    """
+    Get the version of the inputs of a call of a figure builder.
+
+    Builders that read files besides the loaded data (see FILE_INPUTS) depend on the versions of those files only, so
+    they are neither computed again when the data changes nor kept when the files change.
+
+    Parameters:
+    - func (callable): The figure builder.
+    - args (tuple): The positional arguments of the call.
+    - kwargs (dict): The keyword arguments of the call.
+    - version (str): The version of the loaded data.
+
+    Returns:
+    - str: The version the result of the call depends on.
+    """
+    inputs = FILE_INPUTS.get(func.__module__ + '.' + func.__qualname__)
+    if inputs is None:
+        return version
+    return ','.join(get_registry().version(path) if os.path.exists(path) else 'missing'
+                    for path in inputs(*args, **kwargs))
@@ -0,0 +1,299 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import actor_engagement, clustering, cohorts, course_popularity, early_warning, figure_cache, forecasting, \
+    linear_regression, network_analysis, process_mining, query_backend, sessions, time_series, verbs, versioning
+
+DEFAULT_WORKERS = int(os.environ.get('ILEDA_WARMUP_WORKERS', 2))
+VISITS_PATH = os.environ.get('ILEDA_VISITS_PATH', 'data/visits.json')
+VISITS_FLUSH_SECONDS = float(os.environ.get('ILEDA_VISITS_FLUSH_SECONDS', 30))
+TIME_SERIES_METRICS = ['assessments', 'non_assessments', 'total', 'both']
+
+
+class VisitCounter:
+    """
+    A thread-safe counter of page visits per selection, persisted as JSON.
+
+    Visits are counted in memory and added to the file by a background thread every flush_seconds and when the
+    process exits, so recording a visit never waits for the disk, and the processes sharing the file (the dashboard
+    and the compute backend) add up their counts instead of overwriting each other's.
+    """
+
+    def __init__(self, path=VISITS_PATH, flush_seconds=VISITS_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._counts = self.read()
+        self._pending = Counter()
+        self._flusher = None
+
+    def read(self):
+        """
+        Read the counts of the file.
+
+        Returns:
+        - Counter: The visits per page and selection, none if the file is missing or cannot be read.
+        """
+        try:
+            with open(self.path) as file:
+                return Counter({tuple(key.split('|', 1)): int(count) for key, count in json.load(file).items()})
+        except (OSError, ValueError, TypeError, AttributeError):
+            return Counter()
+
+    def record(self, page, selection):
+        """
+        Record a visit of a page with a given selection.
+
+        Parameters:
+        - page (str): The name of the page.
+        - selection (str): The selected course or institution.
+        """
+        with self._lock:
+            self._counts[(page, str(selection))] += 1
+            self._pending[(page, str(selection))] += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='visits', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        """
+        Add the visits recorded since the last flush to the file, replacing it at once, and read the visits recorded by
+        the other processes.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+
+        try:
+            with versioning.file_lock(self.path + '.lock'):
+                counts = self.read() + pending
+                temporary = self.path + '.' + str(os.getpid()) + '.tmp'
+                with open(temporary, 'w') as file:
+                    json.dump({key[0] + '|' + key[1]: count for key, count in counts.items()}, file)
+                os.replace(temporary, self.path)
+        except OSError:
+            with self._lock:
+                self._pending.update(pending)
+            return
+
+        with self._lock:
+            self._counts = counts + self._pending
+
+    def get(self, page, selection):
+        """
+        Get the number of visits of a page with a given selection.
+
+        Parameters:
+        - page (str): The name of the page.
+        - selection (str): The selected course or institution.
+
+        Returns:
+        - int: The number of recorded visits.
+        """
+        with self._lock:
+            return self._counts[(page, str(selection))]
+
+
+visits = VisitCounter()
+
+
+def page_tasks(df, visit_counter=None):
+    """
+    List the figure builder calls made by the pages with their default widget values, most visited first.
+
+    Page-wide figures come first, followed by the per-course and per-institution figures shown with the default
+    widget values and finally the other variants, each group ordered by recorded visits and then by event count.
+
+    Parameters:
+    - df (pd.DataFrame or QueryBackend): The DataFrame containing interaction data.
+    - visit_counter (VisitCounter, optional): The visit counts used for the priority. Default is visits.
+
+    Returns:
+    - List[Tuple[str, callable, tuple]]: A description, the builder and its arguments for each call.
+    """
+    visit_counter = visits if visit_counter is None else visit_counter
+    tasks = [
+        ('Verbs (lollipop)', verbs.get_verb_lollipop, (df,)),
+        ('Verbs (radar per course)', verbs.get_verb_radar_course, (df,)),
+        ('Verbs (radar per verb)', verbs.get_verb_radar_verb, (df,)),
+        ('Course popularity (pie)', course_popularity.get_interaction_pie, (df, False)),
+        ('Course popularity (boxplot)', course_popularity.get_interaction_boxplot, (df, False)),
+        ('Course popularity (scatter)', course_popularity.get_median_scatter, (df, False)),
+        ('Network analysis', network_analysis.get_network, (df, list(network_analysis.SANKEY_LEVELS), 10)),
+        ('Predict score', linear_regression.regression, (df,)),
+        ('Predict score (streaming)', linear_regression.streaming_regression, (df,)),
+        ('Forecast', forecasting.next_week, (df,)),
+        ('Process mining', process_mining.display, (df, 'verb.id')),
+        ('Cohort comparison', cohorts.display,
+         (df, {'Teaching': 'Flipped classroom'}, {'Teaching': 'Project-based'}, cohorts.DEFAULT_RESAMPLES)),
+    ]
+
+    selections = []
+    backend = query_backend.get_backend(df)
+    for column in ['Course', 'Institution']:
+        for name, events in backend.count([column]).dropna().itertuples(index=False, name=None):
+            selections.append((
+                (True, visit_counter.get('Student engagement', name), events),
+                (name + ' (engagement)', actor_engagement.display, (df, name))
+            ))
+            selections.append((
+                (True, visit_counter.get('Student engagement', name), events),
+                (name + ' (sessions)', sessions.display, (df, name))
+            ))
+            selections.append((
+                (True, visit_counter.get('Student engagement', name), events),
+                (name + ' (early warning)', early_warning.display, (df, name))
+            ))
+
+            if column == 'Institution':
+                continue
+
+            selections.append((
+                (True, visit_counter.get('Cluster analysis', name), events),
+                (name + ' (clusters)', clustering.cluster, (name, 3))
+            ))
+
+            for metric in TIME_SERIES_METRICS:
+                priority = (metric == TIME_SERIES_METRICS[0], visit_counter.get('Time series', name), events)
+                selections.append((
+                    priority,
+                    (name + ' (autocorrelation, ' + metric + ')', time_series.analyze_time_series, (df, name, metric))
+                ))
+                selections.append((
+                    priority,
+                    (name + ' (timeline, ' + metric + ')', time_series.display_course_or_institution_actions,
+                     (df, name, metric))
+                ))
+                selections.append((
+                    priority,
+                    (name + ' (forecast, ' + metric + ')', forecasting.display, (df, name, metric))
+                ))
+
+    selections.sort(key=lambda selection: selection[0], reverse=True)
+    return tasks + [task for _, task in selections]
+
+
+class WarmupScheduler:
+    """
+    Precompute figure builder calls into the shared figure cache on a bounded thread pool.
+    """
+
+    def __init__(self, tasks, version, max_workers=DEFAULT_WORKERS, cache=None):
+        self.tasks = tasks
+        self.version = version
+        self.max_workers = max_workers
+        self.cache = cache
+        self.done = 0
+        self.errors = []
+        self.running = set()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def start(self):
+        """
+        Submit every task in priority order. Does nothing if the pool size is zero.
+
+        Returns:
+        - WarmupScheduler: The scheduler itself.
+        """
+        self.started_at = time.time()
+        if self.max_workers <= 0 or not self.tasks:
+            self.finished_at = self.started_at
+            return self
+
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='warmup')
+        for task in self.tasks:
+            self._executor.submit(self._run, task)
+        return self
+
+    def cancel(self):
+        """
+        Drop the tasks that have not started yet.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, task):
+        description, func, args = task
+        with self._lock:
+            self.running.add(description)
+
+        try:
+            figure_cache.cached(func, *args, version=self.version, cache=self.cache)
+        except Exception as error:
+            with self._lock:
+                self.errors.append((description, repr(error)))
+        finally:
+            with self._lock:
+                self.running.discard(description)
+                self.done += 1
+                if self.done == len(self.tasks):
+                    self.finished_at = time.time()
+
+    def status(self):
+        """
+        Get the progress of the warm-up.
+
+        Returns:
+        - dict: The data version, the number of tasks, completed tasks, the running tasks, the errors and the
+          elapsed time in seconds.
+        """
+        with self._lock:
+            end = self.finished_at if self.finished_at is not None else time.time()
+            return {
+                'version': self.version,
+                'total': len(self.tasks),
+                'done': self.done,
+                'running': sorted(self.running),
+                'errors': list(self.errors),
+                'elapsed': 0.0 if self.started_at is None else end - self.started_at,
+                'finished': self.finished_at is not None
+            }
+
+
+_current = None
+_current_lock = threading.Lock()
+
+
+def start(tasks, version, max_workers=DEFAULT_WORKERS):
+    """
+    Start warming up the caches for a data version, cancelling the warm-up of the previous version.
+
+    Parameters:
+    - tasks (List[Tuple[str, callable, tuple]]): The calls to precompute, as returned by page_tasks.
+    - version (str): The data version the calls depend on.
+    - max_workers (int): The size of the thread pool. Default is ILEDA_WARMUP_WORKERS or 2.
+
+    Returns:
+    - WarmupScheduler: The started scheduler.
+    """
+    global _current
+    with _current_lock:
+        if _current is not None:
+            _current.cancel()
+        _current = WarmupScheduler(tasks, version, max_workers).start()
+        return _current
+
+
+def current():
+    """
+    Get the scheduler of the latest warm-up.
+
+    Returns:
+    - WarmupScheduler or None: The scheduler, or None if no warm-up has been started.
+    """
+    return _current